@@ -0,0 +1,109 @@
+"""Concurrent ingestion engine for ``etl.run(mode="async")``.
+
+Fetches run in a bounded pool of worker threads (the HTTP client and the rate
+limiter are blocking), and a single writer task drains a queue of normalized
+symbols, bulk-loading several symbols per COPY on one long-lived connection.
+Downloads for the next symbols therefore overlap with the database work for
+the previous ones.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Dict, List, Tuple
+
+import psycopg2
+
+from app import bulkload, columnar, etl, spool
+
+
+_DONE = object()
+
+
+def _write_batch(sink: bulkload.BulkWriter, batch: List[Tuple[str, columnar.Bars, int]]) -> Dict[str, Dict]:
+    written: Dict[str, Dict] = {}
+    for symbol, rows, skipped in batch:
+        bulkload.combine_results(written, sink.add(symbol, rows, skipped))
+    bulkload.combine_results(written, sink.flush())
+    return written
+
+
+async def _run(cfg: Dict) -> Dict[str, Dict]:
+    loop = asyncio.get_running_loop()
+    concurrency = max(1, cfg["fetch_concurrency"])
+    executor = ThreadPoolExecutor(max_workers=concurrency + 1, thread_name_prefix="etl")
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    slots = asyncio.Semaphore(concurrency)
+    results: Dict[str, Dict] = {}
+    marks = await loop.run_in_executor(executor, etl.load_watermarks, cfg)
+
+    stop = threading.Event()
+
+    def put(item) -> None:
+        # Called from fetch threads; the timeout lets them give up if the run is aborted.
+        while not stop.is_set():
+            fut = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            try:
+                return fut.result(timeout=1)
+            except FutureTimeout:
+                fut.cancel()
+        raise RuntimeError("ingestion run aborted")
+
+    def produce(symbol: str) -> None:
+        # Streamed symbols produce one queue item per batch, so the writer
+        # starts on a long history before its download has finished.
+        for rows, skipped in etl.iter_new_rows(cfg, symbol, marks.get(symbol)):
+            put((symbol, rows, skipped))
+
+    async def fetcher(symbol: str) -> None:
+        async with slots:
+            try:
+                await loop.run_in_executor(executor, produce, symbol)
+            except Exception as e:
+                etl.record_results(results, {symbol: {"status": "error", "error": str(e)}})
+
+    async def writer() -> None:
+        sink = bulkload.BulkWriter(
+            lambda: psycopg2.connect(**cfg["pg"]), bulkload.PRICES, cfg["write_batch_rows"], etl.PRICE_STAGES,
+            spool.for_target(bulkload.PRICES),
+        )
+        try:
+            finished = False
+            while not finished:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                batch = [item]
+                batch_rows = len(item[1])
+                while batch_rows < cfg["write_batch_rows"] and not queue.empty():
+                    nxt = queue.get_nowait()
+                    if nxt is _DONE:
+                        finished = True
+                        break
+                    batch.append(nxt)
+                    batch_rows += len(nxt[1])
+                etl.record_results(results, await loop.run_in_executor(executor, _write_batch, sink, batch))
+        finally:
+            await loop.run_in_executor(executor, sink.close)
+
+    try:
+        writer_task = asyncio.create_task(writer())
+        fetchers = asyncio.gather(*(fetcher(sym) for sym in cfg["symbols"]))
+        done, _ = await asyncio.wait({writer_task, fetchers}, return_when=asyncio.FIRST_COMPLETED)
+        if writer_task in done:
+            # The writer only finishes early if it crashed; stop fetching and
+            # surface its error.
+            fetchers.cancel()
+            writer_task.result()
+        await fetchers
+        await queue.put(_DONE)
+        await writer_task
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {sym: results[sym] for sym in cfg["symbols"] if sym in results}
+
+
+def run(cfg: Dict) -> Dict[str, Dict]:
+    return asyncio.run(_run(cfg))
@@ -0,0 +1,212 @@
+"""Resumable historical backfill of intraday bars.
+
+A single ``TIME_SERIES_INTRADAY`` call only returns the latest window, so
+history is loaded one ``(symbol, month)`` slice at a time with the provider's
+``month=YYYY-MM`` parameter. Slices run in a thread pool. Every fetch goes
+through the shared rate limiter, so the pool never exceeds the provider
+budget however many workers it has.
+
+Progress lives in ``backfill_checkpoints``. A slice's rows and its ``done``
+checkpoint commit in the same transaction, so an interrupted job resumes
+with exactly the slices that have not landed.
+
+Slices only refresh ``latest_quotes`` and announce their changes. Rollups,
+indicators, quality checks and resampled series depend on the bars around a
+slice, so rebuilding them per slice would redo each symbol's history once per
+month and leave the result to whichever slice committed last. They are
+derived once per symbol over the job's whole range after the pool drains,
+and a ``derived`` checkpoint keeps a resumed job from skipping them::
+
+    python -m app.backfill --symbols AAPL,MSFT --start 2022-01 --end 2024-06
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+import psycopg2
+
+from app import bulkload, columnar, etl, indicators, latest, metrics, notify, partitions, quality, resample, rollups
+
+
+CHECKPOINTS_DDL = """
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    job TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    slice TEXT NOT NULL,
+    status TEXT NOT NULL,
+    rows INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (job, symbol, slice)
+);
+"""
+
+_CHECKPOINT_SQL = """
+INSERT INTO backfill_checkpoints (job, symbol, slice, status, rows, error, updated_at)
+VALUES (%s, %s, %s, %s, %s, %s, now())
+ON CONFLICT (job, symbol, slice) DO UPDATE
+SET status = EXCLUDED.status, rows = EXCLUDED.rows, error = EXCLUDED.error, updated_at = now()
+"""
+
+DERIVED = "derived"  # checkpoint slice of a symbol whose derived tables are up to date
+# Merged in every slice's transaction; the rest of etl.PRICE_STAGES runs once per job.
+SLICE_STAGES = (latest.stage_for(bulkload.PRICES), notify.stage_for(bulkload.PRICES))
+JOB_STAGES = notify.inline((
+    rollups.after_merge,
+    indicators.stage_for(etl.INTRADAY_BAR),
+    quality.stage_for(bulkload.PRICES, etl.INTRADAY_BAR),
+    resample.stage_for(bulkload.PRICES, etl.INTRADAY_BAR),
+))
+
+
+def parse_month(value: str) -> date:
+    return date.fromisoformat(f"{value[:7]}-01")
+
+
+def months(start: date, end: date) -> List[str]:
+    """``YYYY-MM`` for every month from ``start`` to ``end`` inclusive, newest first."""
+    out = []
+    y, m = end.year, end.month
+    while (y, m) >= (start.year, start.month):
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y, m - 1) if m > 1 else (y - 1, 12)
+    return out
+
+
+def slices(symbols: List[str], start: date, end: date) -> List[Tuple[str, str]]:
+    # Newest months first: recent history is the most useful if a job is cut short.
+    return [(sym, month) for month in months(start, end) for sym in symbols]
+
+
+def default_job(symbols: List[str], start: date, end: date) -> str:
+    return f"{start:%Y-%m}..{end:%Y-%m}:{','.join(sorted(symbols))}"
+
+
+def completed(conn, job: str) -> set:
+    with conn, conn.cursor() as cur:
+        cur.execute(CHECKPOINTS_DDL)
+        cur.execute("SELECT symbol, slice FROM backfill_checkpoints WHERE job = %s AND status = 'done'", (job,))
+        return set(cur.fetchall())
+
+
+def _load_slice(cfg: Dict, job: str, symbol: str, month: str) -> Tuple[int, tuple | None]:
+    """Load one slice; returns ``(rows, (first, last) | None)`` with the range of bars that changed."""
+    series = etl.fetch_intraday_series(
+        symbol=symbol,
+        api_key=cfg["alpha_vantage_key"],
+        timeout=cfg["timeout"],
+        retries=cfg["retries"],
+        outputsize="full",
+        month=month,
+    )
+    bars = columnar.from_series(series, columnar.INTRADAY_FIELDS)
+    merged = {}
+    conn = psycopg2.connect(**cfg["pg"])
+    try:
+        with metrics.timer("transaction", table=bulkload.PRICES.table), conn, conn.cursor() as cur:
+            if len(bars):
+                bulkload.copy_bars_into_stage(cur, bulkload.PRICES, [(symbol, bars)])
+                merged = bulkload.merge_stage(cur, bulkload.PRICES, SLICE_STAGES)
+            cur.execute(_CHECKPOINT_SQL, (job, symbol, month, "done", len(bars), None))
+    finally:
+        conn.close()
+    m = merged.get(symbol)
+    return len(bars), (m["first"], m["last"]) if m else None
+
+
+def _derive(cfg: Dict, job: str, symbols: List[str], start: date, end: date, touched: Dict[str, tuple]) -> None:
+    """Run ``JOB_STAGES`` for ``symbols`` in one transaction and checkpoint them.
+
+    Each symbol's range spans the job's months and whatever its slices changed
+    outside them (providers pad a month with neighbouring bars).
+    """
+    first = datetime(start.year, start.month, 1)
+    last = datetime(end.year + end.month // 12, end.month % 12 + 1, 1) - timedelta(microseconds=1)
+    merged = {}
+    for sym in symbols:
+        lo, hi = touched.get(sym, (first, last))
+        merged[sym] = {"new": 0, "changed": 0, "first": min(first, lo), "last": max(last, hi)}
+    conn = psycopg2.connect(**cfg["pg"])
+    try:
+        with metrics.timer("transaction", table=bulkload.PRICES.table), conn, conn.cursor() as cur:
+            for stage in JOB_STAGES:
+                with metrics.timer("derive", step=stage.__module__.rsplit(".", 1)[-1]):
+                    stage(cur, merged)
+            for sym in symbols:
+                cur.execute(_CHECKPOINT_SQL, (job, sym, DERIVED, "done", 0, None))
+    finally:
+        conn.close()
+
+
+def _record_failure(cfg: Dict, job: str, symbol: str, month: str, error: str) -> None:
+    conn = psycopg2.connect(**cfg["pg"])
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(_CHECKPOINT_SQL, (job, symbol, month, "error", 0, error[:2000]))
+    finally:
+        conn.close()
+
+
+def run(symbols: List[str], start: date, end: date, job: str | None = None, workers: int = 4) -> Dict[str, int]:
+    """Backfill ``symbols`` over ``[start, end]``; returns slice counts by outcome."""
+    cfg = etl.load_settings()
+    symbols = [s.strip().upper() for s in symbols if s.strip()]
+    job = job or default_job(symbols, start, end)
+
+    conn = psycopg2.connect(**cfg["pg"])
+    try:
+        done = completed(conn, job)
+        # Give historical months their own partitions instead of filling the default one.
+        partitions.ensure_range(conn, bulkload.PRICES.table, start, end)
+    finally:
+        conn.close()
+    todo = [s for s in slices(symbols, start, end) if s not in done]
+    loaded = [s for s in done if s[1] != DERIVED]
+    print(f"[ETL] backfill {job}: {len(todo)} slices to load, {len(loaded)} already done")
+
+    summary = {"done": 0, "failed": 0, "skipped": len(loaded), "rows": 0}
+    failed = set()
+    touched: Dict[str, tuple] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backfill") as pool:
+        futures = {pool.submit(_load_slice, cfg, job, sym, month): (sym, month) for sym, month in todo}
+        for fut in as_completed(futures):
+            sym, month = futures[fut]
+            try:
+                rows, span = fut.result()
+            except Exception as e:
+                print(f"[ETL] backfill {sym} {month} failed: {e}")
+                _record_failure(cfg, job, sym, month, str(e))
+                summary["failed"] += 1
+                failed.add(sym)
+                continue
+            print(f"[ETL] backfill {sym} {month}: {rows} rows")
+            summary["done"] += 1
+            summary["rows"] += rows
+            if span:
+                lo, hi = touched.get(sym, span)
+                touched[sym] = (min(lo, span[0]), max(hi, span[1]))
+    # Symbols with failed slices wait for the run that completes them.
+    pending = [sym for sym in symbols if sym not in failed and (sym, DERIVED) not in done]
+    if pending:
+        _derive(cfg, job, pending, start, end, touched)
+        print(f"[ETL] backfill {job}: derived tables refreshed for {len(pending)} symbols")
+    print(f"[ETL] backfill {job} finished: {summary}")
+    metrics.export("backfill")
+    return summary
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Backfill intraday history month by month.")
+    parser.add_argument("--symbols", required=True, help="comma-separated symbols")
+    parser.add_argument("--start", required=True, help="first month, YYYY-MM")
+    parser.add_argument("--end", default=date.today().strftime("%Y-%m"), help="last month, YYYY-MM (default: this month)")
+    parser.add_argument("--job", help="checkpoint job name (default: derived from the arguments)")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+    summary = run(args.symbols.split(","), parse_month(args.start), parse_month(args.end), args.job, args.workers)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,436 @@
+"""COPY-based bulk loading shared by every upsert path.
+
+Rows are streamed with ``COPY ... FROM STDIN`` into a temporary staging table
+and merged into the target with one ``INSERT ... ON CONFLICT`` statement, so a
+write costs a handful of round trips no matter how many rows or symbols it
+carries. ``BulkWriter`` accumulates rows from many symbols and flushes them in
+a single COPY. Columnar ``Bars`` batches are sent in binary COPY format
+straight from their NumPy arrays.
+"""
+import io
+import math
+import struct
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from app import columnar, metrics
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str
+    table: str
+    key: Tuple[str, ...]
+    columns: Tuple[Tuple[str, str], ...]
+    touch_column: str | None = None
+    # Extra condition on the existing row (alias ``t``) for an update to apply.
+    update_when: str | None = None
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c for c, _ in self.columns]
+
+
+_OHLC = (
+    ("open", "DOUBLE PRECISION"),
+    ("high", "DOUBLE PRECISION"),
+    ("low", "DOUBLE PRECISION"),
+    ("close", "DOUBLE PRECISION"),
+)
+
+# etl.py rows: (symbol, ts, open, high, low, close, volume)
+PRICES = Target(
+    name="prices",
+    table="stock_prices",
+    key=("symbol", "ts"),
+    columns=(("symbol", "TEXT"), ("ts", "TIMESTAMP")) + _OHLC + (("volume", "BIGINT"),),
+)
+
+# app/fetch_and_upsert.py rows: (symbol, ts, open, high, low, close, adjusted_close, volume)
+PRICES_ADJUSTED = Target(
+    name="prices_adjusted",
+    table="stock_prices",
+    key=("symbol", "ts"),
+    columns=(("symbol", "TEXT"), ("ts", "TIMESTAMP")) + _OHLC
+    + (("adjusted_close", "DOUBLE PRECISION"), ("volume", "BIGINT")),
+)
+
+# python-worker rows: (symbol, date, open, high, low, close, adjusted_close, volume)
+DAILY = Target(
+    name="daily",
+    table="stocks",
+    key=("symbol", "date"),
+    columns=(("symbol", "TEXT"), ("date", "DATE")) + _OHLC
+    + (("adjusted_close", "DOUBLE PRECISION"), ("volume", "BIGINT")),
+    touch_column="updated_at",
+)
+
+
+def _copy_text(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, float):
+        return "\\N" if math.isnan(value) else repr(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    text = str(value)
+    if any(ch in text for ch in "\\\t\n\r"):
+        text = text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return text
+
+
+class _CopyStream:
+    """File-like object that renders rows to COPY text lazily as psycopg2 reads it."""
+
+    def __init__(self, rows: Iterable[Sequence]):
+        self._lines = ("\t".join(_copy_text(v) for v in row) + "\n" for row in rows)
+        self._buf = ""
+        self.rows = 0
+
+    def read(self, size: int = -1) -> str:
+        parts = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            have += len(line)
+            self.rows += 1
+        data = "".join(parts)
+        if size < 0:
+            self._buf = ""
+            return data
+        self._buf = data[size:]
+        return data[:size]
+
+
+_EXISTING: set = set()
+
+
+def ensure_table(cur, table: str, ddl: str, column: str | None = None) -> None:
+    """Run ``ddl`` only while ``table`` (or its ``column``) is missing; once seen, later calls in this process are free.
+
+    Merge stages call this on every flush. ``CREATE ... IF NOT EXISTS`` is
+    not free even when the table exists: it takes locks and a catalog round
+    trip each time. ``column`` lets ``ddl`` upgrade tables created before
+    that column existed.
+    """
+    if table in _EXISTING:
+        return
+    if column is None:
+        cur.execute("SELECT to_regclass(%s)", (table,))
+    else:
+        cur.execute(
+            "SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped",
+            (table, column),
+        )
+    row = cur.fetchone()
+    if row is None or row[0] is None:
+        # Not remembered yet: the creating transaction may still roll back.
+        cur.execute(ddl)
+    else:
+        _EXISTING.add(table)
+
+
+def resolution(bar: timedelta) -> str:
+    """Name of a bar width as stored in ``resolution`` columns: ``5min``, ``60min``, ``1d``."""
+    minutes = int(bar.total_seconds() // 60)
+    return f"{minutes // 1440}d" if minutes % 1440 == 0 else f"{minutes}min"
+
+
+def stage_table(target: Target) -> str:
+    return f"_stage_{target.name}"
+
+
+def _ensure_stage(cur, target: Target) -> str:
+    stage = stage_table(target)
+    cols = ", ".join(f"{c} {t}" for c, t in target.columns)
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} ({cols}) ON COMMIT DELETE ROWS")
+    return stage
+
+
+def copy_into_stage(cur, target: Target, rows: Iterable[Sequence]) -> int:
+    stage = _ensure_stage(cur, target)
+    stream = _CopyStream(rows)
+    with metrics.timer("copy", table=target.table):
+        cur.copy_expert(f"COPY {stage} ({', '.join(target.column_names)}) FROM STDIN", stream, size=65536)
+    metrics.inc("rows_staged", stream.rows, table=target.table)
+    return stream.rows
+
+
+_PG_EPOCH_US = np.datetime64("2000-01-01T00:00:00", "us")
+_PG_EPOCH_DAY = np.datetime64("2000-01-01", "D")
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_BINARY_TRAILER = struct.pack("!h", -1)
+
+
+def _binary_rows(target: Target, symbol: str, bars: columnar.Bars) -> bytes:
+    """Encode one symbol's bars as binary COPY tuples via a packed big-endian record array."""
+    sym = symbol.encode()
+    fields = [("n", ">i2")]
+    values = {}
+    for i, (col, typ) in enumerate(target.columns):
+        if typ == "TEXT":
+            fields.append((f"l{i}", ">i4"))
+            fields.append((f"v{i}", f"S{len(sym)}"))
+            values[i] = (len(sym), sym)
+        elif typ == "TIMESTAMP":
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">i8")]
+            values[i] = (8, (bars.ts.astype("datetime64[us]") - _PG_EPOCH_US).astype(np.int64))
+        elif typ == "DATE":
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">i4")]
+            values[i] = (4, (bars.ts.astype("datetime64[D]") - _PG_EPOCH_DAY).astype(np.int32))
+        elif typ == "DOUBLE PRECISION":
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">f8")]
+            values[i] = (8, getattr(bars, col))
+        elif typ == "BIGINT":
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">i8")]
+            values[i] = (8, getattr(bars, col))
+        else:
+            raise RuntimeError(f"No binary COPY encoding for {col} {typ}")
+    out = np.empty(len(bars), dtype=fields)
+    out["n"] = len(target.columns)
+    for i, (size, val) in values.items():
+        out[f"l{i}"] = size
+        out[f"v{i}"] = val
+    return out.tobytes()
+
+
+def copy_bars_into_stage(cur, target: Target, chunks: Iterable[Tuple[str, columnar.Bars]]) -> int:
+    stage = _ensure_stage(cur, target)
+    buf = io.BytesIO()
+    buf.write(_BINARY_HEADER)
+    staged = 0
+    for symbol, bars in chunks:
+        buf.write(_binary_rows(target, symbol, bars))
+        staged += len(bars)
+    buf.write(_BINARY_TRAILER)
+    buf.seek(0)
+    with metrics.timer("copy", table=target.table):
+        cur.copy_expert(f"COPY {stage} ({', '.join(target.column_names)}) FROM STDIN WITH (FORMAT binary)", buf)
+    metrics.inc("rows_staged", staged, table=target.table)
+    return staged
+
+
+def _select_expr(col: str, typ: str) -> str:
+    if typ == "DOUBLE PRECISION":
+        return f"NULLIF({col}, 'NaN')"
+    if col == "volume":
+        return f"NULLIF({col}, {columnar.MISSING_VOLUME})"
+    return col
+
+
+def merge_sql(target: Target) -> str:
+    cols = target.column_names
+    key = ", ".join(target.key)
+    ts_col = target.key[1]
+    insert_cols = cols + ([target.touch_column] if target.touch_column else [])
+    select_cols = [_select_expr(c, t) for c, t in target.columns] + (["now()"] if target.touch_column else [])
+    values = [c for c in cols if c not in target.key]
+    updates = ",\n      ".join(f"{c} = EXCLUDED.{c}" for c in insert_cols if c not in target.key)
+    # DISTINCT ON keeps the last staged copy of a key: ON CONFLICT cannot touch
+    # the same target row twice within one statement. The IS DISTINCT FROM
+    # guard leaves identical rows alone, so re-delivered bars cost no WAL.
+    # NULLIF turns the NaN / MISSING_VOLUME placeholders of binary COPY into NULL.
+    # Inserts and updates are told apart by probing the target before the
+    # upsert (all CTEs share one snapshot); the usual xmax = 0 trick is not
+    # allowed in RETURNING on a partitioned table.
+    key_match = " AND ".join(f"e.{k} = m.{k}" for k in target.key)
+    guard = f"\n      AND ({target.update_when})" if target.update_when else ""
+    return f"""
+WITH existing AS (
+    SELECT {", ".join("e." + k for k in target.key)}
+    FROM {target.table} e
+    JOIN (SELECT DISTINCT {key} FROM {stage_table(target)}) s USING ({key})
+), merged AS (
+    INSERT INTO {target.table} AS t ({", ".join(insert_cols)})
+    SELECT DISTINCT ON ({key}) {", ".join(select_cols)}
+    FROM {stage_table(target)}
+    ORDER BY {key}, ctid DESC
+    ON CONFLICT ({key}) DO UPDATE SET
+      {updates}
+    WHERE ({", ".join("t." + c for c in values)}) IS DISTINCT FROM ({", ".join("EXCLUDED." + c for c in values)}){guard}
+    RETURNING t.symbol, t.{ts_col}
+)
+SELECT m.symbol, count(*) FILTER (WHERE e.{ts_col} IS NULL), count(*) FILTER (WHERE e.{ts_col} IS NOT NULL),
+       min(m.{ts_col}), max(m.{ts_col})
+FROM merged m
+LEFT JOIN existing e ON {key_match}
+GROUP BY m.symbol
+"""
+
+
+def merge_stage(cur, target: Target, stages: Sequence[Callable] = ()) -> Dict[str, Dict]:
+    """Merge the staging table into the target.
+
+    Returns ``{symbol: {"new", "changed", "first", "last"}}`` for symbols whose
+    rows were inserted or actually changed; untouched symbols are absent.
+    Each of ``stages`` is then called as ``stage(cur, merged)`` in the same
+    transaction, so derived tables commit (or roll back) with the rows.
+    """
+    with metrics.timer("merge", table=target.table):
+        cur.execute(merge_sql(target))
+    merged = {
+        sym: {"new": new, "changed": changed, "first": first, "last": last}
+        for sym, new, changed, first, last in cur.fetchall()
+    }
+    cur.execute(f"TRUNCATE {stage_table(target)}")
+    if merged:
+        for stage in stages:
+            with metrics.timer("derive", step=stage.__module__.rsplit(".", 1)[-1]):
+                stage(cur, merged)
+    return merged
+
+
+def copy_upsert(cur, target: Target, rows: Iterable[Sequence], stages: Sequence[Callable] = ()) -> int:
+    """Stage ``rows`` with COPY and merge them into ``target.table``; returns rows staged."""
+    staged = copy_into_stage(cur, target, rows)
+    if staged:
+        merge_stage(cur, target, stages)
+    return staged
+
+
+def combine_results(into: Dict[str, Dict], written: Dict[str, Dict]) -> None:
+    """Fold flush results into a run's per-symbol results, summing counts across flushes.
+
+    A symbol that failed in any flush stays failed.
+    """
+    for sym, res in written.items():
+        prev = into.get(sym)
+        if prev is None or res["status"] != "ok":
+            into[sym] = dict(res)
+        elif prev["status"] == "ok":
+            for k in ("rows", "new", "changed", "skipped"):
+                prev[k] = prev.get(k, 0) + res.get(k, 0)
+            if "spooled" in res:
+                prev["spooled"] = prev.get("spooled", 0) + res["spooled"]
+
+
+def copy_upsert_bars(
+    cur, target: Target, symbol: str, bars: columnar.Bars, stages: Sequence[Callable] = ()
+) -> int:
+    """Binary-COPY one symbol's ``Bars`` and merge them; returns rows staged."""
+    if not len(bars):
+        return 0
+    staged = copy_bars_into_stage(cur, target, [(symbol, bars)])
+    merge_stage(cur, target, stages)
+    return staged
+
+
+class BulkWriter:
+    """Buffers rows from many symbols and writes them with one COPY per flush.
+
+    Rows may be row tuples or ``columnar.Bars``; bars go through binary COPY
+    and tuples through text COPY into the same staging table and merge.
+
+    ``flush`` returns per-symbol results in the same shape as ``run_batch``,
+    extended with ``new``/``changed``/``skipped`` row counts. ``skipped``
+    covers rows dropped by the caller (passed to ``add``) plus rows that
+    matched what was already stored. A failed flush rolls back and marks
+    every symbol in it as failed. ``touched`` accumulates the time range of
+    committed changes per symbol for downstream stages; ``stages`` run inside
+    each flush transaction (see ``merge_stage``).
+
+    With a ``spool`` (``app.spool``), a flush that fails on the connection
+    or exceeds the spool's write timeout is appended to the spool instead.
+    Its symbols are reported as ``ok`` with a ``spooled`` bar count, and the
+    writer keeps spooling for as long as ``spool.blocked`` is set.
+    """
+
+    def __init__(
+        self, connect: Callable, target: Target, flush_rows: int = 50000, stages: Sequence[Callable] = (), spool=None
+    ):
+        self.connect = connect
+        self.target = target
+        self.flush_rows = flush_rows
+        self.stages = tuple(stages)
+        self.spool = spool
+        self.touched: Dict[str, Tuple] = {}
+        self._conn = None
+        self._pending: List[Tuple[str, List[Sequence], int]] = []
+        self._pending_rows = 0
+
+    def add(self, symbol: str, rows: List[Sequence], skipped: int = 0) -> Dict[str, Dict]:
+        self._pending.append((symbol, rows, skipped))
+        self._pending_rows += len(rows)
+        if self._pending_rows >= self.flush_rows:
+            return self.flush()
+        return {}
+
+    def flush(self) -> Dict[str, Dict]:
+        pending, self._pending, self._pending_rows = self._pending, [], 0
+        if not pending:
+            return {}
+        has_rows = any(len(rows) for _, rows, _ in pending)
+        if has_rows and self.spool is not None and self.spool.blocked:
+            return self._spool(pending, None)
+        merged: Dict[str, Dict] = {}
+        try:
+            if has_rows:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self.connect()
+                bars = [(sym, rows) for sym, rows, _ in pending if isinstance(rows, columnar.Bars) and len(rows)]
+                tuples = [rows for _, rows, _ in pending if not isinstance(rows, columnar.Bars) and rows]
+                with metrics.timer("transaction", table=self.target.table), self._conn:
+                    with self._conn.cursor() as cur:
+                        if self.spool is not None and self.spool.write_timeout > 0:
+                            cur.execute("SET LOCAL statement_timeout = %s", (int(self.spool.write_timeout * 1000),))
+                        staged = copy_bars_into_stage(cur, self.target, bars) if bars else 0
+                        if tuples:
+                            staged += copy_into_stage(cur, self.target, (row for rows in tuples for row in rows))
+                        if staged:
+                            merged = merge_stage(cur, self.target, self.stages)
+        except Exception as e:
+            if self.spool is not None and self.spool.transient(e):
+                return self._spool(pending, e)
+            return {sym: {"status": "error", "error": str(e)} for sym, _, _ in pending}
+
+        results: Dict[str, Dict] = {}
+        for sym, rows, skipped in pending:
+            m = merged.get(sym, {})
+            new, changed = m.get("new", 0), m.get("changed", 0)
+            prev = results.get(sym, {"rows": 0, "new": 0, "changed": 0, "skipped": 0})
+            results[sym] = {
+                "status": "ok",
+                "rows": prev["rows"] + len(rows),
+                "new": new,
+                "changed": changed,
+                "skipped": prev["skipped"] + skipped + len(rows),
+            }
+        for sym, res in results.items():
+            res["skipped"] -= res["new"] + res["changed"]
+            m = merged.get(sym)
+            if m:
+                first, last = self.touched.get(sym, (m["first"], m["last"]))
+                self.touched[sym] = (min(first, m["first"]), max(last, m["last"]))
+        return results
+
+    def _spool(self, pending: List[Tuple[str, List[Sequence], int]], error: Exception | None) -> Dict[str, Dict]:
+        try:
+            spooled = self.spool.append(pending)
+        except Exception as e:
+            return {sym: {"status": "error", "error": f"{error or 'spool blocked'}; spooling failed: {e}"} for sym, _, _ in pending}
+        if error is not None:
+            print(f"[SPOOL] {self.target.table} write failed, spooled {sum(spooled.values())} rows locally: {error}")
+        self.spool.blocked = True
+        results: Dict[str, Dict] = {}
+        for sym, rows, skipped in pending:
+            res = results.setdefault(sym, {"status": "ok", "rows": 0, "new": 0, "changed": 0, "skipped": 0})
+            res["rows"] += len(rows)
+            res["skipped"] += skipped
+            res["spooled"] = spooled.get(sym, 0)
+        return results
+
+    def close(self) -> Dict[str, Dict]:
+        try:
+            return self.flush()
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            if self.spool is not None:
+                self.spool.close()
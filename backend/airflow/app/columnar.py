@@ -0,0 +1,115 @@
+"""Columnar normalization of provider payloads into NumPy arrays.
+
+``from_series`` turns an Alpha Vantage ``Time Series (...)`` object into a
+``Bars`` batch (datetime64 timestamps, float64 prices, int64 volume) without
+building a dict or tuple per bar. Missing or unparsable prices become NaN and
+are written as NULL; bars without a timestamp or close are dropped.
+"""
+from dataclasses import dataclass
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+
+INTRADAY_FIELDS = {
+    "open": "1. open",
+    "high": "2. high",
+    "low": "3. low",
+    "close": "4. close",
+    "volume": "5. volume",
+}
+
+DAILY_ADJUSTED_FIELDS = {
+    "open": "1. open",
+    "high": "2. high",
+    "low": "3. low",
+    "close": "4. close",
+    "adjusted_close": "5. adjusted close",
+    "volume": "6. volume",
+}
+
+PRICE_COLUMNS = ("open", "high", "low", "close", "adjusted_close")
+
+# Binary COPY cannot express NULL in a fixed-width row, so a missing volume is
+# carried as -1 and turned back into NULL by the merge.
+MISSING_VOLUME = -1
+
+
+@dataclass
+class Bars:
+    ts: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    adjusted_close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def select(self, mask: np.ndarray) -> "Bars":
+        return Bars(**{name: getattr(self, name)[mask] for name in self.__dataclass_fields__})
+
+
+def parse_timestamps(values: Sequence[str]) -> np.ndarray:
+    """Parse ``YYYY-MM-DD[ HH:MM:SS]`` strings; unparsable entries become NaT."""
+    try:
+        return np.array(values, dtype="datetime64[s]")
+    except ValueError:
+        out = np.empty(len(values), dtype="datetime64[s]")
+        for i, v in enumerate(values):
+            try:
+                out[i] = np.datetime64(v, "s")
+            except ValueError:
+                out[i] = np.datetime64("NaT")
+        return out
+
+
+def parse_floats(values: Sequence) -> np.ndarray:
+    """Parse numeric strings in one C-level pass; None, "" and garbage become NaN."""
+    raw = np.array([v if v not in (None, "") else "nan" for v in values], dtype=str)
+    try:
+        return raw.astype(np.float64)
+    except ValueError:
+        out = np.full(len(raw), np.nan)
+        for i, v in enumerate(raw):
+            try:
+                out[i] = float(v)
+            except ValueError:
+                pass
+        return out
+
+
+def _volume(values: Sequence) -> np.ndarray:
+    vol = parse_floats(values)
+    return np.where(np.isnan(vol), MISSING_VOLUME, vol).astype(np.int64)
+
+
+def from_columns(ts: Sequence[str], columns: Dict[str, Sequence]) -> Bars:
+    """Build ``Bars`` from raw string columns keyed by OHLCV name, dropping unusable bars."""
+    n = len(ts)
+    prices = {name: parse_floats(columns[name]) if name in columns else np.full(n, np.nan) for name in PRICE_COLUMNS}
+    bars = Bars(
+        ts=parse_timestamps(ts),
+        volume=_volume(columns["volume"]) if "volume" in columns else np.full(n, MISSING_VOLUME, dtype=np.int64),
+        **prices,
+    )
+    return bars.select(~np.isnat(bars.ts) & ~np.isnan(bars.close))
+
+
+def from_series(series: Dict[str, Dict[str, str]], fields: Dict[str, str] = INTRADAY_FIELDS) -> Bars:
+    """Normalize an Alpha Vantage ``Time Series (...)`` mapping."""
+    values = list(series.values())
+    return from_columns(
+        list(series.keys()),
+        {name: [v.get(key) for v in values] for name, key in fields.items()},
+    )
+
+
+def from_pairs(pairs: Sequence[Tuple[str, Dict[str, str]]], fields: Dict[str, str] = INTRADAY_FIELDS) -> Bars:
+    """Like ``from_series`` for ``(timestamp, values)`` pairs from a streaming parser."""
+    return from_columns(
+        [ts for ts, _ in pairs],
+        {name: [v.get(key) for _, v in pairs] for name, key in fields.items()},
+    )
@@ -1,15 +1,13 @@
 import os 
 import time
 import json
-from typing import Dict, Iterable, List, Tuple
-from datetime import datetime, timezone
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+from datetime import datetime, timedelta, timezone
 import requests
 import psycopg2
-from psycopg2.extras import execute_values
-from airflow.providers.postgres.hooks.postgres import PostgresHook
-
-from airflow.models import DAG
 
+from app import bulkload, columnar, indicators, jsonstream, latest, metrics, notify, quality, ratelimit, resample, respcache, rollups, scheduler, spool, watermark
 
 
 
@@ -28,12 +26,16 @@ def load_settings() -> Dict:
             "dbname": _env("POSTGRES_DB", "stocks"),
             "user": _env("POSTGRES_USER", "admin"),
             "password": _env("POSTGRES_PASSWORD", "adminpassword"),
+            "connect_timeout": int(_env("POSTGRES_CONNECT_TIMEOUT_SEC", "10")),
         },
         "alpha_vantage_key": _env("ALPHA_VANTAGE_API_KEY"),
         "symbols": [s.strip().upper() for s in _env("SYMBOLS", "AAPL").split(",") if s.strip()],
-        "per_symbol_pause_sec": float(_env("AV_SYMBOL_SLEEP_SEC", "12")),
         "retries": int(_env("HTTP_RETRIES", "2")),
         "timeout": int(_env("HTTP_TIMEOUT_SEC", "30")),
+        "mode": _env("ETL_MODE", "sync").lower(),
+        "fetch_concurrency": int(_env("ETL_FETCH_CONCURRENCY", "4")),
+        "write_batch_rows": int(_env("ETL_WRITE_BATCH_ROWS", "5000")),
+        "stream_batch_rows": int(_env("STREAM_BATCH_ROWS", "0")),
     }
 
 
@@ -43,42 +45,147 @@ def _ts_to_utc(ts_string: str) -> datetime:
 
 
 
-def fetch_intraday_series(symbol: str, api_key: str, timeout: int, retries: int) -> Dict[str, Dict[str, str]]:
-    url = "https://www.alphavantage.co/query"
+# Alpha Vantage intraday interval: only the base series is fetched, the same
+# one app/fetch_and_upsert.py fetches (and caches under the same respcache key).
+# 15min/30min/60min and daily OHLCV are derived from it (app/resample.py).
+INTRADAY_INTERVAL = _env("ETL_INTERVAL", "5min").strip()
+if INTRADAY_INTERVAL not in ("1min", "5min"):
+    raise RuntimeError(
+        f"ETL_INTERVAL must be 1min or 5min, got {INTRADAY_INTERVAL!r}; "
+        "coarser bars are derived into price_rollups (RESAMPLE_INTERVALS)"
+    )
+INTRADAY_BAR = timedelta(minutes=int(INTRADAY_INTERVAL[:-3]))
+SERIES_KEY = f"Time Series ({INTRADAY_INTERVAL})"
+# Derived tables refreshed inside every stock_prices write transaction, which
+# then announces its changes to listeners (app/notify.py) when it commits.
+PRICE_STAGES = notify.inline((
+    rollups.after_merge,
+    latest.stage_for(bulkload.PRICES),
+    indicators.stage_for(INTRADAY_BAR),
+    quality.stage_for(bulkload.PRICES, INTRADAY_BAR),
+    resample.stage_for(bulkload.PRICES, INTRADAY_BAR),
+    notify.stage_for(bulkload.PRICES),
+))
+# Overridable so that benchmarks and tests can point at a stub server.
+ALPHA_VANTAGE_URL = _env("ALPHA_VANTAGE_URL", "https://www.alphavantage.co/query")
+
+
+def _intraday_params(symbol: str, api_key: str, outputsize: str, month: str | None = None) -> Dict[str, str]:
     params = {
         "function": "TIME_SERIES_INTRADAY",
         "symbol": symbol,
-        "interval": "60min",
+        "interval": INTRADAY_INTERVAL,
+        "outputsize": outputsize,
         "apikey": api_key,
     }
+    if month:
+        params["month"] = month
+    return params
+
+
+def _intraday_key(symbol: str, outputsize: str, month: str | None = None) -> respcache.Key:
+    interval = f"{INTRADAY_INTERVAL}@{month}" if month else INTRADAY_INTERVAL
+    return respcache.Key("alphavantage", "TIME_SERIES_INTRADAY", symbol, interval, outputsize)
+
+
+def _raise_for_notice(symbol: str, payload: Dict) -> None:
+    if "Note" in payload:
+        ratelimit.throttled("alphavantage")
+        raise RuntimeError(f"Alpha Vantage notice for {symbol}: {payload.get('Note')}")
+    if "Error Message" in payload:
+        raise RuntimeError(f"Alpha Vantage error for {symbol}: {payload.get('Error Message')}")
+
+
+def fetch_intraday_series(
+    symbol: str, api_key: str, timeout: int, retries: int, outputsize: str = "compact", month: str | None = None
+) -> Dict[str, Dict[str, str]]:
+    """Latest intraday bars, or a whole historical ``month`` (``YYYY-MM``) with ``outputsize="full"``."""
+    params = _intraday_params(symbol, api_key, outputsize, month)
+    key = _intraday_key(symbol, outputsize, month)
+    cache = respcache.get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        return json.loads(cached)[SERIES_KEY]
 
     last_err = None
     for attempt in range(retries + 1):
         try:
-            resp = requests.get(url, params=params, timeout=timeout)
-            resp.raise_for_status()
-            payload = resp.json()
-
-            if "Note" in payload:
-                raise RuntimeError(f"Alpha Vantage notice for {symbol}: {payload.get('Note')}")
-            if "Error Message" in payload:
-                raise RuntimeError(f"Alpha Vantage error for {symbol}: {payload.get('Error Message')}")
-
-            series = payload.get("Time Series (60min)")
+            ratelimit.acquire("alphavantage")
+            with metrics.timer("fetch", provider="alphavantage"):
+                resp = requests.get(ALPHA_VANTAGE_URL, params=params, timeout=timeout)
+                resp.raise_for_status()
+            metrics.inc("http_bytes", len(resp.content), provider="alphavantage")
+            with metrics.timer("parse", provider="alphavantage"):
+                payload = resp.json()
+            _raise_for_notice(symbol, payload)
+
+            series = payload.get(SERIES_KEY)
             if not isinstance(series, dict) or not series:
                 raise RuntimeError(f"No intraday data returned for {symbol}: {json.dumps(payload)[:500]}")
 
+            cache.put(key, resp.content)
             return series
 
+        except ratelimit.RateLimitExceeded:
+            raise
         except Exception as e:
             last_err = e
             if attempt < retries:
+                metrics.inc("http_retries", provider="alphavantage")
                 time.sleep(2 * (attempt + 1))
             else:
                 raise RuntimeError(f"Failed fetching {symbol} after {retries+1} attempts: {last_err}") from last_err
     return {}
 
 
+def iter_intraday_batches(
+    symbol: str, api_key: str, timeout: int, retries: int, outputsize: str, batch_rows: int
+) -> Iterator[columnar.Bars]:
+    """Stream the intraday series, yielding at most ``batch_rows`` bars at a time.
+
+    A retry after a mid-stream failure re-yields bars already delivered; the
+    upsert is idempotent, so they are simply skipped as unchanged.
+    """
+    params = _intraday_params(symbol, api_key, outputsize)
+    key = _intraday_key(symbol, outputsize)
+    cache = respcache.get_cache()
+
+    def batches(chunks: Iterable[bytes]) -> Iterator[columnar.Bars]:
+        members = jsonstream.iter_object_members(chunks, re.escape(SERIES_KEY))
+        for batch in jsonstream.batched(members, batch_rows):
+            with metrics.timer("parse", provider="alphavantage"):
+                bars = columnar.from_pairs(batch, columnar.INTRADAY_FIELDS)
+            yield bars
+
+    cached = cache.read(key)
+    if cached is not None:
+        yield from batches(cached)
+        return
+
+    for attempt in range(retries + 1):
+        try:
+            ratelimit.acquire("alphavantage")
+            with requests.get(ALPHA_VANTAGE_URL, params=params, timeout=timeout, stream=True) as resp, \
+                    cache.recording(key) as rec:
+                resp.raise_for_status()
+                yield from batches(rec.tee(metrics.counted(resp.iter_content(65536), provider="alphavantage")))
+            return
+
+        except ratelimit.RateLimitExceeded:
+            raise
+        except Exception as e:
+            if isinstance(e, jsonstream.SeriesNotFound) and isinstance(e.payload, dict):
+                try:
+                    _raise_for_notice(symbol, e.payload)
+                except RuntimeError as notice:
+                    e = notice
+            if attempt < retries:
+                metrics.inc("http_retries", provider="alphavantage")
+                time.sleep(2 * (attempt + 1))
+            else:
+                raise RuntimeError(f"Failed fetching {symbol} after {retries+1} attempts: {e}") from e
+
+
 def normalize_rows(series: Dict[str, Dict[str, str]]) -> List[Dict]:
     rows: List[Dict] = []
     for ts_str, vals in series.items():
@@ -99,18 +206,7 @@ def normalize_rows(series: Dict[str, Dict[str, str]]) -> List[Dict]:
 
 
 
-UPSERT_SQL = """
-INSERT INTO stock_prices (symbol, ts, open, high, low, close, volume)
-VALUES %s
-ON CONFLICT (symbol, ts) DO UPDATE SET
-  open = EXCLUDED.open,
-  high = EXCLUDED.high,
-  low = EXCLUDED.low,
-  close = EXCLUDED.close,
-  volume = EXCLUDED.volume;
-"""
-
-def _values_for_execute_values(symbol: str, rows: Iterable[Dict]) -> List[Tuple]:
+def price_tuples(symbol: str, rows: Iterable[Dict]) -> List[Tuple]:
     return [
         (
             symbol,
@@ -133,38 +229,131 @@ def upsert_prices(pg_cfg: Dict, symbol: str, rows: List[Dict]) -> None:
     try:
         with conn:
             with conn.cursor() as cur:
-                psycopg2.extras.execute_values(
-                    cur,
-                    UPSERT_SQL,
-                    _values_for_execute_values(symbol, rows),
-                    page_size=500,
-                )
+                bulkload.copy_upsert(cur, bulkload.PRICES, price_tuples(symbol, rows), PRICE_STAGES)
     finally:
         conn.close()
 
 
-
-def run() -> None:
-    cfg = load_settings()
-
-    for sym in cfg["symbols"]:
+def load_watermarks(cfg: Dict) -> Dict[str, datetime]:
+    try:
+        conn = psycopg2.connect(**cfg["pg"])
         try:
-            series = fetch_intraday_series(
-                symbol=sym,
-                api_key=cfg["alpha_vantage_key"],
-                timeout=cfg["timeout"],
-                retries=cfg["retries"],
+            # Open data-quality findings pull the watermark back so the fetch covers them again.
+            marks = watermark.load(conn, bulkload.PRICES, cfg["symbols"])
+            return quality.rewind(conn, bulkload.PRICES, INTRADAY_BAR, marks, cfg["symbols"])
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[ETL] Could not load watermarks, fetching full windows: {e}")
+        return {}
+
+
+def iter_new_rows(cfg: Dict, symbol: str, mark: datetime | None) -> Iterator[Tuple[columnar.Bars, int]]:
+    """Fetch ``symbol`` sized to its watermark; yields bars at/after it and the count dropped.
+
+    Yields once per symbol, or once per streamed batch when ``stream_batch_rows`` is set.
+    """
+    outputsize = watermark.output_size(mark, INTRADAY_BAR)
+    if cfg["stream_batch_rows"] > 0:
+        for bars in iter_intraday_batches(
+            symbol, cfg["alpha_vantage_key"], cfg["timeout"], cfg["retries"], outputsize, cfg["stream_batch_rows"]
+        ):
+            yield watermark.since(bars, mark)
+        return
+    series = fetch_intraday_series(
+        symbol=symbol,
+        api_key=cfg["alpha_vantage_key"],
+        timeout=cfg["timeout"],
+        retries=cfg["retries"],
+        outputsize=outputsize,
+    )
+    with metrics.timer("parse", provider="alphavantage"):
+        bars = columnar.from_series(series, columnar.INTRADAY_FIELDS)
+    yield watermark.since(bars, mark)
+
+
+def record_results(results: Dict[str, Dict], written: Dict[str, Dict]) -> None:
+    for sym, res in written.items():
+        if res["status"] == "ok" and res.get("spooled"):
+            print(f"[ETL] {sym}: {res['spooled']} rows spooled until the database is back")
+        elif res["status"] == "ok":
+            print(
+                f"[ETL] {sym}: {res['new']} new, {res['changed']} changed, {res['skipped']} skipped"
+                if res["rows"] or res["skipped"]
+                else f"[ETL] No rows to upsert for {sym}"
             )
-            rows = normalize_rows(series)
-            if rows:
-                upsert_prices(cfg["pg"], sym, rows)
-                print(f"[ETL] Upserted {len(rows)} rows for {sym}")
-            else:
-                print(f"[ETL] No rows to upsert for {sym}")
-        except Exception as e:
-            print(f"[ETL] {sym} failed: {e}")
+        else:
+            print(f"[ETL] {sym} failed: {res['error']}")
+    bulkload.combine_results(results, written)
 
-        time.sleep(cfg["per_symbol_pause_sec"])
+
+def select_symbols(cfg: Dict, mode: str | None = None) -> List[str]:
+    """``SYMBOLS``, or this run's plan from watchlists and holdings with ``SYMBOL_SOURCE=demand`` (app/scheduler.py)."""
+    per_call = 1
+    if (mode or cfg["mode"]).lower() == "quotes":
+        from app import quotes
+
+        per_call = quotes.get_provider(cfg).max_symbols
+    return scheduler.select(lambda: psycopg2.connect(**cfg["pg"]), bulkload.PRICES, cfg["symbols"], symbols_per_call=per_call)
+
+
+def run(mode: str | None = None, symbols: List[str] | None = None) -> metrics.RunResults:
+    """Ingest ``symbols`` (default: ``SYMBOLS``, or the scheduler's plan with ``SYMBOL_SOURCE=demand``).
+
+    Returns the per-symbol results; the run's metrics summary is on ``.report``.
+    """
+    cfg = load_settings()
+    mode = (mode or cfg["mode"]).lower()
+    if symbols is not None:
+        cfg["symbols"] = [s.strip().upper() for s in symbols if s.strip()]
+    else:
+        cfg["symbols"] = select_symbols(cfg, mode)
+
+    if mode == "async":
+        from app import async_engine
+
+        engine = async_engine.run
+    elif mode == "quotes":
+        from app import quotes
+
+        engine = quotes.run
+    elif mode == "sync":
+        engine = _run_sync
+    else:
+        raise RuntimeError(f"Unknown ETL mode: {mode}")
+
+    started = metrics.begin()
+    # Rows spooled by earlier runs are written first, so they cannot overwrite newer bars.
+    results: Dict[str, Dict] = {}
+    record_results(results, spool.replay(
+        bulkload.PRICES, lambda: psycopg2.connect(**cfg["pg"]), PRICE_STAGES, cfg["write_batch_rows"]
+    ))
+    bulkload.combine_results(results, engine(cfg))
+    results = metrics.RunResults({sym: results[sym] for sym in cfg["symbols"] if sym in results})
+    scheduler.record(lambda: psycopg2.connect(**cfg["pg"]), bulkload.PRICES, results)
+    results.report = started.report()
+    print(f"[ETL] run report: {json.dumps(results.report)}")
+    metrics.export("etl")
+    return results
+
+
+def _run_sync(cfg: Dict) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    marks = load_watermarks(cfg)
+    writer = bulkload.BulkWriter(
+        lambda: psycopg2.connect(**cfg["pg"]), bulkload.PRICES, cfg["write_batch_rows"], PRICE_STAGES,
+        spool.for_target(bulkload.PRICES),
+    )
+    try:
+        for sym in cfg["symbols"]:
+            try:
+                for rows, skipped in iter_new_rows(cfg, sym, marks.get(sym)):
+                    record_results(results, writer.add(sym, rows, skipped))
+            except Exception as e:
+                record_results(results, {sym: {"status": "error", "error": str(e)}})
+    finally:
+        record_results(results, writer.close())
+    return {sym: results[sym] for sym in cfg["symbols"] if sym in results}
 
 
 if __name__ == "__main__":
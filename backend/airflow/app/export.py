@@ -0,0 +1,366 @@
+"""Incremental columnar export of price history for analytics.
+
+Backtests and ad-hoc research scan years of bars. Run against ``stock_prices``
+and ``stocks``, they compete with the Go API. ``export`` appends newly
+ingested bars to column files outside Postgres, and ``Reader`` memory-maps
+them, so these scans never touch the database.
+
+Layout under ``<EXPORT_DIR>/<table>/``, one directory per symbol and month::
+
+    stock_prices/AAPL/2024-01/ts.i8         epoch seconds (TIMESTAMP, or DATE at midnight)
+                              open.f8 high.f8 low.f8 close.f8 adjusted_close.f8
+                              volume.i8     -1 where volume is NULL
+                              _rows         rows committed to the files above
+
+Columns are raw little-endian arrays, ``columnar.Bars`` on disk, sorted by
+``ts`` within a partition. A reader maps only the columns it touches and gets
+NumPy views without copying or parsing anything. The files are deliberately
+not compressed: compressed blocks cannot be memory-mapped. Expired database
+partitions (app/partitions.py) stay available here.
+
+The export is append-only and incremental. Each symbol's watermark is the
+newest ``ts`` already exported, and each run appends the bars after it that
+are older than ``EXPORT_SETTLE_SEC`` (default one day). Bar times are naive
+exchange time, so their age is measured against the clock in
+``SCHEDULER_EXCHANGE_TZ`` (default ``America/New_York``). The delay gives
+provisional quotes and data-quality refetches time to settle before a bar is
+frozen. The columns are written and fsynced first, then ``_rows`` is replaced
+atomically. Bytes past ``_rows`` left by an interrupted run are ignored by
+readers and truncated by the next append. Bars rewritten in Postgres after
+they were exported, and history backfilled behind the watermark, need
+``--rebuild`` for those symbols.
+
+    python -m app.export run [--tables stock_prices,stocks] [--symbols AAPL] [--rebuild]
+    python -m app.export status
+
+``EXPORT_DIR=`` (empty, the default) turns the export off.
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Sequence
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from app import bulkload, columnar, metrics
+
+
+COLUMNS = (
+    ("ts", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("adjusted_close", "<f8"),
+    ("volume", "<i8"),
+)
+TABLES = {t.table: t for t in (bulkload.PRICES_ADJUSTED, bulkload.DAILY)}
+
+# Distinct symbols by skipping along the (symbol, ts) primary key instead of scanning the table.
+_SYMBOLS_SQL = """
+WITH RECURSIVE s AS (
+    (SELECT symbol FROM {table} ORDER BY symbol LIMIT 1)
+    UNION ALL
+    SELECT (SELECT symbol FROM {table} WHERE symbol > s.symbol ORDER BY symbol LIMIT 1)
+    FROM s WHERE s.symbol IS NOT NULL
+)
+SELECT symbol FROM s WHERE symbol IS NOT NULL
+"""
+
+_ROWS_SQL = """
+SELECT t.symbol, t.{ts}, t.open::float8, t.high::float8, t.low::float8, t.close::float8,
+       t.adjusted_close::float8, t.volume
+FROM unnest(%(symbols)s::text[], %(marks)s::timestamp[]) AS m(symbol, mark)
+JOIN {table} t ON t.symbol = m.symbol
+ AND t.{ts} > coalesce(m.mark, '-infinity'::timestamp)
+ AND t.{ts} <= (now() AT TIME ZONE %(tz)s) - %(settle)s * interval '1 second'
+ORDER BY t.symbol, t.{ts}
+"""
+
+
+def _env(name: str, default: str) -> str:
+    val = os.getenv(name)
+    return default if val is None else val
+
+
+def export_dir() -> str:
+    return _env("EXPORT_DIR", "").strip()
+
+
+def _empty() -> columnar.Bars:
+    cols = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+    cols["ts"] = cols["ts"].view("datetime64[s]")
+    return columnar.Bars(**cols)
+
+
+class Partition:
+    """One symbol-month directory of column files."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _column(self, name: str, dtype: str) -> str:
+        return os.path.join(self.path, f"{name}.{dtype[1:]}")
+
+    def rows(self) -> int:
+        try:
+            with open(os.path.join(self.path, "_rows")) as fh:
+                return int(fh.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def bars(self) -> columnar.Bars:
+        """The committed rows as read-only memory-mapped columns (zero-copy)."""
+        n = self.rows()
+        if not n:
+            return _empty()
+        cols = {name: np.memmap(self._column(name, dtype), dtype=dtype, mode="r", shape=(n,)) for name, dtype in COLUMNS}
+        cols["ts"] = cols["ts"].view("datetime64[s]")
+        return columnar.Bars(**cols)
+
+    def last_ts(self) -> np.datetime64 | None:
+        n = self.rows()
+        return self.bars().ts[n - 1] if n else None
+
+    def append(self, bars: columnar.Bars) -> int:
+        if not len(bars):
+            return 0
+        os.makedirs(self.path, exist_ok=True)
+        committed = self.rows()
+        for name, dtype in COLUMNS:
+            values = getattr(bars, name)
+            if name == "ts":
+                values = values.astype("datetime64[s]").astype(np.int64)
+            with open(self._column(name, dtype), "ab") as fh:
+                fh.truncate(committed * np.dtype(dtype).itemsize)  # drop a torn append
+                fh.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                fh.flush()
+                os.fsync(fh.fileno())
+        tmp = os.path.join(self.path, f"_rows.{os.getpid()}.tmp")
+        with open(tmp, "w") as fh:
+            fh.write(str(committed + len(bars)))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, os.path.join(self.path, "_rows"))
+        return len(bars)
+
+
+class Reader:
+    """Memory-mapped range queries over an export, without Postgres.
+
+        reader = Reader("/data/export")
+        bars = reader.range("AAPL", "2024-01-01", "2024-04-01")
+        bars.close.mean()
+    """
+
+    def __init__(self, root: str | None = None, table: str = bulkload.PRICES.table):
+        root = root or export_dir()
+        if not root:
+            raise RuntimeError("No export directory: pass one or set EXPORT_DIR")
+        self.base = os.path.join(root, table)
+
+    def symbols(self) -> List[str]:
+        if not os.path.isdir(self.base):
+            return []
+        return sorted(
+            unquote(d) for d in os.listdir(self.base)
+            if not d.endswith(".old") and os.path.isdir(os.path.join(self.base, d))
+        )
+
+    def months(self, symbol: str) -> List[str]:
+        path = os.path.join(self.base, quote(symbol, safe=""))
+        if not os.path.isdir(path):
+            return []
+        return sorted(m for m in os.listdir(path) if len(m) == 7 and m[4] == "-")
+
+    def partition(self, symbol: str, month: str) -> Partition:
+        return Partition(os.path.join(self.base, quote(symbol, safe=""), month))
+
+    def iter_range(self, symbol: str, start=None, end=None) -> Iterator[columnar.Bars]:
+        """Zero-copy slices of each month partition with ``start <= ts < end`` (either bound optional)."""
+        lo = None if start is None else np.datetime64(start, "s")
+        hi = None if end is None else np.datetime64(end, "s")
+        for month in self.months(symbol):
+            first = np.datetime64(month, "M")
+            if (hi is not None and first >= hi) or (lo is not None and first + 1 <= lo):
+                continue
+            bars = self.partition(symbol, month).bars()
+            i = 0 if lo is None else int(np.searchsorted(bars.ts, lo, side="left"))
+            j = len(bars) if hi is None else int(np.searchsorted(bars.ts, hi, side="left"))
+            if j > i:
+                yield columnar.Bars(**{name: getattr(bars, name)[i:j] for name, _ in COLUMNS})
+
+    def range(self, symbol: str, start=None, end=None) -> columnar.Bars:
+        """Bars of ``symbol`` in ``[start, end)``: a view when they fall in one month, else one concatenated copy."""
+        parts = list(self.iter_range(symbol, start, end))
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return _empty()
+        return columnar.Bars(**{name: np.concatenate([getattr(p, name) for p in parts]) for name, _ in COLUMNS})
+
+    def marks(self) -> Dict[str, datetime]:
+        """Newest exported ``ts`` per symbol: the export watermark."""
+        out = {}
+        for sym in self.symbols():
+            for month in reversed(self.months(sym)):
+                last = self.partition(sym, month).last_ts()
+                if last is not None:
+                    out[sym] = last.astype(datetime)
+                    break
+        return out
+
+
+@contextmanager
+def _locked(base: str) -> Iterator[None]:
+    os.makedirs(base, exist_ok=True)
+    with open(os.path.join(base, "export.lock"), "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _to_bars(rows: Sequence[tuple]) -> columnar.Bars:
+    def floats(i: int) -> np.ndarray:
+        return np.array([np.nan if r[i] is None else r[i] for r in rows], dtype=np.float64)
+
+    return columnar.Bars(
+        ts=np.array([r[1] for r in rows], dtype="datetime64[s]"),
+        open=floats(2), high=floats(3), low=floats(4), close=floats(5), adjusted_close=floats(6),
+        volume=np.array([columnar.MISSING_VOLUME if r[7] is None else r[7] for r in rows], dtype=np.int64),
+    )
+
+
+def _append(reader: Reader, rows: Sequence[tuple], written: Dict[str, int]) -> None:
+    bars = _to_bars(rows)
+    sym = np.array([r[0] for r in rows], dtype=object)
+    month = bars.ts.astype("datetime64[M]")
+    bounds = np.flatnonzero(np.r_[True, (sym[1:] != sym[:-1]) | (month[1:] != month[:-1]), True])
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        part = reader.partition(sym[lo], str(month[lo]))
+        chunk = columnar.Bars(**{name: getattr(bars, name)[lo:hi] for name, _ in COLUMNS})
+        written[sym[lo]] = written.get(sym[lo], 0) + part.append(chunk)
+
+
+def export(
+    connect: Callable,
+    table: str = bulkload.PRICES.table,
+    root: str | None = None,
+    symbols: Sequence[str] | None = None,
+    rebuild: bool = False,
+    batch_rows: int = 100_000,
+) -> Dict[str, int]:
+    """Append ``table``'s bars after each symbol's export watermark; returns rows written per symbol."""
+    target = TABLES[table]
+    reader = Reader(root, table)
+    settle = float(_env("EXPORT_SETTLE_SEC", "86400"))
+    tz = _env("SCHEDULER_EXCHANGE_TZ", "").strip() or "America/New_York"
+    written: Dict[str, int] = {}
+    with _locked(reader.base):
+        conn = connect()
+        try:
+            if symbols is None:
+                with conn.cursor() as cur:
+                    cur.execute(_SYMBOLS_SQL.format(table=table))
+                    symbols = [r[0] for r in cur.fetchall()]
+            symbols = sorted({s.strip().upper() for s in symbols if s.strip()})
+            if rebuild:
+                for sym in symbols:
+                    path = os.path.join(reader.base, quote(sym, safe=""))
+                    if os.path.isdir(path):
+                        # Open readers keep their mappings of the old files.
+                        trash = f"{path}.{time.time_ns()}.old"
+                        os.replace(path, trash)
+                        shutil.rmtree(trash, ignore_errors=True)
+            marks = reader.marks()
+            # A named cursor streams the rows instead of loading a first full export into memory.
+            with metrics.timer("export", table=table), conn.cursor(name="export_rows") as cur:
+                cur.itersize = batch_rows
+                cur.execute(
+                    _ROWS_SQL.format(table=table, ts=target.key[1]),
+                    {"symbols": symbols, "marks": [marks.get(s) for s in symbols], "settle": settle, "tz": tz},
+                )
+                while True:
+                    rows = cur.fetchmany(batch_rows)
+                    if not rows:
+                        break
+                    _append(reader, rows, written)
+            conn.rollback()
+        finally:
+            conn.close()
+    metrics.inc("rows_exported", sum(written.values()), table=table)
+    return written
+
+
+def run(connect: Callable, tables: Sequence[str] = (bulkload.PRICES.table,), **kwargs) -> Dict[str, Dict[str, int]]:
+    """``export`` each of ``tables`` when ``EXPORT_DIR`` is set; the DAGs call this after validation."""
+    if not (kwargs.get("root") or export_dir()):
+        print("[EXPORT] EXPORT_DIR is not set, skipping the columnar export")
+        return {}
+    out = {}
+    for table in tables:
+        written = export(connect, table, **kwargs)
+        print(f"[EXPORT] {table}: {sum(written.values())} rows appended for {len(written)} symbols")
+        out[table] = written
+    return out
+
+
+def status(root: str | None = None) -> Dict[str, Dict]:
+    root = root or export_dir()
+    out = {}
+    for table in TABLES:
+        reader = Reader(root, table)
+        rows = partitions = size = 0
+        for sym in reader.symbols():
+            for month in reader.months(sym):
+                part = reader.partition(sym, month)
+                partitions += 1
+                rows += part.rows()
+                size += sum(e.stat().st_size for e in os.scandir(part.path) if e.is_file())
+        marks = reader.marks()
+        out[table] = {
+            "symbols": len(marks),
+            "partitions": partitions,
+            "rows": rows,
+            "bytes": size,
+            "newest": max(marks.values()).isoformat() if marks else None,
+        }
+    return out
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Export price history to memory-mappable column files.")
+    parser.add_argument("command", choices=("run", "status"))
+    parser.add_argument("--dir", help="export directory (default: EXPORT_DIR)")
+    parser.add_argument("--tables", default=bulkload.PRICES.table, help=f"comma-separated, from {', '.join(TABLES)}")
+    parser.add_argument("--symbols", help="comma-separated (default: every symbol in the table)")
+    parser.add_argument("--rebuild", action="store_true", help="rewrite the given symbols from scratch")
+    args = parser.parse_args(argv)
+    root = args.dir or export_dir()
+    if not root:
+        parser.error("set EXPORT_DIR or pass --dir")
+    if args.command == "status":
+        print(json.dumps(status(root), indent=2))
+        return 0
+    if args.rebuild and not args.symbols:
+        parser.error("--rebuild needs --symbols")
+    import psycopg2
+    from app import etl
+
+    pg = etl.load_settings()["pg"]
+    symbols = args.symbols.split(",") if args.symbols else None
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    run(lambda: psycopg2.connect(**pg), tables, root=root, symbols=symbols, rebuild=args.rebuild)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
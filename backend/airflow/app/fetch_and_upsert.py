@@ -1,10 +1,16 @@
-import os, time, requests, json
+import os, time, threading, requests, json
+from datetime import timedelta
 import psycopg2
-from psycopg2.extras import execute_values
 
-ALPHA = "https://www.alphavantage.co/query"
-APIFY_RUN = "https://api.apify.com/v2/acts/{actorId}/runs?token={token}"
-APIFY_ITEMS = "https://api.apify.com/v2/datasets/{datasetId}/items?token={token}"
+from app import bulkload, columnar, indicators, jsonstream, latest, metrics, notify, partitions, providers, quality, ratelimit, resample, respcache, rollups, scheduler, spool, watermark
+
+ALPHA = os.getenv("ALPHA_VANTAGE_URL", "https://www.alphavantage.co/query")
+APIFY = os.getenv("APIFY_BASE_URL", "https://api.apify.com")
+APIFY_RUN = APIFY + "/v2/acts/{actorId}/runs?token={token}"
+APIFY_ITEMS = APIFY + "/v2/datasets/{datasetId}/items?token={token}"
+APIFY_RUN_STATUS = APIFY + "/v2/actor-runs/{runId}?token={token}"
+APIFY_FAILED = ("FAILED","ABORTED","TIMED-OUT")
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT_SEC","30"))
 
 def db():
     return psycopg2.connect(
@@ -13,45 +19,104 @@ def db():
         user=os.getenv("POSTGRES_USER","admin"),
         password=os.getenv("POSTGRES_PASSWORD","adminpassword"),
         dbname=os.getenv("STOCKS_DB","stocks"),
+        connect_timeout=int(os.getenv("POSTGRES_CONNECT_TIMEOUT_SEC","10")),
     )
 
 def ensure_table():
-    with db() as conn, conn.cursor() as cur:
+    try: conn=db()
+    except psycopg2.OperationalError as e: print(f"[ETL] Could not check stock_prices, writes will be spooled: {e}"); return
+    with conn, conn.cursor() as cur:
         cur.execute("""CREATE TABLE IF NOT EXISTS stock_prices(
             symbol TEXT NOT NULL, ts TIMESTAMP NOT NULL,
             open NUMERIC, high NUMERIC, low NUMERIC, close NUMERIC,
             adjusted_close NUMERIC, volume BIGINT,
-            PRIMARY KEY(symbol, ts));""")
+            PRIMARY KEY(symbol, ts)) PARTITION BY RANGE (ts);""")
+        if partitions.is_partitioned(cur, "stock_prices"):
+            cur.execute("CREATE TABLE IF NOT EXISTS stock_prices_default PARTITION OF stock_prices DEFAULT;")
         conn.commit()
+    conn.close()
+
+def load_marks(symbols):
+    """Watermarks moved back to open data-quality findings; empty (full fetches) when Postgres is down."""
+    try:
+        conn=db()
+        try: return quality.rewind(conn, bulkload.PRICES_ADJUSTED, ALPHA_BAR, watermark.load(conn, bulkload.PRICES_ADJUSTED, symbols), symbols)
+        finally: conn.close()
+    except Exception as e:
+        print(f"[ETL] Could not load watermarks, fetching full windows: {e}"); return {}
 
-def upsert(rows):
-    if not rows: return
-    sql = """INSERT INTO stock_prices(symbol,ts,open,high,low,close,adjusted_close,volume)
-             VALUES %s ON CONFLICT(symbol,ts) DO UPDATE SET
-             open=EXCLUDED.open, high=EXCLUDED.high, low=EXCLUDED.low, close=EXCLUDED.close,
-             adjusted_close=EXCLUDED.adjusted_close, volume=EXCLUDED.volume;"""
+def upsert(rows, symbol=None):
+    if not len(rows): return
     with db() as conn, conn.cursor() as cur:
-        execute_values(cur, sql, rows, page_size=500); conn.commit()
+        if isinstance(rows, columnar.Bars): bulkload.copy_upsert_bars(cur, bulkload.PRICES_ADJUSTED, symbol, rows, STAGES)
+        else: bulkload.copy_upsert(cur, bulkload.PRICES_ADJUSTED, rows, STAGES)
+        conn.commit()
 
-def fetch_alpha(symbol):
-    key=os.environ["ALPHA_VANTAGE_API_KEY"]
-    r=requests.get(ALPHA, params={"function":"TIME_SERIES_INTRADAY","interval":"5min","symbol":symbol,"apikey":key})
-    p=r.json()
-    if "Note" in p or "Error Message" in p: raise RuntimeError(str(p))
-    ts=p.get("Time Series (5min)") or {}
-    rows=[]
-    for t,v in ts.items():
-        rows.append((symbol,t, _f(v.get("1. open")),_f(v.get("2. high")),_f(v.get("3. low")),
-                     _f(v.get("4. close")),_f(v.get("4. close")), _i(v.get("5. volume"))))
-    return rows
+ALPHA_BAR = timedelta(minutes=5)
+STAGES = notify.inline((rollups.after_merge, latest.stage_for(bulkload.PRICES_ADJUSTED), indicators.stage_for(ALPHA_BAR), quality.stage_for(bulkload.PRICES_ADJUSTED, ALPHA_BAR), resample.stage_for(bulkload.PRICES_ADJUSTED, ALPHA_BAR), notify.stage_for(bulkload.PRICES_ADJUSTED)))  # refreshed/checked in the same transaction as each upsert, announced on commit
+
+def fetch_alpha(symbol, outputsize="compact", cancel=None):
+    cache=respcache.get_cache()
+    ckey=respcache.Key("alphavantage","TIME_SERIES_INTRADAY",symbol,"5min",outputsize)
+    body=cache.get(ckey)
+    if body is not None:
+        p=json.loads(body)
+    else:
+        key=os.environ["ALPHA_VANTAGE_API_KEY"]
+        providers.permit("alphavantage")  # the token wait is not Alpha Vantage latency
+        if cancel is not None and cancel.is_set(): raise providers.Cancelled(f"Alpha Vantage {symbol} abandoned")
+        with metrics.timer("fetch", provider="alphavantage"):
+            r=requests.get(ALPHA, params={"function":"TIME_SERIES_INTRADAY","interval":"5min","outputsize":outputsize,"symbol":symbol,"apikey":key}, timeout=HTTP_TIMEOUT)
+        metrics.inc("http_bytes", len(r.content), provider="alphavantage")
+        with metrics.timer("parse", provider="alphavantage"): p=r.json()
+        if "Note" in p: ratelimit.throttled("alphavantage")
+        if "Note" in p or "Error Message" in p: raise RuntimeError(str(p))
+        if cancel is not None and cancel.is_set(): raise providers.Cancelled(f"Alpha Vantage {symbol} abandoned")
+        if p.get("Time Series (5min)"): cache.put(ckey, r.content)
+    with metrics.timer("parse", provider="alphavantage"):
+        bars=columnar.from_series(p.get("Time Series (5min)") or {}, columnar.INTRADAY_FIELDS)
+    bars.adjusted_close=bars.close
+    return bars
 
-def fetch_apify(symbol):
+def wait_apify_run(run, token, cancel=None):
+    """Poll the actor run with backoff until it has SUCCEEDED; returns its dataset id."""
+    data=run.get("data") or {}
+    deadline=time.monotonic()+float(os.getenv("APIFY_RUN_TIMEOUT_SEC","120")); delay=0.5
+    cancel=cancel or threading.Event()
+    while data.get("status")!="SUCCEEDED":
+        status=data.get("status"); runId=data.get("id")
+        if status in APIFY_FAILED: raise RuntimeError(f"Apify run {runId} {status}")
+        if not runId: raise RuntimeError("No run from Apify")
+        if time.monotonic()+delay>deadline: raise RuntimeError(f"Apify run {runId} still {status} after the {os.getenv('APIFY_RUN_TIMEOUT_SEC','120')}s timeout")
+        if cancel.wait(delay): raise providers.Cancelled(f"Apify run {runId} abandoned")
+        delay=min(delay*2, 5.0)
+        providers.permit("apify")
+        with metrics.timer("fetch", provider="apify", call="status"):
+            r=requests.get(APIFY_RUN_STATUS.format(runId=runId, token=token), timeout=HTTP_TIMEOUT)
+        r.raise_for_status(); data=r.json().get("data") or {}
+    return data.get("defaultDatasetId")
+
+def fetch_apify(symbol, cancel=None):
     actor=os.getenv("APIFY_ACTOR_ID"); token=os.getenv("APIFY_API_TOKEN")
-    run=requests.post(APIFY_RUN.format(actorId=actor, token=token), json={"symbol":symbol}).json()
-    datasetId=run.get("data",{}).get("defaultDatasetId")
+    cache=respcache.get_cache()
+    ckey=respcache.Key("apify",actor or "",symbol)
+    cached=cache.read(ckey)
+    if cached is not None:
+        return _apify_rows(symbol, jsonstream.iter_array_items(cached))
+    providers.permit("apify")
+    with metrics.timer("fetch", provider="apify", call="run"):
+        run=requests.post(APIFY_RUN.format(actorId=actor, token=token), json={"symbol":symbol}, timeout=HTTP_TIMEOUT).json()
+    datasetId=wait_apify_run(run, token, cancel)
     if not datasetId: raise RuntimeError("No dataset from Apify")
-    time.sleep(3)
-    items=requests.get(APIFY_ITEMS.format(datasetId=datasetId, token=token)).json()
+    providers.permit("apify")
+    # Dataset items are parsed as they arrive instead of loading the whole array with .json().
+    with metrics.timer("fetch", provider="apify", call="items"):
+        resp=requests.get(APIFY_ITEMS.format(datasetId=datasetId, token=token), stream=True, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        with cache.recording(ckey) as rec:
+            return _apify_rows(symbol, jsonstream.iter_array_items(rec.tee(metrics.counted(resp.iter_content(65536), provider="apify"))))
+
+def _apify_rows(symbol, items):
     rows=[]
     for it in items:
         t=it.get("timestamp") or it.get("date") or it.get("time")
@@ -67,19 +132,35 @@ def _i(x):
     except: return None
 
 def run_batch(symbols):
+    """Per-symbol results (``metrics.RunResults``; the run summary is on ``.report``)."""
+    started=metrics.begin()
     ensure_table()
-    out={}
-    for s in symbols:
-        try:
-            rows=fetch_alpha(s)
-        except Exception as e:
+    out=metrics.RunResults()
+    batch_rows=int(os.getenv("ETL_WRITE_BATCH_ROWS","5000"))
+    drained=spool.replay(bulkload.PRICES_ADJUSTED, db, STAGES, batch_rows)  # earlier runs' spooled rows go first
+    bulkload.combine_results(out, {s: r for s, r in drained.items() if s in symbols})
+    marks=load_marks(symbols)
+    writer=bulkload.BulkWriter(db, bulkload.PRICES_ADJUSTED, batch_rows, STAGES, spool.for_target(bulkload.PRICES_ADJUSTED))
+    try:
+        for s in symbols:
+            mark=marks.get(s)
+            # Apify is started once Alpha Vantage fails or exceeds PROVIDER_HEDGE_AFTER_SEC; the first answer wins.
             try:
-                rows=fetch_apify(s)
-            except Exception as e2:
-                out[s]={"status":"error","error":str(e2)}; continue
-        upsert(rows); out[s]={"status":"ok","rows":len(rows)}
+                _, rows=providers.hedged({
+                    "alphavantage": lambda cancel, s=s, size=watermark.output_size(mark, ALPHA_BAR): fetch_alpha(s, size, cancel),
+                    "apify": lambda cancel, s=s: fetch_apify(s, cancel),
+                })
+            except Exception as e:
+                out[s]={"status":"error","error":str(e)}; continue
+            rows, skipped = watermark.since(rows, mark)
+            bulkload.combine_results(out, writer.add(s, rows, skipped))
+    finally:
+        bulkload.combine_results(out, writer.close())
+        out.report=started.report(); metrics.export("run_batch")
+    scheduler.record(db, bulkload.PRICES_ADJUSTED, out)  # refresh times for SYMBOL_SOURCE=demand
     return out
 
 if __name__=="__main__":
-    syms=[x.strip() for x in os.getenv("SYMBOLS","AAPL").split(",") if x.strip()]
-    print(json.dumps(run_batch(syms), indent=2))
\ No newline at end of file
+    syms=scheduler.select(db, bulkload.PRICES_ADJUSTED, os.getenv("SYMBOLS","AAPL").split(","))  # SYMBOLS, or the demand plan
+    res=run_batch(syms)
+    print(json.dumps({"results":res, "report":res.report}, indent=2))
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""Technical indicators over ``stock_prices``, maintained incrementally.
+
+``stage_for(bar)`` is a ``bulkload`` merge stage. For every symbol whose bars
+changed, it recomputes ``price_indicators`` from the first changed bar to
+the end of the series and leaves older rows alone. Each run therefore only
+reads a short lookback in front of the new bars:
+
+* ``sma_20`` and ``volatility_20`` (sample std of log returns) are windowed
+  and need the previous 20 bars.
+* ``vwap`` is the session (calendar day) VWAP and needs the day's earlier bars.
+* ``ema_20`` and ``rsi_14`` (Wilder smoothing) are recursive. Their state,
+  the EMA and RSI's smoothed gain and loss, is stored on every row, so a run
+  resumes from the row just before the first changed bar.
+
+If that state is missing, for example on a new symbol, a symbol whose
+indicators were never built, or a change inside the warm-up bars, the
+symbol is rebuilt from its first bar.
+
+Each writer keeps its own series: rows are keyed by ``resolution`` (the bar
+width, e.g. ``5min`` or ``60min``) and only bars on that grid are read. A
+60min writer skips the 5min bars another writer keeps in the same table,
+and neither overwrites nor resumes from the other's rows.
+
+    python -m app.indicators --symbols AAPL,MSFT   # rebuild from scratch (ETL_INTERVAL grid)
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import psycopg2
+from numpy.lib.stride_tricks import sliding_window_view
+from psycopg2.extras import execute_values
+
+from app import bulkload
+
+
+SMA_PERIOD = 20
+EMA_PERIOD = 20
+RSI_PERIOD = 14
+VOLATILITY_PERIOD = 20
+# Bars before the first changed one needed by the windowed indicators.
+LOOKBACK = max(SMA_PERIOD - 1, VOLATILITY_PERIOD, 1)
+
+INDICATORS_DDL = """
+CREATE TABLE IF NOT EXISTS price_indicators (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    ts TIMESTAMP NOT NULL,
+    sma_20 DOUBLE PRECISION,
+    ema_20 DOUBLE PRECISION,
+    rsi_14 DOUBLE PRECISION,
+    vwap DOUBLE PRECISION,
+    volatility_20 DOUBLE PRECISION,
+    rsi_avg_gain DOUBLE PRECISION,
+    rsi_avg_loss DOUBLE PRECISION,
+    PRIMARY KEY (symbol, resolution, ts)
+);
+-- Tables from before the resolution column mixed every writer's bars: rebuilt on their next write.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = 'price_indicators'::regclass AND attname = 'resolution' AND NOT attisdropped) THEN
+        TRUNCATE price_indicators;
+        ALTER TABLE price_indicators ADD COLUMN resolution TEXT NOT NULL;
+        ALTER TABLE price_indicators DROP CONSTRAINT price_indicators_pkey;
+        ALTER TABLE price_indicators ADD PRIMARY KEY (symbol, resolution, ts);
+    END IF;
+END $$;
+"""
+
+COLUMNS = ("sma_20", "ema_20", "rsi_14", "vwap", "volatility_20", "rsi_avg_gain", "rsi_avg_loss")
+
+# Bars on the writer's grid only.
+_ON_GRID = "date_bin(%(step)s, ts::timestamp, TIMESTAMP '2000-01-01') = ts::timestamp"
+
+_BARS_SQL = f"""
+SELECT ts, high::float8, low::float8, close::float8, volume
+FROM {{table}}
+WHERE symbol = %(symbol)s AND close IS NOT NULL AND {_ON_GRID} AND ts >= LEAST(
+    date_trunc('day', %(first)s::timestamp),
+    COALESCE(
+        (SELECT ts FROM {{table}} WHERE symbol = %(symbol)s AND close IS NOT NULL AND {_ON_GRID} AND ts < %(first)s
+         ORDER BY ts DESC OFFSET %(lookback)s - 1 LIMIT 1),
+        '-infinity'
+    )
+)
+ORDER BY ts
+"""
+
+_STATE_SQL = """
+SELECT ema_20, rsi_avg_gain, rsi_avg_loss FROM price_indicators WHERE symbol = %s AND resolution = %s AND ts = %s
+"""
+
+_UPSERT_SQL = f"""
+INSERT INTO price_indicators AS i (symbol, resolution, ts, {", ".join(COLUMNS)})
+VALUES %s
+ON CONFLICT (symbol, resolution, ts) DO UPDATE SET
+    {", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS)}
+WHERE ({", ".join("i." + c for c in COLUMNS)}) IS DISTINCT FROM ({", ".join("EXCLUDED." + c for c in COLUMNS)})
+"""
+
+# NumPy has no scan primitive: the recursions run one block at a time, each
+# block being a lower-triangular matrix product plus the decayed carry-in.
+_BLOCK = 128
+
+
+def ewm(values: np.ndarray, alpha: float, init: float = np.nan) -> np.ndarray:
+    """``y[t] = y[t-1] + alpha * (x[t] - y[t-1])`` with ``y[-1] = init``; a NaN ``init`` starts at ``x[0]``."""
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    k = np.arange(_BLOCK)
+    lag = k[:, None] - k[None, :]
+    weights = np.where(lag >= 0, alpha * decay ** np.maximum(lag, 0), 0.0)
+    carry = decay ** (k + 1)
+    start, prev = 0, init
+    if np.isnan(prev):
+        out[0] = prev = values[0]
+        start = 1
+    for lo in range(start, len(values), _BLOCK):
+        block = values[lo:lo + _BLOCK]
+        n = len(block)
+        out[lo:lo + n] = weights[:n, :n] @ block + carry[:n] * prev
+        prev = out[lo + n - 1]
+    return out
+
+
+def _rolling(values: np.ndarray, window: int, fn) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = fn(sliding_window_view(values, window), axis=-1)
+    return out
+
+
+def _session_vwap(ts: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+    typical = np.where(np.isnan(high) | np.isnan(low), close, (high + low + close) / 3)
+    vol = np.nan_to_num(volume)
+    pv, v = np.cumsum(typical * vol), np.cumsum(vol)
+    # Restart both running sums at the first bar of each day.
+    day = ts.astype("datetime64[D]")
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    owner = np.repeat(starts, np.diff(np.r_[starts, len(ts)]))
+    pv -= (pv - typical * vol)[owner]
+    v -= (v - vol)[owner]
+    return np.divide(pv, v, out=np.full(len(ts), np.nan), where=v > 0)
+
+
+def compute(
+    ts: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray,
+    start: int = 0, state: Sequence[float] | None = None,
+) -> Dict[str, np.ndarray]:
+    """Indicators for ``bars[start:]``.
+
+    ``bars[:start]`` is lookback only. ``state`` is ``(ema, avg_gain,
+    avg_loss)`` as of bar ``start - 1``; ``None`` means the series begins
+    at bar 0, and warm-up bars are left NULL.
+    """
+    diff = np.diff(close, prepend=np.nan)
+    gain, loss = np.clip(diff, 0, None), np.clip(-diff, 0, None)
+    new = slice(start, None)
+    if state is None:
+        ema = ewm(close, 2.0 / (EMA_PERIOD + 1))
+        avg_gain = np.r_[np.nan, ewm(gain[1:], 1.0 / RSI_PERIOD)]
+        avg_loss = np.r_[np.nan, ewm(loss[1:], 1.0 / RSI_PERIOD)]
+    else:
+        ema, avg_gain, avg_loss = (np.full(len(close), np.nan) for _ in range(3))
+        ema[new] = ewm(close[new], 2.0 / (EMA_PERIOD + 1), state[0])
+        avg_gain[new] = ewm(gain[new], 1.0 / RSI_PERIOD, state[1])
+        avg_loss[new] = ewm(loss[new], 1.0 / RSI_PERIOD, state[2])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = np.where(avg_loss > 0, 100 - 100 / (1 + avg_gain / avg_loss), np.where(avg_gain > 0, 100.0, 50.0))
+        returns = np.log(close / np.r_[np.nan, close[:-1]])
+    rsi[np.isnan(avg_gain)] = np.nan
+    if state is None:
+        ema[:EMA_PERIOD - 1] = np.nan
+        rsi[:RSI_PERIOD] = np.nan
+    out = {
+        "sma_20": _rolling(close, SMA_PERIOD, np.mean),
+        "ema_20": ema,
+        "rsi_14": rsi,
+        "vwap": _session_vwap(ts, high, low, close, volume),
+        "volatility_20": _rolling(returns, VOLATILITY_PERIOD, lambda w, axis: np.std(w, axis=axis, ddof=1)),
+        "rsi_avg_gain": avg_gain,
+        "rsi_avg_loss": avg_loss,
+    }
+    return {name: values[new] for name, values in out.items()}
+
+
+def _load(cur, table: str, symbol: str, first, bar: timedelta) -> Dict[str, np.ndarray]:
+    cur.execute(_BARS_SQL.format(table=table), {"symbol": symbol, "first": first, "lookback": LOOKBACK, "step": bar})
+    rows = cur.fetchall()
+    return {
+        "ts": np.array([r[0] for r in rows], dtype="datetime64[us]"),
+        "high": np.array([r[1] for r in rows], dtype=np.float64),
+        "low": np.array([r[2] for r in rows], dtype=np.float64),
+        "close": np.array([r[3] for r in rows], dtype=np.float64),
+        "volume": np.array([r[4] for r in rows], dtype=np.float64),
+    }
+
+
+def _symbol_rows(cur, table: str, symbol: str, first: datetime | None, bar: timedelta) -> List[tuple]:
+    bars = _load(cur, table, symbol, first or datetime.min, bar)
+    start = int(np.searchsorted(bars["ts"], np.datetime64(first or datetime.min, "us")))
+    state = None
+    if start >= LOOKBACK:
+        cur.execute(_STATE_SQL, (symbol, bulkload.resolution(bar), bars["ts"][start - 1].item()))
+        row = cur.fetchone()
+        if row is None or None in row:
+            return _symbol_rows(cur, table, symbol, None, bar)
+        state = row
+    # Otherwise fewer than LOOKBACK bars precede ``first``: the whole series is loaded.
+    values = compute(bars["ts"], bars["high"], bars["low"], bars["close"], bars["volume"], start, state)
+    columns = [values[c].tolist() for c in COLUMNS]
+    resolution = bulkload.resolution(bar)
+    return [
+        (symbol, resolution, ts, *(None if v != v else v for v in vals))
+        for ts, *vals in zip(bars["ts"][start:].tolist(), *columns)
+    ]
+
+
+def refresh(cur, firsts: Dict[str, datetime | None], bar: timedelta, source: str = bulkload.PRICES.table) -> int:
+    """Recompute the ``bar``-wide series from each symbol's first changed bar (``None``: from scratch) onward."""
+    if not firsts:
+        return 0
+    bulkload.ensure_table(cur, "price_indicators", INDICATORS_DDL, column="resolution")
+    rows = [row for sym in sorted(firsts) for row in _symbol_rows(cur, source, sym, firsts[sym], bar)]
+    if rows:
+        execute_values(cur, _UPSERT_SQL, rows, page_size=1000)
+    return len(rows)
+
+
+def stage_for(bar: timedelta) -> Callable[[object, Dict[str, Dict]], None]:
+    """``bulkload`` merge stage for ``stock_prices`` writers of ``bar``-wide bars."""
+
+    def after_merge(cur, merged: Dict[str, Dict]) -> None:
+        refresh(cur, {sym: m["first"] for sym, m in merged.items()}, bar)
+
+    return after_merge
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild technical indicators from the full price history.")
+    parser.add_argument("--symbols", required=True, help="comma-separated symbols")
+    args = parser.parse_args(argv)
+    symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()]
+    from app import etl
+
+    conn = psycopg2.connect(**etl.load_settings()["pg"])
+    try:
+        with conn, conn.cursor() as cur:
+            # Bars of the etl writer's grid (ETL_INTERVAL).
+            print(f"[ETL] rebuilt {refresh(cur, dict.fromkeys(symbols), etl.INTRADAY_BAR)} indicator rows")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""Incremental JSON parsing for large provider responses.
+
+Full-history payloads are one big object (Alpha Vantage ``Time Series (...)``)
+or one big array (Apify dataset items). These helpers walk the response
+stream member by member with ``json.JSONDecoder.raw_decode`` and only ever
+hold the current window of text, so memory stays flat however long the
+history is.
+"""
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator, List, Tuple
+
+
+_decoder = json.JSONDecoder()
+_WS = re.compile(r"[\s,]*")
+_SPACE = re.compile(r"\s*")
+# Trim consumed text once this much has accumulated ahead of the cursor.
+_COMPACT_AT = 1 << 16
+
+
+class SeriesNotFound(RuntimeError):
+    """The stream ended without the requested member; ``payload`` holds the parsed document."""
+
+    def __init__(self, payload: Any):
+        super().__init__(f"Series not found in response: {json.dumps(payload)[:500]}")
+        self.payload = payload
+
+
+class _Window:
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self) -> bool:
+        if self.eof:
+            return False
+        if self.pos > _COMPACT_AT:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.text += self._utf8.decode(b"", final=True)
+        else:
+            self.text += self._utf8.decode(chunk)
+        return True
+
+    def skip_separators(self) -> None:
+        while True:
+            self.pos = _WS.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or not self.more():
+                return
+
+    def decode(self) -> Any:
+        """Decode one complete JSON value at the cursor, reading more input as needed."""
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number or literal that ends exactly at the buffer edge may be cut short.
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.more()
+
+    def expect(self, char: str) -> None:
+        self.pos = _SPACE.match(self.text, self.pos).end()
+        while self.pos >= len(self.text) and self.more():
+            self.pos = _SPACE.match(self.text, self.pos).end()
+        if self.text[self.pos:self.pos + 1] != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+
+def iter_object_members(chunks: Iterable[bytes], key_pattern: str) -> Iterator[Tuple[str, Any]]:
+    """Yield ``(name, value)`` for each member of the object under the first key matching ``key_pattern``."""
+    win = _Window(chunks)
+    start = re.compile(r'"(' + key_pattern + r')"\s*:\s*\{')
+    while True:
+        found = start.search(win.text)
+        if found:
+            win.pos = found.end()
+            break
+        if not win.more():
+            raise SeriesNotFound(json.loads(win.text or "null"))
+    while True:
+        win.skip_separators()
+        if win.text[win.pos:win.pos + 1] in ("}", ""):
+            return
+        name = win.decode()
+        win.expect(":")
+        win.skip_separators()
+        yield name, win.decode()
+
+
+def iter_array_items(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Yield each element of a top-level JSON array."""
+    win = _Window(chunks)
+    win.expect("[")
+    while True:
+        win.skip_separators()
+        if win.text[win.pos:win.pos + 1] in ("]", ""):
+            return
+        yield win.decode()
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,83 @@
+"""``latest_quotes``: the newest bar per symbol, maintained by the writers.
+
+Readers ("current price", portfolio valuation) look up one row by primary
+key instead of sorting a symbol's history. The table is updated by
+``stage_for(target)``, a ``bulkload`` merge stage, in the same transaction
+as the bars. A quote can therefore never point at a bar that was rolled
+back. The upsert is monotonic: a row only moves forward in time. A late or
+replayed older batch leaves it alone. Re-delivering the current bar can
+still correct its values.
+
+``prev_close`` is the last close before the quote's calendar day, and
+``change_pct`` is the move against it.
+"""
+from typing import Callable, Dict
+
+from app import bulkload
+
+
+LATEST_DDL = """
+CREATE TABLE IF NOT EXISTS latest_quotes (
+    symbol TEXT PRIMARY KEY,
+    ts TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    adjusted_close DOUBLE PRECISION,
+    volume BIGINT,
+    prev_close DOUBLE PRECISION,
+    change_pct DOUBLE PRECISION,
+    source TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+_REFRESH_SQL = """
+INSERT INTO latest_quotes AS q
+    (symbol, ts, open, high, low, close, adjusted_close, volume, prev_close, change_pct, source, updated_at)
+SELECT s.symbol, b.{ts}, b.open, b.high, b.low, b.close, b.adjusted_close, b.volume, pc.close,
+       CASE WHEN pc.close <> 0 THEN round(((b.close - pc.close) / pc.close * 100)::numeric, 4) END,
+       %(source)s, now()
+FROM unnest(%(symbols)s::text[]) AS s(symbol)
+CROSS JOIN LATERAL (
+    SELECT {ts}, open::float8, high::float8, low::float8, close::float8, {adjusted}::float8 AS adjusted_close, volume
+    FROM {table} p WHERE p.symbol = s.symbol ORDER BY {ts} DESC LIMIT 1
+) b
+LEFT JOIN LATERAL (
+    SELECT close::float8 AS close
+    FROM {table} p WHERE p.symbol = s.symbol AND p.{ts} < date_trunc('day', b.{ts})
+    ORDER BY {ts} DESC LIMIT 1
+) pc ON true
+ON CONFLICT (symbol) DO UPDATE SET
+    ts = EXCLUDED.ts, open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+    close = EXCLUDED.close, adjusted_close = EXCLUDED.adjusted_close, volume = EXCLUDED.volume,
+    prev_close = EXCLUDED.prev_close, change_pct = EXCLUDED.change_pct, source = EXCLUDED.source,
+    updated_at = now()
+WHERE q.ts <= EXCLUDED.ts
+  AND (q.ts, q.open, q.high, q.low, q.close, q.adjusted_close, q.volume, q.prev_close, q.source)
+      IS DISTINCT FROM
+      (EXCLUDED.ts, EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close, EXCLUDED.adjusted_close,
+       EXCLUDED.volume, EXCLUDED.prev_close, EXCLUDED.source)
+"""
+
+
+def refresh(cur, target: bulkload.Target, symbols) -> int:
+    """Move each symbol's quote up to the newest bar stored in ``target.table``."""
+    symbols = sorted(symbols)
+    if not symbols:
+        return 0
+    bulkload.ensure_table(cur, "latest_quotes", LATEST_DDL)
+    adjusted = "adjusted_close" if "adjusted_close" in target.column_names else "NULL"
+    sql = _REFRESH_SQL.format(table=target.table, ts=target.key[1], adjusted=adjusted)
+    cur.execute(sql, {"symbols": symbols, "source": target.table})
+    return cur.rowcount
+
+
+def stage_for(target: bulkload.Target) -> Callable[[object, Dict[str, Dict]], None]:
+    """``bulkload`` merge stage that refreshes ``latest_quotes`` from ``target``."""
+
+    def after_merge(cur, merged: Dict[str, Dict]) -> None:
+        refresh(cur, target, merged)
+
+    return after_merge
@@ -0,0 +1,210 @@
+"""In-process pipeline metrics: stage timers and counters.
+
+Every ingestion path records into one process-wide registry. The recorded
+metrics are:
+
+* ``timer(stage, **labels)`` or ``observe``: seconds spent per stage.
+  Stages include ``fetch``, ``parse``, ``ratelimit_wait``, ``copy``,
+  ``merge``, ``derive`` (merge stages) and ``transaction``.
+* ``inc(name, value, **labels)``: counters, among them ``http_bytes``,
+  ``http_retries``, ``throttles``, ``cache_hits``, ``cache_misses`` and
+  ``rows_staged``.
+
+``begin()`` marks the start of a run. ``Run.report()`` then summarizes what
+happened since as a plain dict, for example ``{"wall_seconds",
+"rows_per_sec", "stages", "counters"}``. ``etl.run``,
+``fetch_and_upsert.run_batch`` and ``StockDataFetcher.fetch_all_symbols``
+return that report with their results.
+
+The registry is exposed in Prometheus text format in two ways:
+
+* ``export(job)`` writes ``<METRICS_TEXTFILE_DIR>/stock_pipeline_<job>_<shard>.prom``
+  for node_exporter's textfile collector. The file is replaced atomically
+  at the end of each run. ``shard`` is ``METRICS_SHARD`` (the DAGs set it to
+  the mapped task's index) or else the process id, so parallel tasks on one
+  host write separate files and their series carry a distinct ``shard``
+  label.
+* If ``METRICS_PORT`` is set, ``begin()`` also serves ``GET /metrics`` from
+  a daemon thread, which is useful for long-lived processes.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, Tuple
+
+
+PREFIX = "stock_pipeline"
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = {}
+_timers: Dict[_Key, Tuple[int, float]] = {}
+_server = None
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default) or default
+
+
+def _key(name: str, labels: Dict[str, object]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(stage: str, seconds: float, **labels) -> None:
+    key = _key(stage, labels)
+    with _lock:
+        count, total = _timers.get(key, (0, 0.0))
+        _timers[key] = (count + 1, total + seconds)
+
+
+@contextmanager
+def timer(stage: str, **labels) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, **labels)
+
+
+def counted(chunks: Iterable[bytes], name: str = "http_bytes", **labels) -> Iterator[bytes]:
+    """Pass ``chunks`` through, adding their size to counter ``name``."""
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+    finally:
+        inc(name, total, **labels)
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...], extra: Dict[str, str] | None = None) -> str:
+    pairs = list(labels) + sorted((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render(**extra_labels) -> str:
+    """The registry in Prometheus text exposition format."""
+    with _lock:
+        counters, timers = dict(_counters), dict(_timers)
+    lines = [
+        f"# HELP {PREFIX}_stage_seconds Time spent per pipeline stage.",
+        f"# TYPE {PREFIX}_stage_seconds summary",
+    ]
+    for (stage, labels), (count, total) in sorted(timers.items()):
+        text = _label_text((("stage", stage),) + labels, extra_labels)
+        lines.append(f"{PREFIX}_stage_seconds_sum{text} {total:.6f}")
+        lines.append(f"{PREFIX}_stage_seconds_count{text} {count}")
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{PREFIX}_{name}_total{_label_text(labels, extra_labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class Run:
+    """Snapshot of the registry at the start of a run; ``report`` diffs against it."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        with _lock:
+            self._counters, self._timers = dict(_counters), dict(_timers)
+
+    def report(self) -> Dict:
+        with _lock:
+            counters, timers = dict(_counters), dict(_timers)
+        stages: Dict[str, Dict] = {}
+        for key, (count, total) in sorted(timers.items()):
+            before = self._timers.get(key, (0, 0.0))
+            if count > before[0]:
+                stages[key[0] + _label_text(key[1])] = {
+                    "count": count - before[0],
+                    "seconds": round(total - before[1], 6),
+                }
+        counts = {}
+        for key, value in sorted(counters.items()):
+            delta = value - self._counters.get(key, 0.0)
+            if delta:
+                counts[key[0] + _label_text(key[1])] = int(delta) if delta.is_integer() else delta
+        rows = sum(v for k, v in counts.items() if k.startswith("rows_staged"))
+        tx = sum(s["seconds"] for k, s in stages.items() if k.startswith("transaction"))
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started, 6),
+            "rows_per_sec": round(rows / tx, 1) if tx > 0 else None,
+            "stages": stages,
+            "counters": counts,
+        }
+
+
+class RunResults(dict):
+    """Per-symbol results of a run, with the run's metrics ``report`` attached."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.report: Dict = {}
+
+
+def begin() -> Run:
+    port = int(_env("METRICS_PORT", "0"))
+    if port:
+        serve(port)
+    return Run()
+
+
+def export(job: str) -> str | None:
+    """Write the registry for the textfile collector; returns the path, if configured."""
+    directory = os.getenv("METRICS_TEXTFILE_DIR")
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    shard = _env("METRICS_SHARD", str(os.getpid()))
+    path = os.path.join(directory, f"{PREFIX}_{job}_{shard}.prom")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fh:
+        fh.write(render(job=job, shard=shard))
+    os.replace(tmp, path)
+    return path
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(port: int, host: str = "0.0.0.0") -> None:
+    """Serve ``/metrics`` on ``port`` from a daemon thread (once per process)."""
+    global _server
+    with _lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            # Another task process on this host already owns the port.
+            print(f"[ETL] metrics endpoint not started on :{port}: {e}")
+            _server = False
+            return
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
@@ -0,0 +1,266 @@
+"""Change notifications for ingestion writes.
+
+``stage_for`` is a ``bulkload`` merge stage that publishes ``NOTIFY`` on
+``NOTIFY_CHANNEL`` (default ``stock_bars``). Postgres delivers a
+notification only when its transaction commits, so listeners hear about
+committed batches and never about rolled-back ones. A flush sends one
+message per ~170 symbols, not one per symbol. Each message is compact JSON
+under the 8000-byte ``NOTIFY`` limit:
+
+    {"table": "stock_prices", "symbols": {"AAPL": ["2024-01-02T10:00:00", "2024-01-02T15:00:00", 5, 1]}}
+
+which lists, per symbol, the first and last changed ``ts`` (or ``date``) and
+how many bars were new or changed. Any client can ``LISTEN stock_bars``.
+``Listener`` is the Python side. It coalesces notifications that arrive
+within ``coalesce_sec`` of each other into one ``{table: {symbol: Change}}``
+batch, whose ranges cover every message in the batch. Callbacks registered
+with ``on`` use that batch to invalidate caches.
+
+``DERIVED_STAGES=deferred`` moves ``price_rollups`` and ``price_indicators``
+out of the write transaction (see ``inline``). They are then computed by
+``python -m app.notify listen --derive`` for each batch of changes. NOTIFY is
+not durable, so changes made while no listener is running are missed. Rebuild
+them with ``python -m app.indicators --symbols ...``.
+"""
+import argparse
+import json
+import os
+import select
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Sequence
+
+import psycopg2
+from psycopg2 import sql
+
+from app import bulkload, indicators, metrics, rollups
+
+
+MAX_PAYLOAD = 7900  # NOTIFY payloads must stay below 8000 bytes
+DERIVED = ("app.rollups", "app.indicators")  # modules whose merge stages can be deferred
+
+
+def _env(name: str, default: str) -> str:
+    val = os.getenv(name)
+    return default if val is None else val
+
+
+def channel() -> str:
+    return _env("NOTIFY_CHANNEL", "stock_bars").strip()
+
+
+def inline(stages: Sequence[Callable]) -> tuple:
+    """``stages`` to run inside the write transaction: without ``DERIVED`` when they are deferred to a listener."""
+    if _env("DERIVED_STAGES", "inline").strip().lower() == "deferred":
+        return tuple(s for s in stages if getattr(s, "__module__", None) not in DERIVED)
+    return tuple(stages)
+
+
+def _iso(value) -> str:
+    return value.isoformat() if isinstance(value, (datetime, date)) else str(value)
+
+
+def payloads(table: str, merged: Dict[str, Dict]) -> List[str]:
+    """``merged`` (see ``bulkload.merge_stage``) as JSON messages of at most ``MAX_PAYLOAD`` bytes."""
+    head = f'{{"table":{json.dumps(table)},"symbols":{{'
+    out, parts, size = [], [], len(head) + 2
+    for sym in sorted(merged):
+        m = merged[sym]
+        part = f'{json.dumps(sym)}:{json.dumps([_iso(m["first"]), _iso(m["last"]), m["new"], m["changed"]])}'
+        if parts and size + len(part) + 1 > MAX_PAYLOAD:
+            out.append(head + ",".join(parts) + "}}")
+            parts, size = [], len(head) + 2
+        parts.append(part)
+        size += len(part) + 1
+    if parts:
+        out.append(head + ",".join(parts) + "}}")
+    return out
+
+
+def stage_for(target: bulkload.Target) -> Callable[[object, Dict[str, Dict]], None]:
+    """``bulkload`` merge stage that announces ``target.table`` changes on ``NOTIFY_CHANNEL`` at commit."""
+
+    def after_merge(cur, merged: Dict[str, Dict]) -> None:
+        name = channel()
+        if not name:
+            return
+        messages = payloads(target.table, merged)
+        cur.execute("SELECT pg_notify(%s, p) FROM unnest(%s::text[]) AS p", (name, messages))
+        metrics.inc("notifications", len(messages), table=target.table)
+
+    return after_merge
+
+
+@dataclass
+class Change:
+    symbol: str
+    first: datetime | date
+    last: datetime | date
+    new: int = 0
+    changed: int = 0
+
+    def merge(self, other: "Change") -> None:
+        self.first = min(self.first, other.first)
+        self.last = max(self.last, other.last)
+        self.new += other.new
+        self.changed += other.changed
+
+
+def _parse_ts(value: str) -> datetime | date:
+    return date.fromisoformat(value) if len(value) == 10 else datetime.fromisoformat(value)
+
+
+def parse(payload: str) -> tuple:
+    """``(table, {symbol: Change})`` of one notification."""
+    msg = json.loads(payload)
+    changes = {
+        sym: Change(sym, _parse_ts(first), _parse_ts(last), new, changed)
+        for sym, (first, last, new, changed) in msg["symbols"].items()
+    }
+    return msg["table"], changes
+
+
+class Listener:
+    """``LISTEN`` on ``NOTIFY_CHANNEL`` and hand out coalesced ``{table: {symbol: Change}}`` batches.
+
+    ``connect`` must return a new psycopg2 connection; it is put in autocommit mode.
+    """
+
+    def __init__(self, connect: Callable, coalesce_sec: float = 0.5, name: str | None = None):
+        self.connect = connect
+        self.coalesce_sec = coalesce_sec
+        self.channel = name or channel()
+        self.handlers: Dict[str, List[Callable[[Dict[str, Change]], None]]] = {}
+        self._conn = None
+
+    def on(self, table: str, handler: Callable[[Dict[str, Change]], None]) -> "Listener":
+        """Call ``handler({symbol: Change})`` for every batch that changed ``table``."""
+        self.handlers.setdefault(table, []).append(handler)
+        return self
+
+    def _listen(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+            self._conn.autocommit = True
+            with self._conn.cursor() as cur:
+                cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+        return self._conn
+
+    def _drain(self, conn, into: Dict[str, Dict[str, Change]]) -> int:
+        conn.poll()
+        received = 0
+        while conn.notifies:
+            note = conn.notifies.pop(0)
+            try:
+                table, changes = parse(note.payload)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"[NOTIFY] ignoring malformed notification: {e}")
+                continue
+            received += 1
+            batch = into.setdefault(table, {})
+            for sym, change in changes.items():
+                if sym in batch:
+                    batch[sym].merge(change)
+                else:
+                    batch[sym] = change
+        return received
+
+    def poll(self, timeout: float | None = None) -> Dict[str, Dict[str, Change]]:
+        """Wait up to ``timeout`` seconds for changes, then coalesce whatever arrives within ``coalesce_sec``."""
+        conn = self._listen()
+        batch: Dict[str, Dict[str, Change]] = {}
+        if not self._drain(conn, batch):
+            if not select.select([conn], [], [], timeout)[0]:
+                return batch
+            self._drain(conn, batch)
+        deadline = time.monotonic() + self.coalesce_sec
+        while (left := deadline - time.monotonic()) > 0:
+            if select.select([conn], [], [], left)[0]:
+                self._drain(conn, batch)
+        return batch
+
+    def dispatch(self, batch: Dict[str, Dict[str, Change]]) -> None:
+        for table, changes in batch.items():
+            for handler in self.handlers.get(table, ()):
+                handler(changes)
+
+    def run(self, stop: Callable[[], bool] = lambda: False, timeout: float = 5.0) -> None:
+        """Dispatch batches to the handlers until ``stop()``; reconnects after a lost connection."""
+        while not stop():
+            try:
+                batch = self.poll(timeout)
+            except psycopg2.OperationalError as e:
+                print(f"[NOTIFY] connection lost, reconnecting: {e}")
+                self.close()
+                time.sleep(1.0)
+                continue
+            self.dispatch(batch)
+
+    def __iter__(self) -> Iterator[Dict[str, Dict[str, Change]]]:
+        while True:
+            batch = self.poll()
+            if batch:
+                yield batch
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            finally:
+                self._conn = None
+
+    def __enter__(self) -> "Listener":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def deriver(
+    connect: Callable, bar: timedelta, source: str = bulkload.PRICES.table,
+) -> Callable[[Dict[str, Change]], None]:
+    """Handler that brings ``price_rollups`` and ``price_indicators`` (over ``bar``-wide bars) up to date with a batch of changes."""
+    conn = None
+
+    def handle(changes: Dict[str, Change]) -> None:
+        nonlocal conn
+        if conn is None or conn.closed:
+            conn = connect()
+        with metrics.timer("derive", step="notify"), conn, conn.cursor() as cur:
+            rollups.refresh(cur, {s: (c.first, c.last) for s, c in changes.items()}, source)
+            indicators.refresh(cur, {s: c.first for s, c in changes.items()}, bar, source)
+        print(f"[NOTIFY] derived rollups and indicators for {len(changes)} symbols")
+
+    return handle
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Print (and optionally act on) ingestion change notifications.")
+    parser.add_argument("command", choices=("listen",))
+    parser.add_argument("--derive", action="store_true", help="refresh rollups and indicators for stock_prices changes")
+    parser.add_argument("--coalesce", type=float, default=0.5, help="seconds to collect notifications into one batch")
+    args = parser.parse_args(argv)
+    from app import etl
+
+    pg = etl.load_settings()["pg"]
+    listener = Listener(lambda: psycopg2.connect(**pg), args.coalesce)
+    for table in {t.table for t in (bulkload.PRICES, bulkload.DAILY)}:
+        listener.on(table, lambda changes, table=table: print(json.dumps({
+            "table": table,
+            "symbols": {s: [_iso(c.first), _iso(c.last), c.new, c.changed] for s, c in sorted(changes.items())},
+        })))
+    if args.derive:
+        listener.on(bulkload.PRICES.table, deriver(lambda: psycopg2.connect(**pg), etl.INTRADAY_BAR))
+    print(f"[NOTIFY] listening on {listener.channel}")
+    try:
+        listener.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
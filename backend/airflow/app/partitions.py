@@ -0,0 +1,162 @@
+"""Monthly range partitions for the price tables.
+
+``stock_prices`` (by ``ts``) and ``stocks`` (by ``date``) are declared
+``PARTITION BY RANGE`` with one partition per month, named
+``<table>_pYYYYMM``, plus a ``<table>_default`` partition that catches
+anything outside the prepared range. ``maintain`` is run by the DAGs to
+
+* create the partitions for the coming months ahead of time, and
+* enforce retention by detaching (and by default dropping) whole months.
+  This replaces a row-by-row ``DELETE`` that bloated the table and held
+  locks on it.
+
+The schema and the one-off conversion of existing tables are in
+``supabase/migrations/20261017090000_monthly_partitions.sql``.
+"""
+import os
+import re
+from datetime import date
+from typing import Dict, List, Tuple
+
+
+# Partitioned table -> partition key column.
+TABLES: Dict[str, str] = {
+    "stock_prices": "ts",
+    "stocks": "date",
+}
+
+_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default) or default
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    idx = month.year * 12 + month.month - 1 + n
+    return date(idx // 12, idx % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def retention_months(table: str) -> int:
+    """Months to keep (0 keeps everything). ``stocks`` keeps 2 years, as the old cleanup did."""
+    default = "24" if table == "stocks" else "0"
+    return int(_env(f"RETENTION_MONTHS_{table.upper()}", default))
+
+
+def is_partitioned(cur, table: str) -> bool:
+    cur.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+        (table,),
+    )
+    return cur.fetchone()[0]
+
+
+def list_partitions(cur, table: str) -> List[Tuple[date, str]]:
+    """Monthly partitions of ``table`` as ``(month, name)``, oldest first; the default partition is excluded."""
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        (table,),
+    )
+    out = []
+    for (name,) in cur.fetchall():
+        m = _NAME.search(name)
+        if m:
+            out.append((date(int(m.group(1)), int(m.group(2)), 1), name))
+    return sorted(out)
+
+
+def ensure_month(cur, table: str, month: date) -> bool:
+    """Create the partition for ``month`` if missing; returns True if it was created.
+
+    Rows that already landed in the default partition for that month are
+    moved into the new partition in the same transaction. Postgres refuses
+    to create a partition that would overlap rows held by the default.
+    """
+    name = partition_name(table, month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if cur.fetchone()[0]:
+        return False
+    col = TABLES[table]
+    lo, hi = month, add_months(month, 1)
+    default = f"{table}_default"
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (default,))
+    has_default = cur.fetchone()[0]
+    if has_default:
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE _partition_moved ON COMMIT DROP AS
+            WITH moved AS (DELETE FROM {default} WHERE {col} >= %s AND {col} < %s RETURNING *)
+            SELECT * FROM moved
+            """,
+            (lo, hi),
+        )
+    cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+    if has_default:
+        cur.execute(f"INSERT INTO {table} SELECT * FROM _partition_moved")
+        cur.execute("DROP TABLE _partition_moved")
+    return True
+
+
+def ensure_range(conn, table: str, first: date, last: date) -> List[str]:
+    """Create monthly partitions covering ``first``..``last`` (inclusive); returns the ones created."""
+    created = []
+    month = month_start(first)
+    with conn, conn.cursor() as cur:
+        if not is_partitioned(cur, table):
+            return created
+        while month <= month_start(last):
+            if ensure_month(cur, table, month):
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+    return created
+
+
+def enforce_retention(conn, table: str, keep_months: int, today: date | None = None, drop: bool = True) -> Dict:
+    """Detach (and drop) partitions that end before the retention cutoff.
+
+    Rows in the default partition older than the cutoff are deleted; that
+    partition only holds stragglers, so the delete stays small.
+    """
+    summary = {"detached": [], "dropped": [], "default_rows_deleted": 0}
+    if keep_months <= 0:
+        return summary
+    cutoff = add_months(month_start(today or date.today()), -keep_months)
+    with conn, conn.cursor() as cur:
+        if not is_partitioned(cur, table):
+            return summary
+        for month, name in list_partitions(cur, table):
+            if add_months(month, 1) > cutoff:
+                break
+            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            summary["detached"].append(name)
+            if drop:
+                cur.execute(f"DROP TABLE {name}")
+                summary["dropped"].append(name)
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{table}_default",))
+        if cur.fetchone()[0]:
+            cur.execute(f"DELETE FROM {table}_default WHERE {TABLES[table]} < %s", (cutoff,))
+            summary["default_rows_deleted"] = cur.rowcount
+    return summary
+
+
+def maintain(conn, today: date | None = None) -> Dict[str, Dict]:
+    """Create upcoming partitions and apply retention for every partitioned table."""
+    today = today or date.today()
+    ahead = int(_env("PARTITION_MONTHS_AHEAD", "3"))
+    drop = _env("RETENTION_ACTION", "drop").lower() != "detach"
+    out = {}
+    for table in TABLES:
+        created = ensure_range(conn, table, today, add_months(month_start(today), ahead))
+        out[table] = {"created": created, **enforce_retention(conn, table, retention_months(table), today, drop)}
+    return out
@@ -0,0 +1,197 @@
+"""Hedged calls across market-data providers.
+
+``hedged`` starts the preferred provider first. The next provider is started
+as soon as the current one fails, or once ``PROVIDER_HEDGE_AFTER_SEC`` has
+passed without an answer, and the first successful result wins. A slow
+primary then costs at most the hedge budget plus the fallback's own latency,
+not the primary's full timeout followed by the fallback. Losing calls are
+told to stop through the ``cancel`` event passed to every call. Calls that
+cannot be interrupted finish in the background, and their results are
+discarded.
+
+Calls take their rate-limit tokens through ``permit``. Time spent waiting
+for a token counts neither toward the hedge delay nor as the provider's
+latency: at 5 requests a minute the token wait alone would exceed the hedge
+budget and start the fallback on every call.
+
+Each provider's latency (successful calls only) and error rate are tracked
+as exponentially weighted averages. Once every provider has
+``MIN_SAMPLES`` calls, they are ranked by expected time to a good answer,
+``latency / success_rate``, so a faster or healthier fallback gets promoted
+to go first. Every ``PROBE_EVERY``-th call keeps the configured order, which
+gives a demoted provider the chance to win its place back.
+
+``PROVIDER_HEDGE_AFTER_SEC=0`` starts every provider at once. ``off`` only
+falls back on failure.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import count
+from typing import Callable, Dict, List, Sequence, Tuple, TypeVar
+
+from app import metrics, ratelimit
+
+
+T = TypeVar("T")
+
+DECAY = 0.2
+MIN_SAMPLES = 3
+PROBE_EVERY = 10
+_POLL_SEC = 0.05  # how often a race re-checks a call that is waiting for a permit
+
+
+class ProviderError(RuntimeError):
+    pass
+
+
+class Cancelled(RuntimeError):
+    """Raised by a call that stopped because another provider already answered."""
+
+
+def hedge_after() -> float | None:
+    raw = (os.getenv("PROVIDER_HEDGE_AFTER_SEC") or "10").strip().lower()
+    return None if raw in ("off", "none") else max(0.0, float(raw))
+
+
+class ProviderStats:
+    def __init__(self):
+        self.calls = 0
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.error_rate += DECAY * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.latency = seconds if self.latency is None else self.latency + DECAY * (seconds - self.latency)
+
+    def score(self) -> float:
+        """Expected seconds until a successful answer; lower is better."""
+        with self._lock:
+            if self.latency is None:
+                return float("inf")
+            return self.latency / max(1.0 - self.error_rate, 0.05)
+
+
+class _Clock:
+    """Time a call has spent working, without its rate-limit waits."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.waited = 0.0
+        self.paused: float | None = None
+
+    def elapsed(self) -> float:
+        now = time.perf_counter()
+        paused = self.paused
+        return now - self.started - self.waited - (now - paused if paused is not None else 0.0)
+
+
+_local = threading.local()
+
+
+def permit(provider: str) -> None:
+    """``ratelimit.acquire(provider)``, left out of the running call's hedge delay and latency."""
+    clock = getattr(_local, "clock", None)
+    if clock is None:
+        ratelimit.acquire(provider)
+        return
+    clock.paused = time.perf_counter()
+    try:
+        ratelimit.acquire(provider)
+    finally:
+        clock.waited += time.perf_counter() - clock.paused
+        clock.paused = None
+
+
+_stats: Dict[str, ProviderStats] = {}
+_stats_lock = threading.Lock()
+_calls = count(1)
+
+
+def stats(provider: str) -> ProviderStats:
+    with _stats_lock:
+        return _stats.setdefault(provider, ProviderStats())
+
+
+def ranked(providers: Sequence[str]) -> List[str]:
+    """``providers`` fastest-first once each has enough samples, otherwise as given."""
+    providers = list(providers)
+    if next(_calls) % PROBE_EVERY == 0 or any(stats(p).calls < MIN_SAMPLES for p in providers):
+        return providers
+    return sorted(providers, key=lambda p: stats(p).score())
+
+
+def _timed(provider: str, call: Callable[[threading.Event], T], cancel: threading.Event, clock: _Clock) -> T:
+    _local.clock = clock
+    try:
+        result = call(cancel)
+    except Exception:
+        if not cancel.is_set():
+            stats(provider).record(clock.elapsed(), ok=False)
+            metrics.inc("provider_errors", provider=provider)
+        raise
+    finally:
+        _local.clock = None
+    elapsed = clock.elapsed()
+    stats(provider).record(elapsed, ok=True)
+    metrics.observe("provider_call", elapsed, provider=provider)
+    return result
+
+
+def hedged(calls: Dict[str, Callable[[threading.Event], T]], after: float | None = -1.0) -> Tuple[str, T]:
+    """Run ``calls`` (provider -> ``fn(cancel)``) as a hedged race; returns ``(provider, result)``.
+
+    ``after`` (seconds) overrides ``PROVIDER_HEDGE_AFTER_SEC`` when not negative;
+    ``None`` disables hedging.
+    Raises ``ProviderError`` carrying every provider's error if all of them fail.
+    """
+    if after is not None and after < 0:
+        after = hedge_after()
+    queue = ranked(calls)
+    cancel = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=len(queue), thread_name_prefix="provider")
+    pending: Dict = {}
+    errors: Dict[str, Exception] = {}
+    latest: List[_Clock] = []  # clock of the call started last; the hedge delay runs on it
+
+    def start(provider: str) -> None:
+        clock = _Clock()
+        latest[:] = [clock]
+        pending[pool.submit(_timed, provider, calls[provider], cancel, clock)] = provider
+
+    def hedge_in() -> float | None:
+        if not queue or after is None:
+            return None
+        clock = latest[0]
+        return _POLL_SEC if clock.paused is not None else max(after - clock.elapsed(), 0.0)
+
+    start(queue.pop(0))
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=hedge_in(), return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_in() == 0.0:
+                    metrics.inc("hedges", provider=queue[0])
+                    start(queue.pop(0))
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[provider] = e
+                    if queue:
+                        metrics.inc("provider_fallbacks", provider=queue[0])
+                        start(queue.pop(0))
+                    continue
+                metrics.inc("provider_wins", provider=provider)
+                return provider, result
+        raise ProviderError("; ".join(f"{p}: {e}" for p, e in errors.items()))
+    finally:
+        cancel.set()
+        pool.shutdown(wait=False)
@@ -0,0 +1,293 @@
+"""Incremental data-quality checks, run as a ``bulkload`` merge stage.
+
+``stage_for(target, bar)`` checks each symbol's bars from the last stored bar
+before the first changed one up to the last changed one. The checks run in
+one set-based statement per write, so the cost follows what was just
+ingested and not the size of the table. The statement records:
+
+* ``gap``: runs of missing bars. The expected bars come from
+  ``generate_series`` over the trading calendar. That calendar is the set of
+  days on which *any* symbol in the write has bars, and each day spans from
+  the first to the last bar seen that day across those symbols. Weekends and
+  holidays, which have no bars for anyone, are therefore never reported.
+  Early closes and extended hours are handled without configuration.
+* ``zero_price``: a non-positive open, high, low or close. ``normalize_rows``
+  used to default missing fields to 0.
+* ``high_low``: a high below the low, or an open or close outside ``[low, high]``.
+* ``spike``: a close-to-close move above ``QUALITY_MAX_LOG_MOVE`` (a log return).
+
+Only bars on the writer's grid (multiples of ``bar`` since midnight) are
+read. Another writer's finer bars in the same table (5min next to 60min in
+``stock_prices``) are therefore neither expected slots nor neighbours.
+Findings carry the writer's ``resolution`` (``bulkload.resolution(bar)``),
+so one writer never resolves or refetches another writer's findings.
+
+Duplicate timestamps cannot reach storage: ``(symbol, ts)`` is the primary
+key, and the staging merge keeps the last copy of each key.
+
+Findings go to ``data_quality_findings``. An open finding that a later
+check over the same range no longer reproduces is marked resolved.
+``rewind`` lowers the watermarks the fetchers start from to the oldest open
+``gap``, ``zero_price`` or ``high_low`` finding. The next fetch then
+re-requests those bars. Each finding is refetched at most
+``QUALITY_MAX_REFETCHES`` times.
+
+Writers that store stand-in data can register it with ``marker_for``. For
+example, ``app.quotes`` writes one-price bars from bulk quotes. The marked
+rows are recorded as open ``provisional`` findings, so the next full fetch
+replaces them, and they are resolved once real bars have been checked over
+them.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from app import bulkload
+
+
+PROVISIONAL = "provisional"
+REFETCH_KINDS = ("gap", "zero_price", "high_low", PROVISIONAL)
+
+FINDINGS_DDL = """
+CREATE TABLE IF NOT EXISTS data_quality_findings (
+    source TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ts_from TIMESTAMP NOT NULL,
+    ts_to TIMESTAMP NOT NULL,
+    bars INTEGER NOT NULL,
+    detail TEXT,
+    detected_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    refetches INTEGER NOT NULL DEFAULT 0,
+    resolved_at TIMESTAMPTZ,
+    PRIMARY KEY (source, resolution, symbol, kind, ts_from)
+);
+-- Findings from before the resolution column: daily ones are 1d, intraday ones the etl default.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = 'data_quality_findings'::regclass AND attname = 'resolution' AND NOT attisdropped) THEN
+        ALTER TABLE data_quality_findings ADD COLUMN resolution TEXT;
+        UPDATE data_quality_findings SET resolution = CASE WHEN source = 'stocks' THEN '1d' ELSE '60min' END;
+        ALTER TABLE data_quality_findings ALTER COLUMN resolution SET NOT NULL;
+        ALTER TABLE data_quality_findings DROP CONSTRAINT data_quality_findings_pkey;
+        ALTER TABLE data_quality_findings ADD PRIMARY KEY (source, resolution, symbol, kind, ts_from);
+        DROP INDEX IF EXISTS data_quality_findings_open;
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS data_quality_findings_open
+    ON data_quality_findings (source, resolution, symbol) WHERE resolved_at IS NULL;
+"""
+
+_CHECK_SQL = """
+WITH ranges AS (
+    SELECT t.symbol,
+           COALESCE(
+               (SELECT max(p.{ts}) FROM {table} p WHERE p.symbol = t.symbol AND p.{ts} < t.first_ts AND date_bin(%(step)s, p.{ts}::timestamp, TIMESTAMP '2000-01-01') = p.{ts}::timestamp),
+               t.first_ts
+           )::timestamp AS lo,
+           t.last_ts AS hi
+    FROM unnest(%(symbols)s::text[], %(firsts)s::timestamp[], %(lasts)s::timestamp[]) AS t(symbol, first_ts, last_ts)
+), bars AS (
+    SELECT p.symbol, p.{ts}::timestamp AS ts, p.open::float8 AS open, p.high::float8 AS high,
+           p.low::float8 AS low, p.close::float8 AS close,
+           lag(p.close::float8) OVER (PARTITION BY p.symbol ORDER BY p.{ts}) AS prev_close
+    FROM ranges r
+    JOIN {table} p ON p.symbol = r.symbol AND p.{ts} BETWEEN r.lo AND r.hi AND date_bin(%(step)s, p.{ts}::timestamp, TIMESTAMP '2000-01-01') = p.{ts}::timestamp
+), sessions AS (
+    SELECT date_trunc('day', p.{ts}::timestamp) AS day, min(p.{ts})::timestamp AS open_ts, max(p.{ts})::timestamp AS close_ts
+    FROM {table} p
+    WHERE p.symbol = ANY(%(symbols)s) AND p.{ts} BETWEEN (SELECT min(lo) FROM ranges) AND (SELECT max(hi) FROM ranges) AND date_bin(%(step)s, p.{ts}::timestamp, TIMESTAMP '2000-01-01') = p.{ts}::timestamp
+    GROUP BY 1
+), expected AS (
+    -- Slots on each symbol's own grid (anchored at its first checked bar) within every session.
+    SELECT r.symbol, g.ts
+    FROM ranges r
+    JOIN sessions s ON s.day BETWEEN date_trunc('day', r.lo) AND r.hi
+    CROSS JOIN LATERAL generate_series(
+        date_bin(%(step)s, greatest(s.open_ts, r.lo) - interval '1 microsecond', r.lo) + %(step)s,
+        date_bin(%(step)s, least(s.close_ts, r.hi), r.lo),
+        %(step)s
+    ) AS g(ts)
+), missing AS (
+    SELECT e.symbol, e.ts, e.ts - %(step)s * row_number() OVER (PARTITION BY e.symbol ORDER BY e.ts) AS island
+    FROM expected e
+    WHERE NOT EXISTS (SELECT 1 FROM bars b WHERE b.symbol = e.symbol AND b.ts = e.ts)
+), found AS (
+    SELECT symbol, 'gap' AS kind, min(ts) AS ts_from, max(ts) AS ts_to, count(*)::int AS bars,
+           concat(count(*), ' missing bars') AS detail
+    FROM missing
+    GROUP BY symbol, island
+    HAVING count(*) >= %(min_gap)s
+    UNION ALL
+    SELECT b.symbol, a.kind, b.ts, b.ts, 1, a.detail
+    FROM bars b
+    CROSS JOIN LATERAL (VALUES
+        ('zero_price', least(b.open, b.high, b.low, b.close) <= 0,
+         concat_ws(' ', 'open', b.open, 'high', b.high, 'low', b.low, 'close', b.close)),
+        ('high_low', least(b.open, b.high, b.low, b.close) > 0
+                     AND (b.high < b.low OR greatest(b.open, b.close) > b.high OR least(b.open, b.close) < b.low),
+         concat_ws(' ', 'open', b.open, 'high', b.high, 'low', b.low, 'close', b.close)),
+        ('spike', b.close > 0 AND b.prev_close > 0 AND abs(ln(b.close / b.prev_close)) > %(max_move)s,
+         concat_ws(' ', 'close', b.prev_close, '->', b.close))
+    ) AS a(kind, hit, detail)
+    WHERE a.hit
+), upserted AS (
+    INSERT INTO data_quality_findings AS f (source, resolution, symbol, kind, ts_from, ts_to, bars, detail)
+    SELECT %(source)s, %(resolution)s, symbol, kind, ts_from, ts_to, bars, detail FROM found
+    ON CONFLICT (source, resolution, symbol, kind, ts_from) DO UPDATE SET
+        ts_to = EXCLUDED.ts_to, bars = EXCLUDED.bars, detail = EXCLUDED.detail,
+        last_seen_at = now(), resolved_at = NULL
+    RETURNING 1
+), resolved AS (
+    UPDATE data_quality_findings f SET resolved_at = now()
+    FROM ranges r
+    WHERE f.source = %(source)s AND f.resolution = %(resolution)s AND f.symbol = r.symbol AND f.resolved_at IS NULL
+      AND f.ts_from >= r.lo AND f.ts_to <= r.hi
+      AND NOT EXISTS (SELECT 1 FROM found x WHERE x.symbol = f.symbol AND x.kind = f.kind AND x.ts_from = f.ts_from)
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM upserted), (SELECT count(*) FROM resolved)
+"""
+
+_REWIND_SQL = """
+UPDATE data_quality_findings
+SET refetches = refetches + 1
+WHERE source = %s AND resolution = %s AND symbol = ANY(%s) AND resolved_at IS NULL
+  AND kind = ANY(%s) AND refetches < %s
+RETURNING symbol, ts_from
+"""
+
+_MARK_SQL = """
+INSERT INTO data_quality_findings AS f (source, resolution, symbol, kind, ts_from, ts_to, bars, detail)
+SELECT %(source)s, %(resolution)s, t.symbol, %(kind)s, t.first_ts, t.last_ts, t.bars, %(detail)s
+FROM unnest(%(symbols)s::text[], %(firsts)s::timestamp[], %(lasts)s::timestamp[], %(bars)s::int[])
+    AS t(symbol, first_ts, last_ts, bars)
+ON CONFLICT (source, resolution, symbol, kind, ts_from) DO UPDATE SET
+    ts_to = EXCLUDED.ts_to, bars = EXCLUDED.bars, detail = EXCLUDED.detail,
+    last_seen_at = now(), refetches = 0, resolved_at = NULL
+"""
+
+_OPEN_SQL = """
+SELECT symbol, ts_from FROM data_quality_findings
+WHERE source = %s AND resolution = %s AND symbol = ANY(%s) AND kind = %s AND resolved_at IS NULL
+"""
+
+_SUMMARY_SQL = """
+SELECT symbol, kind, count(*), sum(bars)
+FROM data_quality_findings
+WHERE source = %s AND symbol = ANY(%s) AND resolved_at IS NULL
+GROUP BY symbol, kind
+ORDER BY symbol, kind
+"""
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default) or default
+
+
+def check(cur, target: bulkload.Target, ranges: Dict[str, tuple], bar: timedelta) -> tuple:
+    """Check ``{symbol: (first, last)}`` of ``target.table``; returns ``(findings, resolved)``."""
+    if not ranges:
+        return 0, 0
+    # CREATE INDEX IF NOT EXISTS locks the table even when the index exists,
+    # which deadlocks concurrent writers (backfill slices); only run it once.
+    bulkload.ensure_table(cur, "data_quality_findings", FINDINGS_DDL, column="resolution")
+    symbols = sorted(ranges)
+    cur.execute(
+        _CHECK_SQL.format(table=target.table, ts=target.key[1]),
+        {
+            "symbols": symbols,
+            "firsts": [ranges[s][0] for s in symbols],
+            "lasts": [ranges[s][1] for s in symbols],
+            "step": bar,
+            "source": target.table,
+            "resolution": bulkload.resolution(bar),
+            "min_gap": int(_env("QUALITY_MIN_GAP_BARS", "1")),
+            "max_move": float(_env("QUALITY_MAX_LOG_MOVE", "0.5")),
+        },
+    )
+    found, resolved = cur.fetchone()
+    if found or resolved:
+        print(f"[ETL] data quality on {target.table}: {found} findings, {resolved} resolved")
+    return found, resolved
+
+
+def stage_for(target: bulkload.Target, bar: timedelta) -> Callable[[object, Dict[str, Dict]], None]:
+    """``bulkload`` merge stage checking the bars just merged into ``target`` (spaced ``bar`` apart)."""
+
+    def after_merge(cur, merged: Dict[str, Dict]) -> None:
+        check(cur, target, {sym: (m["first"], m["last"]) for sym, m in merged.items()}, bar)
+
+    return after_merge
+
+
+def marker_for(target: bulkload.Target, bar: timedelta, kind: str, detail: str) -> Callable[[object, Dict[str, Dict]], None]:
+    """``bulkload`` merge stage recording every merged range as an open ``kind`` finding of the ``bar``-wide series.
+
+    List it after ``stage_for``: the check would otherwise resolve the marks it just wrote.
+    """
+
+    def after_merge(cur, merged: Dict[str, Dict]) -> None:
+        bulkload.ensure_table(cur, "data_quality_findings", FINDINGS_DDL, column="resolution")
+        symbols = sorted(merged)
+        cur.execute(_MARK_SQL, {
+            "source": target.table, "resolution": bulkload.resolution(bar), "kind": kind, "detail": detail, "symbols": symbols,
+            "firsts": [merged[s]["first"] for s in symbols], "lasts": [merged[s]["last"] for s in symbols],
+            "bars": [merged[s]["new"] + merged[s]["changed"] for s in symbols],
+        })
+
+    return after_merge
+
+
+def _has_findings(cur) -> bool:
+    """Whether ``data_quality_findings`` exists in its current shape (upgraded by the next check otherwise)."""
+    cur.execute(
+        "SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass('data_quality_findings')"
+        " AND attname = 'resolution' AND NOT attisdropped"
+    )
+    return cur.fetchone() is not None
+
+
+def open_findings(conn, source: str, bar: timedelta, symbols, kind: str) -> Dict[str, set]:
+    """``{symbol: {ts_from, ...}}`` of the open findings of ``kind`` on the ``bar``-wide series."""
+    with conn.cursor() as cur:
+        if not _has_findings(cur):
+            return {}
+        cur.execute(_OPEN_SQL, (source, bulkload.resolution(bar), sorted(symbols), kind))
+        out: Dict[str, set] = {}
+        for sym, ts in cur.fetchall():
+            out.setdefault(sym, set()).add(ts)
+        return out
+
+
+def rewind(conn, target: bulkload.Target, bar: timedelta, marks: Dict[str, datetime], symbols) -> Dict[str, datetime]:
+    """``marks`` moved back to each symbol's oldest open refetchable finding of the ``bar``-wide series, counting the refetch."""
+    symbols = sorted(symbols)
+    with conn, conn.cursor() as cur:
+        if not symbols or not _has_findings(cur):
+            return marks
+        cur.execute(_REWIND_SQL, (target.table, bulkload.resolution(bar), symbols, list(REFETCH_KINDS), int(_env("QUALITY_MAX_REFETCHES", "3"))))
+        rows = cur.fetchall()
+    marks = dict(marks)
+    for sym, ts_from in rows:
+        # Symbols without a watermark are fetched in full anyway.
+        if sym in marks and ts_from < marks[sym]:
+            marks[sym] = ts_from
+    if rows:
+        print(f"[ETL] refetching {len(rows)} open data-quality findings for {len({s for s, _ in rows})} symbols")
+    return marks
+
+
+def summary(conn, source: str, symbols) -> Dict[str, Dict[str, int]]:
+    """Open findings per symbol: ``{symbol: {kind: bars}}``."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('data_quality_findings')")
+        if cur.fetchone()[0] is None:
+            return {}
+        cur.execute(_SUMMARY_SQL, (source, sorted(symbols)))
+        out: Dict[str, Dict[str, int]] = {}
+        for sym, kind, _, bars in cur.fetchall():
+            out.setdefault(sym, {})[kind] = int(bars)
+        return out
@@ -0,0 +1,175 @@
+"""Bulk-quote ingestion: many symbols per API call (``ETL_MODE=quotes``).
+
+A "latest price" refresh does not need each symbol's intraday series. A
+quote provider returns the current price of up to ``max_symbols`` symbols
+per request. Alpha Vantage's ``REALTIME_BULK_QUOTES`` takes 100, so a
+500-symbol watchlist costs 5 rate-limited calls instead of 500. That is
+what makes the ``10min`` schedule workable at universe scale.
+
+Each quote is written to ``stock_prices`` through the usual ``BulkWriter``
+and ``etl.PRICE_STAGES``, as a provisional bar in the intraday slot that
+contains it. The bar's open, high, low and close are all set to the quote
+price, and its volume is NULL because a quote only carries the session
+volume. Slots that already hold a real bar are never overwritten. Every
+provisional bar is recorded as an open ``provisional`` data-quality finding
+(``app.quality``). The next intraday run therefore rewinds its watermark
+over those bars and replaces them with the real ones.
+
+Providers are pluggable: subclass ``QuoteProvider`` and ``register`` a
+factory under the name selected by ``QUOTES_PROVIDER``.
+"""
+import json
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List
+
+import psycopg2
+import requests
+
+from app import bulkload, etl, metrics, quality, ratelimit, watermark
+
+
+@dataclass
+class Quote:
+    symbol: str
+    ts: datetime
+    price: float
+
+
+class QuoteProvider(ABC):
+    """Returns the latest quote of up to ``max_symbols`` symbols per ``fetch``."""
+
+    name = "base"
+    max_symbols = 1
+
+    @abstractmethod
+    def fetch(self, symbols: List[str]) -> Dict[str, Quote]:
+        """``{symbol: Quote}`` for the symbols that have a quote; missing ones are left out."""
+
+
+class AlphaVantageBulkQuotes(QuoteProvider):
+    """``REALTIME_BULK_QUOTES`` (a premium Alpha Vantage endpoint)."""
+
+    name = "alphavantage"
+    max_symbols = 100
+
+    def __init__(self, api_key: str, timeout: int, retries: int):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+
+    def fetch(self, symbols: List[str]) -> Dict[str, Quote]:
+        params = {"function": "REALTIME_BULK_QUOTES", "symbol": ",".join(symbols), "apikey": self.api_key}
+        label = f"{symbols[0]}..{symbols[-1]}" if len(symbols) > 1 else symbols[0]
+        last_err = None
+        for attempt in range(self.retries + 1):
+            try:
+                ratelimit.acquire("alphavantage")
+                with metrics.timer("fetch", provider="alphavantage", call="bulk_quotes"):
+                    resp = requests.get(etl.ALPHA_VANTAGE_URL, params=params, timeout=self.timeout)
+                    resp.raise_for_status()
+                metrics.inc("http_bytes", len(resp.content), provider="alphavantage")
+                with metrics.timer("parse", provider="alphavantage"):
+                    payload = resp.json()
+                etl._raise_for_notice(label, payload)
+                if not isinstance(payload.get("data"), list):
+                    # Keys without the premium entitlement get an "Information" message instead of data.
+                    raise RuntimeError(f"No bulk quotes returned for {label}: {json.dumps(payload)[:500]}")
+                return self._parse(payload["data"])
+            except ratelimit.RateLimitExceeded:
+                raise
+            except Exception as e:
+                last_err = e
+                if attempt < self.retries:
+                    metrics.inc("http_retries", provider="alphavantage")
+                    time.sleep(2 * (attempt + 1))
+        raise RuntimeError(f"Failed fetching bulk quotes for {label} after {self.retries + 1} attempts: {last_err}")
+
+    @staticmethod
+    def _parse(items: List[Dict]) -> Dict[str, Quote]:
+        quotes = {}
+        for item in items:
+            try:
+                symbol = str(item["symbol"]).upper()
+                price = float(item.get("close") or item.get("price"))
+                ts = datetime.fromisoformat(str(item["timestamp"]).strip())
+            except (KeyError, TypeError, ValueError):
+                continue
+            if price > 0:
+                quotes[symbol] = Quote(symbol, ts.replace(tzinfo=None), price)
+        return quotes
+
+
+PROVIDERS: Dict[str, Callable[[Dict], QuoteProvider]] = {
+    "alphavantage": lambda cfg: AlphaVantageBulkQuotes(cfg["alpha_vantage_key"], cfg["timeout"], cfg["retries"]),
+}
+
+
+def register(name: str, factory: Callable[[Dict], QuoteProvider]) -> None:
+    """Make ``factory(cfg)`` available as ``QUOTES_PROVIDER=<name>``."""
+    PROVIDERS[name] = factory
+
+
+def get_provider(cfg: Dict) -> QuoteProvider:
+    name = etl._env("QUOTES_PROVIDER", "alphavantage").lower()
+    if name not in PROVIDERS:
+        raise RuntimeError(f"Unknown QUOTES_PROVIDER: {name}")
+    return PROVIDERS[name](cfg)
+
+
+def batches(symbols: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(symbols), max(1, size)):
+        yield symbols[i:i + size]
+
+
+def slot(ts: datetime, bar=etl.INTRADAY_BAR) -> datetime:
+    """Start of the ``bar``-wide intraday slot containing ``ts``."""
+    start = datetime.combine(ts.date(), datetime.min.time())
+    return start + ((ts - start) // bar) * bar
+
+
+def quote_rows(quotes: Dict[str, Quote], marks: Dict[str, datetime], provisional: Dict[str, set]) -> Dict[str, List]:
+    """``etl`` price tuples for quotes whose slot is newer than the stored bars or already provisional."""
+    rows = {}
+    for sym, q in quotes.items():
+        ts = slot(q.ts)
+        mark = marks.get(sym)
+        if mark is None or ts > mark or ts in provisional.get(sym, ()):
+            rows[sym] = [(sym, ts, q.price, q.price, q.price, q.price, None)]
+        else:
+            rows[sym] = []
+    return rows
+
+
+def run(cfg: Dict) -> Dict[str, Dict]:
+    """``etl.run`` engine for ``ETL_MODE=quotes``."""
+    provider = get_provider(cfg)
+    symbols = cfg["symbols"]
+    conn = psycopg2.connect(**cfg["pg"])
+    try:
+        marks = watermark.load(conn, bulkload.PRICES, symbols)
+        provisional = quality.open_findings(conn, bulkload.PRICES.table, etl.INTRADAY_BAR, symbols, quality.PROVISIONAL)
+    finally:
+        conn.close()
+
+    stages = etl.PRICE_STAGES + (quality.marker_for(bulkload.PRICES, etl.INTRADAY_BAR, quality.PROVISIONAL, f"{provider.name} bulk quote"),)
+    writer = bulkload.BulkWriter(lambda: psycopg2.connect(**cfg["pg"]), bulkload.PRICES, cfg["write_batch_rows"], stages)
+    results: Dict[str, Dict] = {}
+    try:
+        for batch in batches(symbols, provider.max_symbols):
+            try:
+                quotes = provider.fetch(batch)
+            except Exception as e:
+                etl.record_results(results, {sym: {"status": "error", "error": str(e)} for sym in batch})
+                continue
+            metrics.inc("quotes", len(quotes), provider=provider.name)
+            missing = {sym: {"status": "error", "error": "no quote returned"} for sym in batch if sym not in quotes}
+            etl.record_results(results, missing)
+            for sym, rows in quote_rows(quotes, marks, provisional).items():
+                if sym in batch:
+                    etl.record_results(results, writer.add(sym, rows, skipped=0 if rows else 1))
+    finally:
+        etl.record_results(results, writer.close())
+    return {sym: results[sym] for sym in symbols if sym in results}
@@ -0,0 +1,283 @@
+"""Token-bucket rate limiting shared by every ingestion process.
+
+Each provider gets two buckets, one refilled per minute and one per day. The
+bucket state lives either in a lock-protected JSON file (processes on the same
+host) or in a small Postgres table (the Airflow workers and the python-worker
+container share the database, so this is the default).
+
+While Postgres is unreachable, the Postgres store falls back to the file
+store in ``RATE_LIMIT_STATE_DIR``. Fetches then keep running during a
+database outage, and their rows go to the write-ahead spool (app/spool.py)
+instead of failing at the limiter. The budget is then only per-host until
+the database is back.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import psycopg2
+
+from app import metrics
+
+
+PROVIDER_DEFAULTS: Dict[str, Dict[str, float]] = {
+    "alphavantage": {"per_minute": 5, "per_day": 500},
+    "apify": {"per_minute": 60, "per_day": 10000},
+}
+
+
+class RateLimitExceeded(RuntimeError):
+    pass
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default) or default
+
+
+def provider_limits(provider: str) -> Dict[str, float]:
+    defaults = PROVIDER_DEFAULTS.get(provider, {"per_minute": 60, "per_day": 100000})
+    prefix = f"RATE_LIMIT_{provider.upper()}"
+    return {
+        "per_minute": float(_env(f"{prefix}_PER_MINUTE", str(defaults["per_minute"]))),
+        "per_day": float(_env(f"{prefix}_PER_DAY", str(defaults["per_day"]))),
+    }
+
+
+def _pg_cfg_from_env() -> Dict:
+    return {
+        "host": _env("POSTGRES_HOST", "postgres"),
+        "port": int(_env("POSTGRES_PORT", "5432")),
+        "dbname": _env("POSTGRES_DB", "stocks"),
+        "user": _env("POSTGRES_USER", "admin"),
+        "password": _env("POSTGRES_PASSWORD", "adminpassword"),
+        "connect_timeout": int(_env("POSTGRES_CONNECT_TIMEOUT_SEC", "10")),
+    }
+
+
+class FileBucketStore:
+    """Bucket state in a JSON file guarded by an exclusive ``flock``."""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "buckets.json")
+
+    @contextmanager
+    def locked(self, provider: str, limits: Dict[str, float]) -> Iterator[Dict]:
+        with open(self.path, "a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                all_state = json.loads(raw) if raw.strip() else {}
+                state = all_state.get(provider) or _full_state(limits, time.time())
+                state["now"] = time.time()
+                yield state
+                state.pop("now", None)
+                all_state[provider] = state
+                fh.seek(0)
+                fh.truncate()
+                json.dump(all_state, fh)
+                fh.flush()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+BUCKETS_DDL = """
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    provider TEXT PRIMARY KEY,
+    minute_tokens DOUBLE PRECISION NOT NULL,
+    day_tokens DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+);
+"""
+
+
+RECONNECT_SEC = 30.0  # how long the Postgres store stays on its fallback before reconnecting
+
+
+class PostgresBucketStore:
+    """Bucket state in ``rate_limit_buckets``, serialized with ``SELECT ... FOR UPDATE``.
+
+    The database clock is used for refills so that containers with skewed
+    clocks still agree on how many tokens are available.
+    """
+
+    def __init__(self, pg_cfg: Dict, fallback: FileBucketStore | None = None):
+        self.pg_cfg = pg_cfg
+        self.fallback = fallback
+        self._conn = None
+        self._degraded = False
+        self._retry_at = 0.0
+        # One connection per store: threads (hedged provider calls, backfill slices) take turns.
+        self._lock = threading.Lock()
+
+    def _lost(self, error: Exception) -> None:
+        if self._conn is not None and not self._conn.closed:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+        self._conn = None
+        self._retry_at = time.monotonic() + RECONNECT_SEC
+        if not self._degraded:
+            self._degraded = True
+            where = self.fallback.path if self.fallback else "nowhere"
+            print(f"[ETL] rate limiter: Postgres unavailable ({str(error).strip()}), using {where} until it is back")
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            if time.monotonic() < self._retry_at:
+                raise psycopg2.OperationalError("still unavailable, retrying later")
+            self._conn = psycopg2.connect(**self.pg_cfg)
+            with self._conn, self._conn.cursor() as cur:
+                cur.execute(BUCKETS_DDL)
+        return self._conn
+
+    @contextmanager
+    def locked(self, provider: str, limits: Dict[str, float]) -> Iterator[Dict]:
+        with self._lock:
+            try:
+                conn = self._connection()
+                state = self._read(conn, provider, limits)
+            except psycopg2.OperationalError as e:
+                if self.fallback is None:
+                    raise
+                self._lost(e)
+                with self.fallback.locked(provider, limits) as state:
+                    yield state
+                return
+            if self._degraded:
+                self._degraded = False
+                print("[ETL] rate limiter: Postgres is back")
+            try:
+                yield state
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE rate_limit_buckets SET minute_tokens = %s, day_tokens = %s, updated_at = %s WHERE provider = %s",
+                        (state["minute"], state["day"], state["updated"], provider),
+                    )
+                conn.commit()
+            except psycopg2.OperationalError as e:
+                # The permit was already handed out; only its bookkeeping is lost.
+                self._lost(e)
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _read(conn, provider: str, limits: Dict[str, float]) -> Dict:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO rate_limit_buckets (provider, minute_tokens, day_tokens, updated_at)
+                VALUES (%s, %s, %s, extract(epoch FROM clock_timestamp()))
+                ON CONFLICT (provider) DO NOTHING
+                """,
+                (provider, limits["per_minute"], limits["per_day"]),
+            )
+            cur.execute(
+                """
+                SELECT minute_tokens, day_tokens, updated_at, extract(epoch FROM clock_timestamp())
+                FROM rate_limit_buckets WHERE provider = %s FOR UPDATE
+                """,
+                (provider,),
+            )
+            minute, day, updated, now = cur.fetchone()
+        return {"minute": minute, "day": day, "updated": updated, "now": float(now)}
+
+
+def _full_state(limits: Dict[str, float], now: float) -> Dict:
+    return {"minute": limits["per_minute"], "day": limits["per_day"], "updated": now}
+
+
+def _refill(state: Dict, limits: Dict[str, float]) -> None:
+    elapsed = max(0.0, state["now"] - state["updated"])
+    state["minute"] = min(limits["per_minute"], state["minute"] + elapsed * limits["per_minute"] / 60.0)
+    state["day"] = min(limits["per_day"], state["day"] + elapsed * limits["per_day"] / 86400.0)
+    state["updated"] = state["now"]
+
+
+class TokenBucketLimiter:
+    def __init__(self, provider: str, store, limits: Dict[str, float], max_wait_sec: float):
+        self.provider = provider
+        self.store = store
+        self.limits = limits
+        self.max_wait_sec = max_wait_sec
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until ``tokens`` permits are available; return the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.store.locked(self.provider, self.limits) as state:
+                _refill(state, self.limits)
+                if state["minute"] >= tokens and state["day"] >= tokens:
+                    state["minute"] -= tokens
+                    state["day"] -= tokens
+                    metrics.observe("ratelimit_wait", waited, provider=self.provider)
+                    return waited
+                wait = max(
+                    (tokens - state["minute"]) * 60.0 / self.limits["per_minute"],
+                    (tokens - state["day"]) * 86400.0 / self.limits["per_day"],
+                    0.05,
+                )
+            if waited + wait > self.max_wait_sec:
+                raise RateLimitExceeded(
+                    f"{self.provider} quota exhausted: next permit in {wait:.0f}s exceeds the {self.max_wait_sec:.0f}s wait budget"
+                )
+            time.sleep(wait)
+            waited += wait
+
+    def available(self) -> Dict[str, float]:
+        """Permits left in the minute and day buckets right now, without taking any."""
+        with self.store.locked(self.provider, self.limits) as state:
+            _refill(state, self.limits)
+            return {"minute": state["minute"], "day": state["day"]}
+
+    def throttled(self) -> None:
+        """Record a provider-side throttle notice so every process backs off for a full minute."""
+        metrics.inc("throttles", provider=self.provider)
+        with self.store.locked(self.provider, self.limits) as state:
+            _refill(state, self.limits)
+            state["minute"] = 0.0
+
+
+_limiters: Dict[str, TokenBucketLimiter] = {}
+
+
+def _make_store(pg_cfg: Dict | None):
+    backend = _env("RATE_LIMIT_BACKEND", "postgres").lower()
+    file_store = FileBucketStore(_env("RATE_LIMIT_STATE_DIR", "/tmp/stock-pipeline-ratelimit"))
+    if backend == "file":
+        return file_store
+    if backend == "postgres":
+        return PostgresBucketStore(pg_cfg or _pg_cfg_from_env(), fallback=file_store)
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+
+def get_limiter(provider: str, pg_cfg: Dict | None = None) -> TokenBucketLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = TokenBucketLimiter(
+            provider,
+            _make_store(pg_cfg),
+            provider_limits(provider),
+            max_wait_sec=float(_env("RATE_LIMIT_MAX_WAIT_SEC", "300")),
+        )
+        _limiters[provider] = limiter
+    return limiter
+
+
+def acquire(provider: str, pg_cfg: Dict | None = None) -> float:
+    return get_limiter(provider, pg_cfg).acquire()
+
+
+def available(provider: str, pg_cfg: Dict | None = None) -> Dict[str, float]:
+    return get_limiter(provider, pg_cfg).available()
+
+
+def throttled(provider: str, pg_cfg: Dict | None = None) -> None:
+    get_limiter(provider, pg_cfg).throttled()
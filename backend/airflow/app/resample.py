@@ -0,0 +1,231 @@
+"""Coarser bars derived locally from the finest intraday series.
+
+Fetching 60min, 5min and daily bars for the same symbols spends the API
+quota three times on overlapping data. The intraday writers only fetch the
+5min series (``ETL_INTERVAL``, 1min or 5min, for the etl writer).
+``stage_for`` is a ``bulkload`` merge stage that derives the coarser
+intervals in ``RESAMPLE_INTERVALS`` from it:
+
+* ``15min``, ``30min`` and ``60min`` bars go to ``price_rollups`` under those
+  resolutions, next to the ``1d``/``1w``/``1mo`` rollups (``GET
+  /stocks/{symbol}?interval=60min``).
+* ``1d`` (opt-in) bars go to the ``stocks`` table, aggregated over the
+  regular session (``RESAMPLE_SESSION``, default ``09:30-16:00`` exchange
+  time) like the daily endpoint. They are only derived from bars that tile
+  the session exactly (30min or finer and aligned to its start); 60min bars
+  starting at 09:00 would lose the first half hour. Derived rows fill in days
+  the daily endpoint (python-worker) has not written yet and never replace
+  its rows: those carry ``adjusted_close``, which is corporate-action data
+  and cannot be derived, so a row with ``adjusted_close`` is left alone.
+
+Only intervals that are coarser than the source bar and a multiple of it
+are derived, and only from bars on the source grid: a 60min writer ignores
+the 5min bars another writer keeps in the same table. The stage reloads each changed symbol's source bars from the
+start of the first touched day. Buckets are therefore always rebuilt from
+every stored bar, never from just the newly fetched ones, and a bucket that
+is still filling gets updated on the next write. Bucketing is vectorized
+(``resample``): bars are grouped by their floored bucket start, and
+``reduceat`` computes first-valid open, max high, min low, last-valid close
+and summed volume per bucket.
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from app import bulkload, columnar, notify, rollups
+
+
+DAY = timedelta(days=1)
+INTRADAY = {
+    "15min": timedelta(minutes=15),
+    "30min": timedelta(minutes=30),
+    "60min": timedelta(minutes=60),
+}
+
+# Derived daily bars: OHLCV only, and only over rows the daily endpoint has not written.
+DAILY_OHLCV = bulkload.Target(
+    name="daily_ohlcv",
+    table="stocks",
+    key=("symbol", "date"),
+    columns=(("symbol", "TEXT"), ("date", "DATE")) + bulkload._OHLC + (("volume", "BIGINT"),),
+    touch_column="updated_at",
+    update_when="t.adjusted_close IS NULL",
+)
+MAX_DAILY_SOURCE_BAR = timedelta(minutes=30)
+DAILY_STAGES = (notify.stage_for(DAILY_OHLCV),)
+
+
+def _env(name: str, default: str) -> str:
+    val = os.getenv(name)
+    return default if val is None else val
+
+
+def intervals() -> List[str]:
+    return [i.strip() for i in _env("RESAMPLE_INTERVALS", "15min,60min").split(",") if i.strip()]
+
+
+def session() -> Tuple[time, time]:
+    start, _, end = _env("RESAMPLE_SESSION", "09:30-16:00").partition("-")
+    return time.fromisoformat(start.strip()), time.fromisoformat(end.strip())
+
+
+def tiles_session(bar: timedelta) -> bool:
+    """Whether ``bar``-wide bars cover ``session()`` exactly, so a derived daily bar misses nothing."""
+    start, end = (t.hour * 60 + t.minute for t in session())
+    minutes = bar.total_seconds() / 60
+    return bar <= MAX_DAILY_SOURCE_BAR and start % minutes == 0 and (end - start) % minutes == 0
+
+
+@dataclass
+class Resampled:
+    bars: columnar.Bars  # ts is the bucket start
+    count: np.ndarray
+    last: np.ndarray  # ts of the last source bar in each bucket
+
+
+def resample(bars: columnar.Bars, width: timedelta, within: Tuple[time, time] | None = None) -> Resampled:
+    """Aggregate ``bars`` into ``width`` buckets aligned to midnight, optionally only bars starting ``within`` a session."""
+    ts = bars.ts.astype("datetime64[s]")
+    order = np.argsort(ts, kind="stable")
+    ts = ts[order]
+    cols = {name: getattr(bars, name)[order] for name in ("open", "high", "low", "close", "volume")}
+    if within is not None:
+        minute = (ts - ts.astype("datetime64[D]")).astype(np.int64) // 60
+        start, end = (t.hour * 60 + t.minute for t in within)
+        keep = (minute >= start) & (minute < end)
+        ts = ts[keep]
+        cols = {name: values[keep] for name, values in cols.items()}
+    n = len(ts)
+    if not n:
+        empty = np.array([], dtype="datetime64[s]")
+        return Resampled(columnar.Bars(empty, *(np.array([]) for _ in range(5)), np.array([], dtype=np.int64)),
+                         np.array([], dtype=np.int64), empty)
+
+    secs = ts.astype(np.int64)
+    step = int(width.total_seconds())
+    key = secs - secs % step
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], n]
+
+    def first_valid(values: np.ndarray) -> np.ndarray:
+        pos = np.minimum.reduceat(np.where(np.isnan(values), n, np.arange(n)), starts)
+        return np.append(values, np.nan)[pos]
+
+    def last_valid(values: np.ndarray) -> np.ndarray:
+        pos = np.maximum.reduceat(np.where(np.isnan(values), -1, np.arange(n)), starts)
+        return np.append(values, np.nan)[np.where(pos < 0, n, pos)]
+
+    volume = cols["volume"]
+    present = volume != columnar.MISSING_VOLUME
+    total = np.add.reduceat(np.where(present, volume, 0), starts)
+    out = columnar.Bars(
+        ts=key[starts].astype("datetime64[s]"),
+        open=first_valid(cols["open"]),
+        high=np.fmax.reduceat(cols["high"], starts),
+        low=np.fmin.reduceat(cols["low"], starts),
+        close=last_valid(cols["close"]),
+        adjusted_close=np.full(len(starts), np.nan),
+        volume=np.where(np.add.reduceat(present.astype(np.int64), starts) > 0, total, columnar.MISSING_VOLUME),
+    )
+    return Resampled(out, ends - starts, ts[ends - 1])
+
+
+_SOURCE_SQL = """
+SELECT p.symbol, p.{ts}, p.open::float8, p.high::float8, p.low::float8, p.close::float8, p.volume
+FROM unnest(%(symbols)s::text[], %(firsts)s::timestamp[]) AS t(symbol, first_ts)
+JOIN {table} p ON p.symbol = t.symbol AND p.{ts} >= date_trunc('day', t.first_ts) AND p.close IS NOT NULL
+    AND date_bin(%(step)s, p.{ts}::timestamp, TIMESTAMP '2000-01-01') = p.{ts}::timestamp
+ORDER BY p.symbol, p.{ts}
+"""
+
+_ROLLUP_SQL = """
+INSERT INTO price_rollups AS r (symbol, resolution, period_start, open, high, low, close, volume, bars, period_end)
+VALUES %s
+ON CONFLICT (symbol, resolution, period_start) DO UPDATE SET
+    open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close,
+    volume = EXCLUDED.volume, bars = EXCLUDED.bars, period_end = EXCLUDED.period_end
+WHERE (r.open, r.high, r.low, r.close, r.volume, r.bars, r.period_end)
+      IS DISTINCT FROM (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close,
+                        EXCLUDED.volume, EXCLUDED.bars, EXCLUDED.period_end)
+"""
+
+
+def _load(cur, target: bulkload.Target, bar: timedelta, firsts: Dict[str, datetime]) -> Dict[str, columnar.Bars]:
+    symbols = sorted(firsts)
+    cur.execute(
+        _SOURCE_SQL.format(table=target.table, ts=target.key[1]),
+        {"symbols": symbols, "firsts": [firsts[s] for s in symbols], "step": bar},
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return {}
+    sym = np.array([r[0] for r in rows], dtype=object)
+    ts = np.array([r[1] for r in rows], dtype="datetime64[s]")
+    values = np.array([r[2:6] for r in rows], dtype=np.float64)
+    volume = np.array([columnar.MISSING_VOLUME if r[6] is None else r[6] for r in rows], dtype=np.int64)
+    bounds = np.flatnonzero(np.r_[True, sym[1:] != sym[:-1], True])
+    out = {}
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        out[sym[lo]] = columnar.Bars(
+            ts=ts[lo:hi], open=values[lo:hi, 0], high=values[lo:hi, 1], low=values[lo:hi, 2],
+            close=values[lo:hi, 3], adjusted_close=np.full(hi - lo, np.nan), volume=volume[lo:hi],
+        )
+    return out
+
+
+def _nan_none(values: np.ndarray) -> list:
+    return [None if v != v else v for v in values.tolist()]
+
+
+def _rollup_rows(symbol: str, resolution: str, res: Resampled) -> List[tuple]:
+    b = res.bars
+    volume = [None if v == columnar.MISSING_VOLUME else v for v in b.volume.tolist()]
+    return list(zip(
+        [symbol] * len(b), [resolution] * len(b), b.ts.tolist(),
+        _nan_none(b.open), _nan_none(b.high), _nan_none(b.low), _nan_none(b.close),
+        volume, res.count.tolist(), res.last.tolist(),
+    ))
+
+
+def refresh(cur, target: bulkload.Target, bar: timedelta, firsts: Dict[str, datetime]) -> Dict[str, int]:
+    """Rebuild the derived buckets of each symbol from the day of its first changed bar; returns buckets per interval."""
+    wanted = [
+        i for i in intervals()
+        if (i == "1d" and tiles_session(bar)) or (i in INTRADAY and INTRADAY[i] > bar and INTRADAY[i] % bar == timedelta(0))
+    ]
+    if not wanted or not firsts or bar >= DAY:
+        return {}
+    series = _load(cur, target, bar, firsts)
+    written = dict.fromkeys(wanted, 0)
+    rows: List[tuple] = []
+    daily = []
+    for sym, bars in series.items():
+        for interval in wanted:
+            if interval == "1d":
+                res = resample(bars, DAY, session())
+                if len(res.bars):
+                    daily.append((sym, res.bars))
+            else:
+                res = resample(bars, INTRADAY[interval])
+                rows += _rollup_rows(sym, interval, res)
+            written[interval] += len(res.bars)
+    if rows:
+        bulkload.ensure_table(cur, "price_rollups", rollups.ROLLUPS_DDL)
+        execute_values(cur, _ROLLUP_SQL, rows, page_size=1000)
+    if daily:
+        bulkload.copy_bars_into_stage(cur, DAILY_OHLCV, daily)
+        bulkload.merge_stage(cur, DAILY_OHLCV, DAILY_STAGES)
+    return written
+
+
+def stage_for(target: bulkload.Target, bar: timedelta) -> Callable[[object, Dict[str, Dict]], None]:
+    """``bulkload`` merge stage deriving ``RESAMPLE_INTERVALS`` from ``target``'s ``bar``-wide bars."""
+
+    def after_merge(cur, merged: Dict[str, Dict]) -> None:
+        refresh(cur, target, bar, {sym: m["first"] for sym, m in merged.items()})
+
+    return after_merge
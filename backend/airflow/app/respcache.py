@@ -0,0 +1,258 @@
+"""On-disk cache of raw provider responses.
+
+A retried Airflow task re-runs every symbol, including the ones whose
+download already succeeded. Caching the raw response bodies lets the retry
+skip the network (and the rate limiter) for those symbols.
+
+Entries are gzip files under ``<dir>/<key hash>/<written>-<scope>-<variant>.gz``.
+The key hash covers provider, function, symbol and interval. ``variant``
+separates payload shapes of the same series, such as ``compact`` and
+``full``. ``scope`` ties an entry to the run that wrote it, so a scheduled
+run never gets the previous run's payload:
+
+* Inside an Airflow task, the scope is the DAG run (``AIRFLOW_CTX_DAG_ID`` and
+  ``AIRFLOW_CTX_DAG_RUN_ID``, or ``RESPONSE_CACHE_RUN_ID``). Retries of the
+  same run hit the cache however long the retry delay is, and the next run
+  starts empty.
+* Outside a run (manual scripts), an entry is served for
+  ``RESPONSE_CACHE_TTL_SEC`` after it was written. The default of 240s stays
+  below the shortest schedule (5min).
+
+Writing an entry removes older ones for the same variant. Reads refresh a
+file's mtime, and once the directory grows past ``RESPONSE_CACHE_MAX_MB`` the
+least recently used entries are evicted.
+
+``RESPONSE_CACHE_MODE=replay`` ignores the TTL and serves the newest cached
+body for a key in any variant. A key with no entry raises ``ReplayMiss``
+instead of going to the network, so normalize and upsert can be re-run from
+stored payloads with no network access.
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple
+
+from app import metrics
+
+
+_READ_CHUNK = 1 << 16
+
+
+class ReplayMiss(RuntimeError):
+    pass
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default) or default
+
+
+@dataclass(frozen=True)
+class Key:
+    provider: str
+    function: str
+    symbol: str
+    interval: str = ""
+    variant: str = ""
+
+    def digest(self) -> str:
+        raw = "\x1f".join((self.provider, self.function, self.symbol, self.interval))
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+class ResponseCache:
+    def __init__(self, directory: str, ttl_sec: float, max_bytes: int, mode: str = "on"):
+        self.directory = directory
+        self.ttl_sec = max(1.0, ttl_sec)
+        self.max_bytes = max_bytes
+        self.mode = mode
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("on", "replay")
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == "replay"
+
+    def _dir(self, key: Key) -> str:
+        return os.path.join(self.directory, key.digest())
+
+    def _path(self, key: Key) -> str | None:
+        if self.replay:
+            return self._newest(key)
+        scope = run_scope()
+        suffix = f"-{scope or '_'}-{key.variant}.gz"
+        try:
+            names = [n for n in os.listdir(self._dir(key)) if n.endswith(suffix)]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        newest = max(names, key=_written)
+        if not scope and time.time() - _written(newest) > self.ttl_sec:
+            return None
+        return os.path.join(self._dir(key), newest)
+
+    def _newest(self, key: Key) -> str | None:
+        try:
+            names = [n for n in os.listdir(self._dir(key)) if n.endswith(".gz")]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        return os.path.join(self._dir(key), max(names, key=_written))
+
+    def _miss(self, key: Key) -> None:
+        if self.replay:
+            raise ReplayMiss(f"No cached {key.provider} response for {key.symbol} ({key.function})")
+
+    def read(self, key: Key) -> Iterator[bytes] | None:
+        """Decompressed chunks of the cached body, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        if path is None:
+            metrics.inc("cache_misses", provider=key.provider)
+            self._miss(key)
+            return None
+        try:
+            os.utime(path)
+            fh = gzip.open(path, "rb")
+        except FileNotFoundError:  # evicted by another process
+            metrics.inc("cache_misses", provider=key.provider)
+            self._miss(key)
+            return None
+        metrics.inc("cache_hits", provider=key.provider)
+        return _chunks(fh)
+
+    def get(self, key: Key) -> bytes | None:
+        chunks = self.read(key)
+        return None if chunks is None else b"".join(chunks)
+
+    @contextmanager
+    def recording(self, key: Key) -> Iterator["_Recorder"]:
+        """Record a body into the cache; it is published only if the block exits cleanly.
+
+        Parse and validate the payload inside the block so that a provider
+        notice or a truncated download never becomes a cache entry.
+        """
+        if not self.enabled or self.replay:
+            yield _Recorder(None)
+            return
+        directory = self._dir(key)
+        os.makedirs(directory, exist_ok=True)
+        final = os.path.join(directory, f"{time.time_ns()}-{run_scope() or '_'}-{key.variant}.gz")
+        tmp = f"{final}.{os.getpid()}.tmp"
+        try:
+            with gzip.open(tmp, "wb", compresslevel=6) as fh:
+                yield _Recorder(fh)
+            meta = os.path.join(directory, "key.json")
+            if not os.path.exists(meta):
+                with open(meta, "w") as mf:
+                    json.dump({"provider": key.provider, "function": key.function,
+                               "symbol": key.symbol, "interval": key.interval}, mf)
+            os.replace(tmp, final)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._drop_superseded(final, key.variant)
+        self.evict()
+
+    def _drop_superseded(self, keep: str, variant: str) -> None:
+        directory = os.path.dirname(keep)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(f"-{variant}.gz") and path != keep and _written(name) < _written(os.path.basename(keep)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def put(self, key: Key, body: bytes) -> None:
+        with self.recording(key) as rec:
+            rec.write(body)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        out = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".gz"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the cache fits in ``max_bytes``."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+class _Recorder:
+    def __init__(self, fh):
+        self._fh = fh
+
+    def write(self, data: bytes) -> None:
+        if self._fh is not None:
+            self._fh.write(data)
+
+    def tee(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+
+
+def _written(name: str) -> float:
+    """Write time (epoch seconds) of a cache file name."""
+    return int(name.split("-", 1)[0]) / 1e9
+
+
+def run_scope() -> str:
+    """Digest of the current pipeline run, or ``""`` outside one."""
+    run_id = os.getenv("RESPONSE_CACHE_RUN_ID") or os.getenv("AIRFLOW_CTX_DAG_RUN_ID")
+    if not run_id:
+        return ""
+    raw = f"{os.getenv('AIRFLOW_CTX_DAG_ID', '')}\x1f{run_id}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def _chunks(fh) -> Iterator[bytes]:
+    with fh:
+        while True:
+            chunk = fh.read(_READ_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+_cache: ResponseCache | None = None
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(
+            directory=_env("RESPONSE_CACHE_DIR", "/tmp/stock-pipeline-responses"),
+            ttl_sec=float(_env("RESPONSE_CACHE_TTL_SEC", "240")),
+            max_bytes=int(float(_env("RESPONSE_CACHE_MAX_MB", "512")) * 1024 * 1024),
+            mode=_env("RESPONSE_CACHE_MODE", "on").lower(),
+        )
+    return _cache
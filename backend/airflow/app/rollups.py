@@ -0,0 +1,81 @@
+"""Daily, weekly and monthly OHLCV rollups of ``stock_prices``.
+
+``price_rollups`` holds one row per ``(symbol, resolution, period_start)``.
+``after_merge`` is registered as a ``bulkload`` merge stage. Inside the
+write transaction it recomputes, from the raw bars, only the buckets that
+overlap the time range each symbol just changed. The work is proportional
+to the new data and not to the table size. Long-range charts read these
+rows instead of aggregating thousands of raw bars.
+"""
+from datetime import datetime
+from typing import Dict, Tuple
+
+from app import bulkload
+
+
+ROLLUPS_DDL = """
+CREATE TABLE IF NOT EXISTS price_rollups (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    period_start TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume BIGINT,
+    bars INTEGER NOT NULL,
+    period_end TIMESTAMP NOT NULL,
+    PRIMARY KEY (symbol, resolution, period_start)
+);
+"""
+
+# resolution -> (date_trunc unit, bucket width)
+RESOLUTIONS: Dict[str, Tuple[str, str]] = {
+    "1d": ("day", "1 day"),
+    "1w": ("week", "1 week"),
+    "1mo": ("month", "1 month"),
+}
+
+_REFRESH_SQL = """
+INSERT INTO price_rollups AS r (symbol, resolution, period_start, open, high, low, close, volume, bars, period_end)
+SELECT p.symbol, %(resolution)s, date_trunc(%(unit)s, p.ts) AS period_start,
+       (array_agg(p.open ORDER BY p.ts) FILTER (WHERE p.open IS NOT NULL))[1],
+       max(p.high), min(p.low),
+       (array_agg(p.close ORDER BY p.ts DESC) FILTER (WHERE p.close IS NOT NULL))[1],
+       sum(p.volume), count(*), max(p.ts)
+FROM unnest(%(symbols)s::text[], %(firsts)s::timestamp[], %(lasts)s::timestamp[]) AS t(symbol, first_ts, last_ts)
+JOIN {source} p
+  ON p.symbol = t.symbol
+ AND p.ts >= date_trunc(%(unit)s, t.first_ts)
+ AND p.ts < date_trunc(%(unit)s, t.last_ts) + %(width)s::interval
+GROUP BY p.symbol, date_trunc(%(unit)s, p.ts)
+ON CONFLICT (symbol, resolution, period_start) DO UPDATE SET
+    open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close,
+    volume = EXCLUDED.volume, bars = EXCLUDED.bars, period_end = EXCLUDED.period_end
+WHERE (r.open, r.high, r.low, r.close, r.volume, r.bars, r.period_end)
+      IS DISTINCT FROM (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close,
+                        EXCLUDED.volume, EXCLUDED.bars, EXCLUDED.period_end)
+"""
+
+
+def refresh(cur, touched: Dict[str, Tuple[datetime, datetime]], source: str = bulkload.PRICES.table) -> int:
+    """Recompute the rollup buckets overlapping each symbol's touched ``(first, last)`` range."""
+    if not touched:
+        return 0
+    symbols = sorted(touched)
+    params = {
+        "symbols": symbols,
+        "firsts": [touched[s][0] for s in symbols],
+        "lasts": [touched[s][1] for s in symbols],
+    }
+    bulkload.ensure_table(cur, "price_rollups", ROLLUPS_DDL)
+    updated = 0
+    for resolution, (unit, width) in RESOLUTIONS.items():
+        cur.execute(_REFRESH_SQL.format(source=source), {**params, "resolution": resolution, "unit": unit, "width": width})
+        updated += cur.rowcount
+    return updated
+
+
+def after_merge(cur, merged: Dict[str, Dict]) -> None:
+    """``bulkload`` merge stage for ``stock_prices`` writers."""
+    refresh(cur, {sym: (m["first"], m["last"]) for sym, m in merged.items()})
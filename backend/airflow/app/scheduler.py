@@ -0,0 +1,372 @@
+"""Demand-driven symbol selection for the fetchers.
+
+With ``SYMBOL_SOURCE=static`` (default), each run fetches every symbol in
+``SYMBOLS``. With ``SYMBOL_SOURCE=demand``, ``select`` plans each run
+instead:
+
+* The universe is ``SYMBOLS`` plus every symbol on a watchlist
+  (``user_preferences.watchlist``) or held in ``portfolios``.
+* Each symbol gets a demand score from three signals: the market value held
+  (quantity times the ``latest_quotes`` close, falling back to the buy
+  price), how many users watch it, and its page views over the last
+  ``SCHEDULER_VIEW_DAYS`` days (``symbol_views``, counted by the Go API).
+* Symbols are ranked by score and dealt into ``SCHEDULER_TIERS``. The
+  default ``hot:0.1:1h,warm:0.3:4h,cold:1:24h`` puts the top 10% of the
+  universe in ``hot`` and refreshes it every hour, the next 30% every four
+  hours, and the rest daily. Symbols without any demand are always in the
+  last tier.
+* A symbol's staleness is the time since its last successful refresh
+  (``symbol_schedule``, written by ``record``) divided by its tier's
+  interval. Without a recorded refresh, the age of its newest bar is used,
+  and symbols with no bars at all come first. Bar timestamps are exchange
+  time (``SCHEDULER_EXCHANGE_TZ``, default ``America/New_York``) and are
+  converted to UTC first.
+* The run fetches the due symbols (staleness >= 1) hottest tier first, then
+  the most stale. Any budget left is spent on the symbols closest to due.
+  Symbols whose last attempt failed go after the other due symbols, so a
+  broken ticker cannot crowd out the rest.
+
+The budget is the provider calls this run may spend: the day bucket's
+share for one ``SCHEDULER_PERIOD_SEC`` (the DAG's schedule, default one
+hour). It is capped by what the rate limiter has left and can be pinned
+with ``SCHEDULER_RUN_BUDGET``. ``symbols_per_call`` covers providers that
+serve several symbols per call (bulk quotes).
+
+    python -m app.scheduler plan   # print the next plan without recording anything
+"""
+import argparse
+import json
+import math
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from typing import Callable, Dict, List, Sequence
+
+from app import bulkload, ratelimit, watermark
+
+
+SCHEDULE_DDL = """
+CREATE TABLE IF NOT EXISTS symbol_views (
+    symbol TEXT NOT NULL,
+    day DATE NOT NULL,
+    views BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (symbol, day)
+);
+CREATE TABLE IF NOT EXISTS symbol_schedule (
+    source TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    tier TEXT,
+    score DOUBLE PRECISION,
+    last_attempt_at TIMESTAMPTZ,
+    last_refreshed_at TIMESTAMPTZ,
+    last_error TEXT,
+    PRIMARY KEY (source, symbol)
+);
+"""
+
+_DEMAND_SQL = """
+WITH universe AS (
+    SELECT upper(s) AS symbol FROM unnest(%(static)s::text[]) AS s
+    UNION SELECT upper(w) FROM user_preferences, unnest(watchlist) AS w
+    UNION SELECT upper(symbol) FROM portfolios WHERE quantity > 0
+), held AS (
+    SELECT upper(p.symbol) AS symbol, sum(p.quantity * coalesce(q.close, p.avg_buy_price))::float8 AS value
+    FROM portfolios p
+    LEFT JOIN latest_quotes q ON q.symbol = upper(p.symbol)
+    WHERE p.quantity > 0
+    GROUP BY 1
+), watched AS (
+    SELECT upper(w) AS symbol, count(DISTINCT user_id) AS watchers
+    FROM user_preferences, unnest(watchlist) AS w
+    GROUP BY 1
+), viewed AS (
+    SELECT symbol, sum(views) AS views FROM symbol_views
+    WHERE day > current_date - %(view_days)s
+    GROUP BY 1
+)
+SELECT u.symbol, coalesce(h.value, 0), coalesce(w.watchers, 0), coalesce(v.views, 0),
+       s.last_refreshed_at, s.last_attempt_at, s.last_error IS NOT NULL
+FROM universe u
+LEFT JOIN held h USING (symbol)
+LEFT JOIN watched w USING (symbol)
+LEFT JOIN viewed v USING (symbol)
+LEFT JOIN symbol_schedule s ON s.source = %(source)s AND s.symbol = u.symbol
+WHERE u.symbol <> ''
+"""
+
+_PLANNED_SQL = """
+INSERT INTO symbol_schedule AS s (source, symbol, tier, score)
+SELECT %(source)s, * FROM unnest(%(symbols)s::text[], %(tiers)s::text[], %(scores)s::float8[])
+ON CONFLICT (source, symbol) DO UPDATE SET tier = EXCLUDED.tier, score = EXCLUDED.score
+"""
+
+_RECORD_SQL = """
+INSERT INTO symbol_schedule AS s (source, symbol, last_attempt_at, last_refreshed_at, last_error)
+SELECT %(source)s, t.symbol, now(), CASE WHEN t.error IS NULL THEN now() END, t.error
+FROM unnest(%(symbols)s::text[], %(errors)s::text[]) AS t(symbol, error)
+ON CONFLICT (source, symbol) DO UPDATE SET
+    last_attempt_at = EXCLUDED.last_attempt_at,
+    last_refreshed_at = coalesce(EXCLUDED.last_refreshed_at, s.last_refreshed_at),
+    last_error = EXCLUDED.last_error
+"""
+
+# Demand score weights: log market value held, watchers, log recent views.
+WEIGHTS = {"value": 1.0, "watchers": 2.0, "views": 1.0}
+
+
+def _env(name: str, default: str) -> str:
+    val = os.getenv(name)
+    return default if val is None else val
+
+
+def enabled() -> bool:
+    return _env("SYMBOL_SOURCE", "static").strip().lower() == "demand"
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    share: float
+    every: timedelta
+
+
+def _duration(text: str) -> timedelta:
+    units = {"m": "minutes", "h": "hours", "d": "days"}
+    text = text.strip().lower()
+    if text[-1:] in units:
+        return timedelta(**{units[text[-1]]: float(text[:-1])})
+    return timedelta(minutes=float(text))
+
+
+def tiers() -> List[Tier]:
+    out = []
+    for spec in _env("SCHEDULER_TIERS", "hot:0.1:1h,warm:0.3:4h,cold:1:24h").split(","):
+        name, share, every = spec.strip().split(":")
+        out.append(Tier(name, float(share), _duration(every)))
+    if not out:
+        raise RuntimeError("SCHEDULER_TIERS must define at least one tier")
+    return out
+
+
+@dataclass
+class Demand:
+    symbol: str
+    value: float = 0.0
+    watchers: int = 0
+    views: int = 0
+    last_refreshed: datetime | None = None
+    last_attempt: datetime | None = None
+    failing: bool = False
+
+    @property
+    def score(self) -> float:
+        return (
+            WEIGHTS["value"] * math.log1p(max(self.value, 0.0))
+            + WEIGHTS["watchers"] * self.watchers
+            + WEIGHTS["views"] * math.log1p(self.views)
+        )
+
+
+@dataclass
+class Plan:
+    symbols: List[str]  # to fetch this run, in priority order
+    tier: Dict[str, str]  # every symbol of the universe
+    score: Dict[str, float]
+    staleness: Dict[str, float]
+    due: int
+    budget: int
+    skipped: List[str] = field(default_factory=list)  # due but over budget
+
+    def summary(self) -> Dict:
+        counts: Dict[str, int] = {}
+        for sym in self.symbols:
+            counts[self.tier[sym]] = counts.get(self.tier[sym], 0) + 1
+        return {
+            "universe": len(self.tier),
+            "due": self.due,
+            "budget": self.budget,
+            "planned": len(self.symbols),
+            "planned_by_tier": counts,
+            "skipped_due": len(self.skipped),
+        }
+
+
+def load_demand(conn, source: str, static: Sequence[str]) -> Dict[str, Demand]:
+    with conn.cursor() as cur:
+        cur.execute(SCHEDULE_DDL)
+        cur.execute(_DEMAND_SQL, {
+            "static": list(static),
+            "view_days": int(_env("SCHEDULER_VIEW_DAYS", "7")),
+            "source": source,
+        })
+        rows = cur.fetchall()
+    return {
+        sym: Demand(sym, value or 0.0, watchers, int(views), _naive(refreshed), _naive(attempt), failing)
+        for sym, value, watchers, views, refreshed, attempt, failing in rows
+    }
+
+
+def exchange_to_utc(value: datetime) -> datetime:
+    """Naive exchange-local bar time as naive UTC."""
+    tz = ZoneInfo(_env("SCHEDULER_EXCHANGE_TZ", "America/New_York"))
+    return value.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _naive(value: datetime | None) -> datetime | None:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def assign_tiers(demand: Dict[str, Demand], levels: Sequence[Tier]) -> Dict[str, Tier]:
+    """Deal symbols into ``levels`` by score; symbols without demand always get the last one."""
+    ranked = sorted(demand.values(), key=lambda d: (-d.score, d.symbol))
+    out: Dict[str, Tier] = {}
+    bound, start = 0, 0
+    for level in levels[:-1]:
+        bound += math.ceil(level.share * len(ranked))
+        for d in ranked[start:bound]:
+            if d.score > 0:
+                out[d.symbol] = level
+        start = max(start, bound)
+    for d in ranked:
+        out.setdefault(d.symbol, levels[-1])
+    return out
+
+
+def plan(
+    demand: Dict[str, Demand],
+    marks: Dict[str, datetime],  # newest bar per symbol, exchange time
+    budget: int,
+    levels: Sequence[Tier] | None = None,
+    now: datetime | None = None,
+) -> Plan:
+    """Pick at most ``budget`` symbols: due ones by tier and staleness, then the closest to due."""
+    levels = list(levels or tiers())
+    now = now or datetime.utcnow()
+    tier_of = assign_tiers(demand, levels)
+    rank = {level.name: i for i, level in enumerate(levels)}
+    staleness: Dict[str, float] = {}
+    for sym, d in demand.items():
+        mark = marks.get(sym)
+        seen = d.last_refreshed or (exchange_to_utc(mark) if mark else None)
+        every = tier_of[sym].every.total_seconds()
+        staleness[sym] = math.inf if seen is None else max((now - seen).total_seconds(), 0.0) / every
+
+    def failed_recently(d: Demand) -> bool:
+        return d.failing and d.last_attempt is not None and now - d.last_attempt < tier_of[d.symbol].every
+
+    due = sorted(
+        (s for s in demand if staleness[s] >= 1.0),
+        key=lambda s: (failed_recently(demand[s]), rank[tier_of[s].name], -staleness[s], -demand[s].score, s),
+    )
+    rest = sorted((s for s in demand if staleness[s] < 1.0), key=lambda s: (-staleness[s], -demand[s].score, s))
+    budget = max(budget, 0)
+    return Plan(
+        symbols=(due + rest)[:budget],
+        tier={s: t.name for s, t in tier_of.items()},
+        score={s: d.score for s, d in demand.items()},
+        staleness=staleness,
+        due=len(due),
+        budget=budget,
+        skipped=due[budget:],
+    )
+
+
+def run_budget(provider: str = "alphavantage", symbols_per_call: int = 1) -> int:
+    """Symbols this run may fetch: the day bucket's share for ``SCHEDULER_PERIOD_SEC``, capped by what is left."""
+    pinned = _env("SCHEDULER_RUN_BUDGET", "").strip()
+    if pinned:
+        calls = float(pinned)
+    else:
+        limits = ratelimit.provider_limits(provider)
+        period = float(_env("SCHEDULER_PERIOD_SEC", "3600"))
+        calls = min(limits["per_day"] * period / 86400.0, ratelimit.available(provider)["day"])
+    return int(math.floor(calls)) * max(symbols_per_call, 1)
+
+
+def select(
+    connect: Callable,
+    target: bulkload.Target,
+    static: Sequence[str],
+    provider: str = "alphavantage",
+    symbols_per_call: int = 1,
+) -> List[str]:
+    """Symbols to fetch into ``target`` this run: ``static`` unless ``SYMBOL_SOURCE=demand``."""
+    static = [s.strip().upper() for s in static if s.strip()]
+    if not enabled():
+        return static
+    try:
+        conn = connect()
+        try:
+            with conn:
+                demand = load_demand(conn, target.name, static)
+                marks = watermark.load(conn, target, demand)
+                result = plan(demand, marks, run_budget(provider, symbols_per_call))
+                with conn.cursor() as cur:
+                    syms = sorted(result.tier)
+                    cur.execute(_PLANNED_SQL, {
+                        "source": target.name,
+                        "symbols": syms,
+                        "tiers": [result.tier[s] for s in syms],
+                        "scores": [result.score[s] for s in syms],
+                    })
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[SCHED] Could not plan from demand, fetching SYMBOLS: {e}")
+        return static
+    print(f"[SCHED] {target.name}: {json.dumps(result.summary())}")
+    return result.symbols
+
+
+def record(connect: Callable, target: bulkload.Target, results: Dict[str, Dict]) -> None:
+    """Remember when each symbol was last attempted and last refreshed successfully."""
+    if not enabled() or not results:
+        return
+    syms = sorted(results)
+    try:
+        conn = connect()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(SCHEDULE_DDL)
+                cur.execute(_RECORD_SQL, {
+                    "source": target.name,
+                    "symbols": syms,
+                    "errors": [None if results[s].get("status") == "ok" else str(results[s].get("error", ""))[:500] for s in syms],
+                })
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[SCHED] Could not record refreshes: {e}")
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Show the demand-driven fetch plan.")
+    parser.add_argument("command", choices=("plan",))
+    parser.add_argument("--target", choices=("prices", "prices_adjusted"), default="prices")
+    parser.add_argument("--budget", type=int, help="symbols to plan for (default: the run budget)")
+    args = parser.parse_args(argv)
+    import psycopg2
+    from app import etl
+
+    cfg = etl.load_settings()
+    target = {t.name: t for t in (bulkload.PRICES, bulkload.PRICES_ADJUSTED)}[args.target]
+    conn = psycopg2.connect(**cfg["pg"])
+    try:
+        demand = load_demand(conn, target.name, cfg["symbols"])
+        marks = watermark.load(conn, target, demand)
+        conn.rollback()
+    finally:
+        conn.close()
+    result = plan(demand, marks, run_budget() if args.budget is None else args.budget)
+    print(json.dumps(result.summary()))
+    for sym in sorted(result.tier, key=lambda s: (-result.staleness[s], s)):
+        mark = "*" if sym in result.symbols else " "
+        print(f"{mark} {sym:<10} {result.tier[sym]:<6} score={result.score[sym]:7.2f} staleness={result.staleness[sym]:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,22 @@
+"""Split the symbol universe into shards for dynamic task mapping.
+
+Symbols are dealt round-robin so that shards stay the same size. The
+``SYMBOLS`` order (usually most important first) is spread across shards
+instead of piling into the first one.
+"""
+import os
+from typing import Dict, List, Sequence
+
+
+def split(symbols: Sequence[str], count: int) -> List[List[str]]:
+    count = max(1, min(count, len(symbols)))
+    return [list(symbols[i::count]) for i in range(count)] if symbols else []
+
+
+def shard_count() -> int:
+    return int(os.getenv("ETL_SHARDS", "4") or "4")
+
+
+def plan(symbols: Sequence[str], count: int | None = None) -> List[Dict[str, List[str]]]:
+    """``op_kwargs`` for each mapped task instance, one ``{"symbols": [...]}`` per shard."""
+    return [{"symbols": shard} for shard in split(symbols, count or shard_count())]
@@ -0,0 +1,357 @@
+"""Local write-ahead spool for rows that could not be written to Postgres.
+
+When a ``BulkWriter`` flush fails because the database is down, locked or
+slower than ``SPOOL_WRITE_TIMEOUT_SEC``, the rows are appended to a local
+spool instead of being thrown away. The next run replays the spool before
+it fetches anything, so a quota-limited download is never repeated just
+because the write failed. Only connection-level errors (``OperationalError``
+and ``InterfaceError``: refused connections, timeouts, lock timeouts,
+deadlocks) are spooled. A write that would fail again on replay, such as a
+schema error, is still reported as an error.
+
+The spool lives under ``<SPOOL_DIR>/<target>/`` as segment files named
+``<time_ns>-<pid>.seg``, which sort in the order they were written. A segment
+is a sequence of records. Each record is a ``SPR1`` header (payload length
+and crc32) followed by a symbol and its bars as fixed-width little-endian
+columns (``columnar.Bars``), 56 bytes per bar. The writer fsyncs after every
+append and holds an exclusive ``flock`` on its open segment. ``drain``
+replays closed segments oldest first, one transaction per segment, and
+deletes each segment once it has committed. A record that is truncated or
+fails its checksum ends the segment: the records before it are replayed and
+the file is kept as ``.bad``.
+
+Once a flush has been spooled, or segments are left after a drain, the rest
+of the process's writes to that target go straight to the spool. New rows
+therefore never overtake older spooled ones, and a dead database costs one
+timeout per run instead of one per flush. Replay goes through the usual
+merge and stages, so replaying a segment twice is harmless.
+
+``python -m app.spool status`` lists what is pending, and ``python -m
+app.spool drain [--every SEC]`` replays it outside the pipeline runs.
+``SPOOL_DIR=`` (empty) turns spooling off.
+"""
+import argparse
+import fcntl
+import os
+import struct
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import psycopg2
+
+from app import bulkload, columnar, metrics
+
+
+_MAGIC = b"SPR1"
+_HEADER = struct.Struct("<4sII")  # magic, payload length, crc32(payload)
+_RECORD = struct.Struct("<HI")  # symbol length, bars
+_COLUMNS = (
+    ("ts", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("adjusted_close", "<f8"),
+    ("volume", "<i8"),
+)
+_SEGMENT_SUFFIX = ".seg"
+
+
+class CorruptRecord(RuntimeError):
+    pass
+
+
+def _env(name: str, default: str) -> str:
+    val = os.getenv(name)
+    return default if val is None else val
+
+
+def _ts_text(value) -> str:
+    # TIMESTAMP columns ignore a UTC offset on input, so it is dropped here as well.
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value).strip()
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).replace(tzinfo=None).isoformat()
+    except ValueError:
+        return text
+
+
+def to_bars(target: bulkload.Target, rows) -> columnar.Bars:
+    """``rows`` as ``Bars``: tuples in ``target.columns`` order are converted, ``Bars`` pass through."""
+    if isinstance(rows, columnar.Bars):
+        return rows
+    names = target.column_names
+    cols = dict(zip(names, zip(*rows))) if len(rows) else {name: () for name in names}
+    ts_col = target.key[1]
+    return columnar.from_columns(
+        [_ts_text(v) for v in cols[ts_col]],
+        {name: values for name, values in cols.items() if name not in target.key},
+    )
+
+
+def encode(symbol: str, bars: columnar.Bars) -> bytes:
+    sym = symbol.encode()
+    parts = [_RECORD.pack(len(sym), len(bars)), sym]
+    for name, dtype in _COLUMNS:
+        values = getattr(bars, name)
+        if name == "ts":
+            values = values.astype("datetime64[s]").astype(np.int64)
+        parts.append(np.ascontiguousarray(values, dtype=dtype).tobytes())
+    payload = b"".join(parts)
+    return _HEADER.pack(_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload: bytes) -> Tuple[str, columnar.Bars]:
+    sym_len, n = _RECORD.unpack_from(payload)
+    offset = _RECORD.size
+    symbol = payload[offset:offset + sym_len].decode()
+    offset += sym_len
+    if len(payload) != offset + 8 * n * len(_COLUMNS):
+        raise CorruptRecord(f"record for {symbol} has {len(payload)} bytes, expected {offset + 8 * n * len(_COLUMNS)}")
+    columns = {}
+    for name, dtype in _COLUMNS:
+        values = np.frombuffer(payload, dtype=dtype, count=n, offset=offset)
+        offset += 8 * n
+        columns[name] = values.astype("datetime64[s]") if name == "ts" else values.astype(dtype[1:])
+    return symbol, columnar.Bars(**columns)
+
+
+def read_segment(path: str) -> Iterator[Tuple[str, columnar.Bars]]:
+    """Records of a segment in write order; raises ``CorruptRecord`` where it stops being readable."""
+    with open(path, "rb") as fh:
+        while True:
+            header = fh.read(_HEADER.size)
+            if not header:
+                return
+            if len(header) < _HEADER.size:
+                raise CorruptRecord(f"truncated header at byte {fh.tell() - len(header)}")
+            magic, length, crc = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise CorruptRecord(f"bad magic at byte {fh.tell() - _HEADER.size}")
+            payload = fh.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                raise CorruptRecord(f"truncated or corrupt record at byte {fh.tell() - len(payload) - _HEADER.size}")
+            yield decode(payload)
+
+
+def _try_lock(fh) -> bool:
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+class Spool:
+    def __init__(self, directory: str, target: bulkload.Target, segment_bytes: int, write_timeout: float):
+        self.directory = directory
+        self.target = target
+        self.segment_bytes = segment_bytes
+        self.write_timeout = write_timeout
+        # Set once a write has been spooled or a drain left segments behind.
+        self.blocked = False
+        self._segment = None
+
+    @staticmethod
+    def transient(exc: BaseException) -> bool:
+        """Errors a later replay can be expected to get past."""
+        return isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+    def segments(self) -> List[str]:
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(_SEGMENT_SUFFIX))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    def append(self, pending: Sequence[Tuple[str, object, int]]) -> Dict[str, int]:
+        """Append ``BulkWriter`` pending ``(symbol, rows, skipped)`` entries; returns bars spooled per symbol."""
+        spooled: Dict[str, int] = {}
+        with metrics.timer("spool", table=self.target.table):
+            for symbol, rows, _ in pending:
+                if not len(rows):
+                    continue
+                bars = to_bars(self.target, rows)
+                fh = self._open()
+                fh.write(encode(symbol, bars))
+                spooled[symbol] = spooled.get(symbol, 0) + len(bars)
+            if self._segment is not None:
+                self._segment.flush()
+                os.fsync(self._segment.fileno())
+                if self._segment.tell() >= self.segment_bytes:
+                    self.close()
+        metrics.inc("spooled_rows", sum(spooled.values()), table=self.target.table)
+        return spooled
+
+    def _open(self):
+        if self._segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}{_SEGMENT_SUFFIX}")
+            fh = open(path, "ab")
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            self._segment = fh
+        return self._segment
+
+    def close(self) -> None:
+        """Close the open segment, making it available to ``drain``."""
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def drain(self, connect: Callable, stages: Sequence[Callable] = (), flush_rows: int = 50000) -> Dict[str, Dict]:
+        """Replay closed segments oldest first; returns per-symbol ``BulkWriter`` results of what was committed.
+
+        Stops at the first segment that fails to commit or is still being
+        written, leaving it and everything after it for a later drain.
+        """
+        self.close()
+        if not self.segments():
+            self.blocked = False
+            return {}
+        os.makedirs(self.directory, exist_ok=True)
+        results: Dict[str, Dict] = {}
+        with open(os.path.join(self.directory, "drain.lock"), "a") as lock:
+            if not _try_lock(lock):
+                self.blocked = True
+                return results
+            writer = bulkload.BulkWriter(connect, self.target, flush_rows, stages)
+            try:
+                for path in self.segments():
+                    ok, written = self._replay(writer, path)
+                    bulkload.combine_results(results, written)
+                    if not ok:
+                        break
+            finally:
+                bulkload.combine_results(results, writer.close())
+        self.blocked = bool(self.segments())
+        if results or self.blocked:
+            rows = sum(r.get("rows", 0) for r in results.values() if r["status"] == "ok")
+            left = len(self.segments())
+            print(f"[SPOOL] replayed {rows} {self.target.table} rows for {len(results)} symbols, {left} segments left")
+        return {sym: res for sym, res in results.items() if res["status"] == "ok"}
+
+    def _replay(self, writer: bulkload.BulkWriter, path: str) -> Tuple[bool, Dict[str, Dict]]:
+        written: Dict[str, Dict] = {}
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:  # drained by another process
+            return True, written
+        with fh:
+            if not _try_lock(fh):
+                return False, written
+            corrupt = None
+            with metrics.timer("spool_replay", table=self.target.table):
+                try:
+                    for symbol, bars in read_segment(path):
+                        bulkload.combine_results(written, writer.add(symbol, bars))
+                except CorruptRecord as e:
+                    corrupt = e
+                bulkload.combine_results(written, writer.flush())
+            if any(res["status"] != "ok" for res in written.values()):
+                errors = {res["error"] for res in written.values() if res["status"] != "ok"}
+                print(f"[SPOOL] could not replay {os.path.basename(path)}: {'; '.join(sorted(errors))}")
+                return False, written
+            metrics.inc("spool_replayed_rows", sum(r["rows"] for r in written.values()), table=self.target.table)
+            if corrupt is not None:
+                print(f"[SPOOL] {os.path.basename(path)}: {corrupt}; kept as .bad")
+                metrics.inc("spool_corrupt_segments", table=self.target.table)
+                os.replace(path, path[: -len(_SEGMENT_SUFFIX)] + ".bad")
+            else:
+                os.remove(path)
+        return True, written
+
+
+_spools: Dict[str, Spool] = {}
+
+
+def for_target(target: bulkload.Target) -> Spool | None:
+    """The process-wide spool of ``target``, or None when ``SPOOL_DIR`` is empty."""
+    root = _env("SPOOL_DIR", "/tmp/stock-pipeline-spool").strip()
+    if not root:
+        return None
+    if target.name not in _spools:
+        _spools[target.name] = Spool(
+            os.path.join(root, target.name),
+            target,
+            segment_bytes=int(float(_env("SPOOL_SEGMENT_MB", "64") or "64") * 1024 * 1024),
+            write_timeout=float(_env("SPOOL_WRITE_TIMEOUT_SEC", "300") or "0"),
+        )
+    return _spools[target.name]
+
+
+def replay(target: bulkload.Target, connect: Callable, stages: Sequence[Callable] = (), flush_rows: int = 50000) -> Dict[str, Dict]:
+    """Drain ``target``'s spool before a run; returns the results of the rows replayed."""
+    spool = for_target(target)
+    if spool is None:
+        return {}
+    try:
+        return spool.drain(connect, stages, flush_rows)
+    except OSError as e:
+        print(f"[SPOOL] could not drain {spool.directory}: {e}")
+        spool.blocked = True
+        return {}
+
+
+def _stages(target: bulkload.Target) -> Tuple[Callable, ...]:
+    """The stages each target's writer runs (imported lazily: they pull in their writers' modules)."""
+    if target is bulkload.PRICES:
+        from app import etl
+
+        return etl.PRICE_STAGES
+    if target is bulkload.PRICES_ADJUSTED:
+        from app import fetch_and_upsert
+
+        return fetch_and_upsert.STAGES
+    from app import latest, notify, quality
+
+    # Same as DAILY_STAGES in python-worker/fetch_and_upsert.py.
+    return (
+        latest.stage_for(bulkload.DAILY),
+        quality.stage_for(bulkload.DAILY, timedelta(days=1)),
+        notify.stage_for(bulkload.DAILY),
+    )
+
+
+TARGETS = {t.name: t for t in (bulkload.PRICES, bulkload.PRICES_ADJUSTED, bulkload.DAILY)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or replay the local write-ahead spool.")
+    parser.add_argument("command", choices=("status", "drain"))
+    parser.add_argument("--target", choices=sorted(TARGETS), action="append", help="default: all")
+    parser.add_argument("--every", type=float, default=0.0, help="keep draining at this interval (seconds)")
+    args = parser.parse_args()
+
+    targets = [TARGETS[name] for name in (args.target or sorted(TARGETS))]
+    pg = {
+        "host": _env("POSTGRES_HOST", "postgres"),
+        "port": int(_env("POSTGRES_PORT", "5432")),
+        "dbname": _env("POSTGRES_DB", "stocks"),
+        "user": _env("POSTGRES_USER", "admin"),
+        "password": _env("POSTGRES_PASSWORD", "adminpassword"),
+        "connect_timeout": int(_env("POSTGRES_CONNECT_TIMEOUT_SEC", "10")),
+    }
+    while True:
+        for target in targets:
+            spool = for_target(target)
+            if spool is None:
+                raise SystemExit("SPOOL_DIR is empty: spooling is off")
+            if args.command == "status":
+                paths = spool.segments()
+                size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+                print(f"{target.name}: {len(paths)} segments, {size / 1e6:.2f} MB in {spool.directory}")
+            else:
+                replay(target, lambda: psycopg2.connect(**pg), _stages(target))
+        if args.command == "status" or args.every <= 0:
+            return
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
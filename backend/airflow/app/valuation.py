@@ -0,0 +1,193 @@
+"""Batch portfolio valuation into ``portfolio_snapshots``.
+
+After an ingestion run, ``run`` finds the users holding any symbol whose bars
+changed. It loads their positions joined to ``latest_quotes`` in one query
+and values them all at once with NumPy. The outputs are market value, cost
+basis, unrealized P&L and per-position weights, and each user gets one
+snapshot row. Snapshots are appended, never overwritten, so they double as
+the history behind portfolio value charts. Readers such as the admin view
+take the newest row per user and do not price every position on every
+request.
+
+Positions without a quote are counted in ``unpriced``. They are left out of
+value, cost basis and P&L so that the P&L only compares priced holdings.
+
+    python -m app.valuation --symbols AAPL,MSFT   # or --all
+"""
+import argparse
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app import bulkload, etl
+
+
+SNAPSHOTS_DDL = """
+CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    as_of TIMESTAMPTZ NOT NULL,
+    market_value DOUBLE PRECISION NOT NULL,
+    cost_basis DOUBLE PRECISION NOT NULL,
+    unrealized_pnl DOUBLE PRECISION NOT NULL,
+    unrealized_pct DOUBLE PRECISION,
+    positions INTEGER NOT NULL,
+    unpriced INTEGER NOT NULL,
+    holdings JSONB NOT NULL,
+    PRIMARY KEY (user_id, as_of)
+);
+"""
+
+_POSITIONS_SQL = """
+SELECT p.user_id, p.symbol, p.quantity::float8, p.avg_buy_price::float8, q.close::float8
+FROM portfolios p
+LEFT JOIN latest_quotes q ON q.symbol = p.symbol
+WHERE {where}
+ORDER BY p.user_id, p.symbol
+"""
+
+_INSERT_SQL = """
+INSERT INTO portfolio_snapshots
+    (user_id, as_of, market_value, cost_basis, unrealized_pnl, unrealized_pct, positions, unpriced, holdings)
+VALUES %s
+ON CONFLICT (user_id, as_of) DO NOTHING
+"""
+
+
+@dataclass
+class Positions:
+    user_id: np.ndarray
+    symbol: np.ndarray
+    quantity: np.ndarray
+    avg_price: np.ndarray
+    price: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.user_id)
+
+
+def changed_symbols(results: Dict[str, Dict]) -> List[str]:
+    """Symbols whose write results report new or changed bars."""
+    return sorted(
+        sym for sym, res in results.items()
+        if res.get("status") == "ok" and (res.get("new", 0) or res.get("changed", 0))
+    )
+
+
+def load_positions(cur, symbols: Iterable[str] | None = None) -> Positions:
+    """Positions (and their latest price) of every user holding any of ``symbols``; all users if ``None``."""
+    if symbols is None:
+        cur.execute(_POSITIONS_SQL.format(where="true"))
+    else:
+        where = "p.user_id IN (SELECT user_id FROM portfolios WHERE symbol = ANY(%s))"
+        cur.execute(_POSITIONS_SQL.format(where=where), (sorted(set(symbols)),))
+    rows = cur.fetchall()
+    # None (no quote, NULL quantity) becomes NaN in the float columns.
+    return Positions(
+        user_id=np.array([r[0] for r in rows], dtype=np.int64),
+        symbol=np.array([r[1] for r in rows], dtype=object),
+        quantity=np.array([r[2] for r in rows], dtype=np.float64),
+        avg_price=np.array([r[3] for r in rows], dtype=np.float64),
+        price=np.array([r[4] for r in rows], dtype=np.float64),
+    )
+
+
+def value(pos: Positions) -> Dict[str, np.ndarray]:
+    """Per-position and per-user valuation of ``pos`` in a handful of array ops."""
+    users, inv = np.unique(pos.user_id, return_inverse=True)
+    qty = np.nan_to_num(pos.quantity)
+    priced = ~np.isnan(pos.price)
+    pos_value = np.where(priced, qty * np.nan_to_num(pos.price), 0.0)
+    pos_cost = np.where(priced, qty * np.nan_to_num(pos.avg_price), 0.0)
+
+    n = len(users)
+    market_value = np.bincount(inv, weights=pos_value, minlength=n)
+    cost_basis = np.bincount(inv, weights=pos_cost, minlength=n)
+    row_total = market_value[inv]
+    pnl = market_value - cost_basis
+    return {
+        "user_id": users,
+        "market_value": market_value,
+        "cost_basis": cost_basis,
+        "unrealized_pnl": pnl,
+        "unrealized_pct": np.divide(pnl * 100, cost_basis, out=np.full(n, np.nan), where=cost_basis != 0),
+        "positions": np.bincount(inv, minlength=n),
+        "unpriced": np.bincount(inv, weights=~priced, minlength=n).astype(np.int64),
+        # per position
+        "index": inv,
+        "value": pos_value,
+        "pnl": pos_value - pos_cost,
+        "weight": np.divide(pos_value, row_total, out=np.zeros(len(pos)), where=row_total != 0),
+    }
+
+
+def _num(x: float) -> float | None:
+    return None if x != x else x
+
+
+def _column(values: np.ndarray) -> list:
+    return np.round(values, 6).tolist()
+
+
+def snapshot_rows(pos: Positions, val: Dict[str, np.ndarray], as_of: datetime) -> List[tuple]:
+    holdings: List[List[Dict]] = [[] for _ in range(len(val["user_id"]))]
+    # Plain lists: per-element access to NumPy arrays is far slower than the math above.
+    columns = zip(
+        val["index"].tolist(), pos.symbol.tolist(), _column(pos.quantity), _column(pos.price),
+        _column(val["value"]), _column(val["pnl"]), _column(val["weight"]),
+    )
+    for u, symbol, qty, price, pos_value, pnl, weight in columns:
+        holdings[u].append({
+            "symbol": symbol, "quantity": _num(qty), "price": _num(price),
+            "value": pos_value, "pnl": pnl, "weight": weight,
+        })
+    users = zip(
+        val["user_id"].tolist(), val["market_value"].tolist(), val["cost_basis"].tolist(),
+        val["unrealized_pnl"].tolist(), _column(val["unrealized_pct"]), val["positions"].tolist(),
+        val["unpriced"].tolist(), holdings,
+    )
+    return [
+        (user_id, as_of, mv, cost, pnl, _num(pct), n, unpriced, json.dumps(held))
+        for user_id, mv, cost, pnl, pct, n, unpriced, held in users
+    ]
+
+
+def run(conn, symbols: Iterable[str] | None = None, as_of: datetime | None = None) -> int:
+    """Snapshot every user holding one of ``symbols`` (everyone if ``None``); returns users valued."""
+    if symbols is not None:
+        symbols = list(symbols)
+        if not symbols:
+            return 0
+    as_of = as_of or datetime.now(timezone.utc)
+    with conn, conn.cursor() as cur:
+        bulkload.ensure_table(cur, "portfolio_snapshots", SNAPSHOTS_DDL)
+        pos = load_positions(cur, symbols)
+        if not len(pos):
+            return 0
+        rows = snapshot_rows(pos, value(pos), as_of)
+        execute_values(cur, _INSERT_SQL, rows, page_size=1000)
+    print(f"[ETL] valued {len(rows)} portfolios ({len(pos)} positions) as of {as_of:%Y-%m-%d %H:%M:%S}")
+    return len(rows)
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Snapshot portfolio valuations.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--symbols", help="comma-separated symbols; values the users holding them")
+    group.add_argument("--all", action="store_true", help="value every portfolio")
+    args = parser.parse_args(argv)
+    symbols = None if args.all else [s.strip().upper() for s in args.symbols.split(",") if s.strip()]
+    conn = psycopg2.connect(**etl.load_settings()["pg"])
+    try:
+        run(conn, symbols)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
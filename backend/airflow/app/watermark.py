@@ -0,0 +1,78 @@
+"""Per-symbol high watermarks for incremental ingestion.
+
+The watermark is the newest bar already stored for a symbol. Fetchers use it
+to ask for ``compact`` output when the gap is small enough, and writers drop
+bars older than it before they reach the database.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from app import bulkload, columnar
+
+
+# Alpha Vantage "compact" responses carry the latest 100 bars.
+COMPACT_BARS = 100
+
+
+def load(conn, target: bulkload.Target, symbols: Iterable[str]) -> Dict[str, datetime]:
+    """Return ``{symbol: newest stored bar}`` for symbols that have any rows."""
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    ts_col = target.key[1]
+    with conn.cursor() as cur:
+        # One index-backed max() per symbol instead of a GROUP BY over all their rows.
+        cur.execute(
+            f"""
+            SELECT s.symbol, (SELECT max({ts_col}) FROM {target.table} t WHERE t.symbol = s.symbol)
+            FROM unnest(%s::text[]) AS s(symbol)
+            """,
+            (symbols,),
+        )
+        return {sym: _as_naive(ts) for sym, ts in cur.fetchall() if ts is not None}
+
+
+def _as_naive(value) -> datetime:
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    # Strings are stored as-is by Postgres TIMESTAMP columns, which ignore any offset.
+    return datetime.fromisoformat(str(value).strip().replace("Z", "")).replace(tzinfo=None)
+
+
+def output_size(mark: datetime | None, bar: timedelta, now: datetime | None = None) -> str:
+    """``compact`` when the latest ``COMPACT_BARS`` bars are guaranteed to reach back to ``mark``."""
+    if mark is None:
+        return "full"
+    now = now or datetime.utcnow()
+    return "compact" if now - mark <= bar * COMPACT_BARS else "full"
+
+
+def since(rows, mark: datetime | None, ts_index: int = 1) -> Tuple:
+    """Keep rows (tuples or ``columnar.Bars``) at or after ``mark``; returns them and how many were dropped.
+
+    Rows without a usable timestamp (Apify items missing one) are dropped too:
+    they would only fail the ``ts NOT NULL`` constraint of the whole batch.
+    """
+    if isinstance(rows, columnar.Bars):
+        valid = ~np.isnat(rows.ts)
+        if mark is not None:
+            valid &= rows.ts >= np.datetime64(mark, "s")
+        if valid.all():
+            return rows, 0
+        kept = rows.select(valid)
+        return kept, len(rows) - len(kept)
+    kept = []
+    for row in rows:
+        try:
+            ts = _as_naive(row[ts_index])
+        except (TypeError, ValueError):
+            continue
+        if mark is None or ts >= mark:
+            kept.append(row)
+    return kept, len(rows) - len(kept)
@@ -0,0 +1,123 @@
+"""Row-count benchmark: per-row execute vs execute_values vs COPY + staging merge.
+
+Runs against the database described by the usual POSTGRES_* variables and
+only touches its own ``bench_stock_prices`` table:
+
+    python bench/bench_bulkload.py --symbols 20 --rows-per-symbol 5000
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import bulkload  # noqa: E402
+
+
+TABLE = "bench_stock_prices"
+TARGET = replace(bulkload.PRICES, name="bench_prices", table=TABLE)
+
+DDL = f"""
+DROP TABLE IF EXISTS {TABLE};
+CREATE TABLE {TABLE} (
+    symbol TEXT NOT NULL,
+    ts TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION, high DOUBLE PRECISION, low DOUBLE PRECISION, close DOUBLE PRECISION,
+    volume BIGINT,
+    PRIMARY KEY (symbol, ts)
+);
+"""
+
+UPSERT_VALUES = f"""
+INSERT INTO {TABLE} (symbol, ts, open, high, low, close, volume) VALUES %s
+ON CONFLICT (symbol, ts) DO UPDATE SET
+  open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+  close = EXCLUDED.close, volume = EXCLUDED.volume
+"""
+
+UPSERT_ROW = UPSERT_VALUES.replace("VALUES %s", "VALUES (%s, %s, %s, %s, %s, %s, %s)")
+
+
+def _pg_cfg():
+    return {
+        "host": os.getenv("POSTGRES_HOST", "localhost"),
+        "port": int(os.getenv("POSTGRES_PORT", "5432")),
+        "dbname": os.getenv("POSTGRES_DB", "stocks"),
+        "user": os.getenv("POSTGRES_USER", "admin"),
+        "password": os.getenv("POSTGRES_PASSWORD", "adminpassword"),
+    }
+
+
+def synthetic_rows(symbols: int, rows_per_symbol: int):
+    start = datetime(2000, 1, 3)
+    out = {}
+    for s in range(symbols):
+        sym = f"SYM{s:04d}"
+        out[sym] = [
+            (sym, start + timedelta(hours=i), 100.0 + i % 7, 101.0 + i % 7, 99.0 + i % 7, 100.5 + i % 7, 1000 + i)
+            for i in range(rows_per_symbol)
+        ]
+    return out
+
+
+def per_row(conn, data):
+    # StockDataFetcher.upsert_stock_data before the bulk loader: one execute per bar.
+    for rows in data.values():
+        with conn, conn.cursor() as cur:
+            for row in rows:
+                cur.execute(UPSERT_ROW, row)
+
+
+def values_per_symbol(conn, data):
+    # etl.upsert_prices / app.fetch_and_upsert.upsert before the bulk loader.
+    for rows in data.values():
+        with conn, conn.cursor() as cur:
+            execute_values(cur, UPSERT_VALUES, rows, page_size=500)
+
+
+def copy_single_batch(conn, data):
+    with conn, conn.cursor() as cur:
+        bulkload.copy_upsert(cur, TARGET, (row for rows in data.values() for row in rows))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=20)
+    parser.add_argument("--rows-per-symbol", type=int, default=5000)
+    parser.add_argument("--skip-per-row", action="store_true", help="skip the slow one-execute-per-row path")
+    args = parser.parse_args()
+
+    data = synthetic_rows(args.symbols, args.rows_per_symbol)
+    total = args.symbols * args.rows_per_symbol
+    paths = [("execute_values page_size=500", values_per_symbol), ("COPY + staging merge", copy_single_batch)]
+    if not args.skip_per_row:
+        paths.insert(0, ("per-row execute", per_row))
+
+    conn = psycopg2.connect(**_pg_cfg())
+    try:
+        baseline = None
+        print(f"{total} rows across {args.symbols} symbols")
+        for label, fn in paths:
+            for phase in ("insert", "update"):
+                if phase == "insert":
+                    with conn, conn.cursor() as cur:
+                        cur.execute(DDL)
+                started = time.perf_counter()
+                fn(conn, data)
+                elapsed = time.perf_counter() - started
+                if baseline is None:
+                    baseline = elapsed
+                print(f"{label:<32} {phase:<7} {elapsed:8.3f}s {total / elapsed:12,.0f} rows/s  x{baseline / elapsed:5.1f}")
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Micro-benchmark: etl.normalize_rows vs the columnar normalizer.
+
+Both sides are timed up to COPY-ready bytes, since the dict path also pays
+for tuple building and text rendering before anything reaches Postgres:
+
+    python bench/bench_normalize.py --bars 100000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import bulkload, columnar, etl  # noqa: E402
+
+
+def synthetic_series(bars: int):
+    start = datetime(2000, 1, 3, 10)
+    series = {}
+    for i in range(bars):
+        px = 100.0 + (i % 97) * 0.01
+        series[(start + timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S")] = {
+            "1. open": f"{px:.4f}",
+            "2. high": f"{px + 1:.4f}",
+            "3. low": f"{px - 1:.4f}",
+            "4. close": f"{px + 0.5:.4f}",
+            "5. volume": str(1000 + i),
+        }
+    return series
+
+
+def dict_path(series):
+    rows = etl.normalize_rows(series)
+    stream = bulkload._CopyStream(etl.price_tuples("BENCH", rows))
+    return len(stream.read())
+
+
+def columnar_path(series):
+    bars = columnar.from_series(series, columnar.INTRADAY_FIELDS)
+    return len(bulkload._binary_rows(bulkload.PRICES, "BENCH", bars))
+
+
+def _best(fn, series, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(series)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bars", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    series = synthetic_series(args.bars)
+    baseline = _best(dict_path, series, args.repeat)
+    fast = _best(columnar_path, series, args.repeat)
+    print(f"{args.bars} bars, best of {args.repeat}")
+    print(f"{'normalize_rows + text COPY':<30} {baseline:8.3f}s {args.bars / baseline:12,.0f} bars/s")
+    print(f"{'columnar + binary COPY':<30} {fast:8.3f}s {args.bars / fast:12,.0f} bars/s  x{baseline / fast:4.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""End-to-end pipeline benchmark against a local stub market-data server.
+
+Starts ``stub_server`` in-process and then runs each ingestion path for
+``--symbols`` synthetic symbols against the database described by the usual
+POSTGRES_* variables:
+
+* ``etl`` and ``etl-async``: ``etl.run`` in sync and async mode (intraday ETL_INTERVAL, 5min by default).
+* ``etl-quotes``: ``etl.run`` in bulk-quote mode (100 symbols per call).
+* ``run_batch``: ``app.fetch_and_upsert.run_batch`` (intraday 5min, Apify fallback).
+* ``worker``: ``StockDataFetcher.fetch_all_symbols`` (daily adjusted).
+
+Every path runs twice, each time in a fresh process. The ``cold`` pass
+starts from an empty history and the ``warm`` pass refetches symbols that
+are already up to date. For each pass the benchmark reports wall time, rows
+written per second, the peak RSS of the process, database round trips
+(``execute``/``executemany``/``copy_expert`` calls plus commits) and HTTP
+requests and bytes served by the stub. Only ``BENCH*`` symbols are written,
+and they are deleted before and after the run::
+
+    python bench/bench_pipeline.py --symbols 20 --bars 5000 --latency-ms 20
+    python bench/bench_pipeline.py --pipelines etl,worker --throttle-every 7 --json out.json
+
+Response caching is off and the rate limiter uses the file backend with
+limits far above anything the run reaches, so the numbers measure the
+pipeline rather than the quota. Compare ``--json`` outputs across versions
+to spot regressions.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import psycopg2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+AIRFLOW = os.path.join(HERE, "..")
+WORKER = os.path.join(HERE, "..", "..", "python-worker")
+sys.path.insert(0, HERE)
+import stub_server  # noqa: E402
+
+
+PIPELINES = ("etl", "etl-async", "etl-quotes", "run_batch", "worker")
+PREFIX = "BENCH"
+TABLES = ("stock_prices", "stocks", "latest_quotes", "price_rollups", "price_indicators", "data_quality_findings")
+
+
+def _pg_cfg():
+    return {
+        "host": os.getenv("POSTGRES_HOST", "localhost"),
+        "port": int(os.getenv("POSTGRES_PORT", "5432")),
+        "dbname": os.getenv("POSTGRES_DB", "stocks"),
+        "user": os.getenv("POSTGRES_USER", "admin"),
+        "password": os.getenv("POSTGRES_PASSWORD", "adminpassword"),
+    }
+
+
+def _counting_connect(counts: Dict[str, int]):
+    """``psycopg2.connect`` replacement whose connections count their round trips."""
+    from psycopg2.extensions import connection, cursor
+
+    class Cursor(cursor):
+        def execute(self, *args, **kwargs):
+            counts["round_trips"] += 1
+            return super().execute(*args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            counts["round_trips"] += 1
+            return super().executemany(*args, **kwargs)
+
+        def copy_expert(self, *args, **kwargs):
+            counts["round_trips"] += 1
+            return super().copy_expert(*args, **kwargs)
+
+    class Connection(connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cursor_factory = Cursor
+            counts["connections"] += 1
+
+        def commit(self):
+            counts["round_trips"] += 1
+            return super().commit()
+
+        def rollback(self):
+            counts["round_trips"] += 1
+            return super().rollback()
+
+    connect = psycopg2.connect
+
+    def counting(*args, **kwargs):
+        kwargs.setdefault("connection_factory", Connection)
+        return connect(*args, **kwargs)
+
+    return counting
+
+
+def _rows_written(pipeline: str, result) -> int:
+    if pipeline == "worker":
+        return result["new_records"] + result["changed_records"]
+    return sum(r.get("new", 0) + r.get("changed", 0) for r in result.values() if r.get("status") == "ok")
+
+
+def _failed(pipeline: str, result) -> List[str]:
+    if pipeline == "worker":
+        return list(result["failed_symbols"])
+    return sorted(s for s, r in result.items() if r.get("status") != "ok")
+
+
+def _child(pipeline: str, symbols: List[str], env: Dict[str, str], queue) -> None:
+    os.environ.update(env)
+    sys.path[:0] = [AIRFLOW, WORKER]
+    counts = {"round_trips": 0, "connections": 0}
+    psycopg2.connect = _counting_connect(counts)
+
+    started = time.perf_counter()
+    if pipeline.startswith("etl"):
+        from app import etl
+
+        result = etl.run(pipeline.partition("-")[2] or "sync", symbols)
+        report = result.report
+    elif pipeline == "run_batch":
+        from app import fetch_and_upsert
+
+        result = fetch_and_upsert.run_batch(symbols)
+        report = result.report
+    else:
+        import fetch_and_upsert as worker
+
+        result = worker.StockDataFetcher(symbols).fetch_all_symbols()
+        report = result["report"]
+    wall = time.perf_counter() - started
+
+    rows = _rows_written(pipeline, result)
+    queue.put({
+        "wall_seconds": round(wall, 3),
+        "rows": rows,
+        "rows_per_sec": round(rows / wall, 1) if wall > 0 else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **counts,
+        "failed": _failed(pipeline, result),
+        "report": report,
+    })
+
+
+def _run(pipeline: str, symbols: List[str], env: Dict[str, str]) -> Dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(pipeline, symbols, env, queue), name=f"bench-{pipeline}")
+    proc.start()
+    # Read before join: a child blocked on a full queue pipe never exits.
+    try:
+        out = queue.get(timeout=3600)
+    except Exception:
+        out = None
+    proc.join()
+    if out is None:
+        raise RuntimeError(f"{pipeline} exited with code {proc.exitcode} and no result")
+    return out
+
+
+def clean(conn, symbols: List[str]) -> None:
+    with conn, conn.cursor() as cur:
+        for table in TABLES:
+            cur.execute("SELECT to_regclass(%s)", (table,))
+            if cur.fetchone()[0] is not None:
+                cur.execute(f"DELETE FROM {table} WHERE symbol = ANY(%s)", (symbols,))
+
+
+def _env(port: int, state_dir: str) -> Dict[str, str]:
+    base = f"http://127.0.0.1:{port}"
+    pg = _pg_cfg()
+    return {
+        "ALPHA_VANTAGE_URL": base + "/query",
+        "APIFY_BASE_URL": base,
+        "ALPHA_VANTAGE_API_KEY": "bench",
+        "APIFY_ACTOR_ID": "bench~actor",
+        "APIFY_API_TOKEN": "bench",
+        "STOCKS_DB": pg["dbname"],
+        "RESPONSE_CACHE_MODE": "off",
+        "RATE_LIMIT_BACKEND": "file",
+        "RATE_LIMIT_STATE_DIR": state_dir,
+        "RATE_LIMIT_ALPHAVANTAGE_PER_MINUTE": "1000000",
+        "RATE_LIMIT_ALPHAVANTAGE_PER_DAY": "100000000",
+        "RATE_LIMIT_APIFY_PER_MINUTE": "1000000",
+        "METRICS_PORT": "",
+        "METRICS_TEXTFILE_DIR": "",
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--bars", type=int, default=1000, help="bars in a full response")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every stub response")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth Alpha Vantage call with a Note")
+    parser.add_argument("--apify-run-ms", type=float, default=0.0, help="time an Apify actor run takes to succeed")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help=f"comma-separated subset of {','.join(PIPELINES)}")
+    parser.add_argument("--json", help="also write the full results, metrics reports included, to this file")
+    args = parser.parse_args()
+
+    pipelines = [p.strip() for p in args.pipelines.split(",") if p.strip()]
+    unknown = set(pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"unknown pipelines: {', '.join(sorted(unknown))}")
+    symbols = [f"{PREFIX}{i:04d}" for i in range(args.symbols)]
+
+    market = stub_server.StubMarket(args.bars, args.latency_ms, args.throttle_every, apify_run_ms=args.apify_run_ms)
+    server = stub_server.start(market)
+    conn = psycopg2.connect(**_pg_cfg())
+    results = []
+    print(f"{args.symbols} symbols, {args.bars} bars per full response, {args.latency_ms:g} ms latency")
+    print(f"{'pipeline':<10} {'pass':<5} {'wall s':>8} {'rows':>9} {'rows/s':>10} {'rss MB':>8} "
+          f"{'db trips':>9} {'http':>6} {'http MB':>8}  failed")
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-ratelimit-") as state_dir:
+            env = _env(server.server_port, state_dir)
+            for pipeline in pipelines:
+                clean(conn, symbols)
+                for phase in ("cold", "warm"):
+                    before = dict(market.stats)
+                    out = _run(pipeline, symbols, env)
+                    out.update(
+                        pipeline=pipeline, phase=phase,
+                        http_requests=market.stats["requests"] - before["requests"],
+                        http_bytes=market.stats["bytes"] - before["bytes"],
+                        throttled=market.stats["throttled"] - before["throttled"],
+                    )
+                    results.append(out)
+                    print(f"{pipeline:<10} {phase:<5} {out['wall_seconds']:8.3f} {out['rows']:9d} "
+                          f"{out['rows_per_sec'] or 0:10,.0f} {out['peak_rss_mb']:8.1f} {out['round_trips']:9d} "
+                          f"{out['http_requests']:6d} {out['http_bytes'] / 1e6:8.2f}  {len(out['failed'])}")
+    finally:
+        clean(conn, symbols)
+        conn.close()
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"args": vars(args), "results": results}, fh, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
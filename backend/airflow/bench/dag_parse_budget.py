@@ -0,0 +1,115 @@
+"""DAG parse-time budget check.
+
+The Airflow scheduler re-imports every file in ``dags/`` on each parse loop,
+so whatever a DAG file imports at module level is paid for continuously.
+This script imports each DAG file the way the scheduler does, in a fresh
+interpreter that has already loaded ``airflow`` and the operators. For each
+file it measures:
+
+* import time in ms (median of ``--repeat`` runs);
+* the number of modules the file pulls in from packages that were not loaded
+  already, which excludes Airflow's own lazy imports;
+* any of the ``--forbid`` modules (``psycopg2``, ``requests``, ``httpx``,
+  ``numpy``, ``app.etl``) loaded at parse time. These belong inside task
+  callables.
+
+It exits with status 1 if any file goes over ``--max-ms`` or
+``--max-modules``, or loads a forbidden module. That makes it usable as a CI
+gate::
+
+    python bench/dag_parse_budget.py
+    python bench/dag_parse_budget.py --max-ms 150 --repeat 7 --json parse.json
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DAGS = os.path.join(HERE, "..", "dags")
+AIRFLOW_HOME = os.path.join(HERE, "..")
+
+FORBIDDEN = ("psycopg2", "requests", "httpx", "numpy", "app.etl")
+
+# Runs in a fresh interpreter: preload what the scheduler already has, then import one DAG file.
+_CHILD = r"""
+import importlib.util, json, sys, time
+import airflow, airflow.operators.python, airflow.operators.bash
+before = set(sys.modules)
+tops = {name.split(".")[0] for name in before}
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("_dag_under_test", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - started
+new = sorted(set(sys.modules) - before)
+print(json.dumps({
+    "ms": elapsed * 1000,
+    "modules": [m for m in new if m.split(".")[0] not in tops],
+    "all_new": len(new),
+}))
+"""
+
+
+def measure(path: str, repeat: int) -> Dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (AIRFLOW_HOME, env.get("PYTHONPATH")) if p)
+    runs: List[Dict] = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", _CHILD, path], capture_output=True, text=True, env=env)
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing {os.path.basename(path)} failed:\n{proc.stderr.strip()}")
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    modules = runs[-1]["modules"]
+    return {
+        "file": os.path.basename(path),
+        "ms": round(statistics.median(r["ms"] for r in runs), 2),
+        "modules": len(modules),
+        "airflow_modules": runs[-1]["all_new"] - len(modules),
+        "new_modules": modules,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="DAG files (default: dags/*.py)")
+    parser.add_argument("--max-ms", type=float, default=250.0, help="import time budget per file")
+    parser.add_argument("--max-modules", type=int, default=15, help="new non-Airflow modules budget per file")
+    parser.add_argument("--forbid", default=",".join(FORBIDDEN), help="comma-separated modules that must not load")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the measurements to this file")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(DAGS, "*.py")))
+    forbidden = [m.strip() for m in args.forbid.split(",") if m.strip()]
+    results, failures = [], []
+    print(f"{'dag file':<24} {'import ms':>10} {'modules':>8} {'airflow':>8}  over budget")
+    for path in files:
+        res = measure(path, max(1, args.repeat))
+        loaded = [m for m in forbidden if m in res["new_modules"]]
+        over = []
+        if res["ms"] > args.max_ms:
+            over.append(f"{res['ms']:.0f} ms > {args.max_ms:g}")
+        if res["modules"] > args.max_modules:
+            over.append(f"{res['modules']} modules > {args.max_modules}")
+        if loaded:
+            over.append(f"imports {', '.join(loaded)}")
+        res["over_budget"] = over
+        results.append(res)
+        failures += [f"{res['file']}: {o}" for o in over]
+        print(f"{res['file']:<24} {res['ms']:10.1f} {res['modules']:8d} {res['airflow_modules']:8d}  {'; '.join(over) or '-'}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"args": vars(args), "results": results}, fh, indent=2)
+    if failures:
+        print("DAG parse budget exceeded:\n  " + "\n  ".join(failures))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Local stand-in for Alpha Vantage and Apify, serving synthetic payloads.
+
+Serves the requests the pipeline makes, with configurable size, latency and
+throttling:
+
+* ``GET /query?function=TIME_SERIES_INTRADAY&interval=1min|5min|15min|30min|60min&outputsize=...``
+* ``GET /query?function=TIME_SERIES_DAILY_ADJUSTED&outputsize=...``
+* ``GET /query?function=REALTIME_BULK_QUOTES&symbol=A,B,...`` (up to 100 symbols)
+* ``POST /v2/acts/<actor>/runs``, ``GET /v2/actor-runs/<id>`` and
+  ``GET /v2/datasets/<id>/items`` (Apify). Runs report ``RUNNING`` for
+  ``--apify-run-ms`` before they turn ``SUCCEEDED``.
+* ``GET /stats`` returns request, byte and throttle counts.
+
+``compact`` responses carry the latest 100 bars and ``full`` ones ``--bars``
+bars. Bodies are rendered once per shape and reused, so the server costs
+little CPU next to the pipeline it feeds. The series end at the hour the
+server started, which means a second pass over the same symbols finds
+nothing new. With ``--throttle-every N``, every Nth Alpha Vantage request
+gets a ``Note`` response, the way the real API answers over-quota calls::
+
+    python bench/stub_server.py --port 8765 --bars 5000 --latency-ms 50
+    ALPHA_VANTAGE_URL=http://127.0.0.1:8765/query APIFY_BASE_URL=http://127.0.0.1:8765 ...
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+COMPACT_BARS = 100
+NOTE = {"Note": "Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute."}
+
+_INTERVALS = {
+    "60min": timedelta(hours=1),
+    "30min": timedelta(minutes=30),
+    "15min": timedelta(minutes=15),
+    "5min": timedelta(minutes=5),
+    "1min": timedelta(minutes=1),
+    "daily": timedelta(days=1),
+}
+
+
+def _price(i: int) -> float:
+    return 100.0 + (i % 97) * 0.05 + (i % 13) * 0.01
+
+
+def series(interval: str, bars: int, end: datetime) -> Dict[str, Dict[str, str]]:
+    step = _INTERVALS[interval]
+    fmt = "%Y-%m-%d" if interval == "daily" else "%Y-%m-%d %H:%M:%S"
+    out = {}
+    for i in range(bars):
+        px = _price(i)
+        bar = {"1. open": f"{px:.4f}", "2. high": f"{px + 1:.4f}", "3. low": f"{px - 1:.4f}", "4. close": f"{px + 0.5:.4f}"}
+        if interval == "daily":
+            bar["5. adjusted close"] = f"{px + 0.4:.4f}"
+            bar["6. volume"] = str(1000 + i)
+        else:
+            bar["5. volume"] = str(1000 + i)
+        out[(end - step * i).strftime(fmt)] = bar
+    return out
+
+
+def apify_items(bars: int, end: datetime) -> list:
+    return [
+        {"timestamp": (end - timedelta(minutes=5) * i).isoformat(sep=" "), "open": _price(i), "high": _price(i) + 1,
+         "low": _price(i) - 1, "close": _price(i) + 0.5, "adjClose": _price(i) + 0.4, "volume": 1000 + i}
+        for i in range(bars)
+    ]
+
+
+def bulk_quotes(symbols: str, end: datetime) -> list:
+    ts = (end + timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M:%S.000")
+    px = _price(0) + 0.5
+    return [
+        {"symbol": sym, "timestamp": ts, "open": f"{px - 1:.4f}", "high": f"{px + 1:.4f}", "low": f"{px - 2:.4f}",
+         "close": f"{px:.4f}", "volume": "123456", "previous_close": f"{px - 0.5:.4f}"}
+        for sym in symbols.split(",")[:100] if sym
+    ]
+
+
+class StubMarket:
+    """Payload factory plus counters; one instance is shared by all handler threads."""
+
+    def __init__(
+        self, bars: int = 1000, latency_ms: float = 0.0, throttle_every: int = 0, apify_bars: int = 100,
+        apify_run_ms: float = 0.0,
+    ):
+        self.bars = bars
+        self.latency = latency_ms / 1000.0
+        self.throttle_every = throttle_every
+        self.apify_bars = apify_bars
+        self.apify_run = apify_run_ms / 1000.0
+        self._run_started: Dict[str, float] = {}
+        self.end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self.stats = {"requests": 0, "bytes": 0, "throttled": 0, "apify_runs": 0}
+        self._bodies: Dict[Tuple, bytes] = {}
+        self._alpha_calls = itertools.count(1)
+        self._runs = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _body(self, key: Tuple, build) -> bytes:
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is None:
+            body = json.dumps(build()).encode()
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def alpha(self, params: Dict[str, str]) -> bytes:
+        if self.throttle_every and next(self._alpha_calls) % self.throttle_every == 0:
+            with self._lock:
+                self.stats["throttled"] += 1
+            return json.dumps(NOTE).encode()
+        function = params.get("function", "")
+        if function == "REALTIME_BULK_QUOTES":
+            return json.dumps({"endpoint": "Realtime Bulk Quotes", "data": bulk_quotes(params.get("symbol", ""), self.end)}).encode()
+        bars = COMPACT_BARS if params.get("outputsize", "compact") == "compact" else self.bars
+        bars = min(bars, self.bars)
+        if function == "TIME_SERIES_DAILY_ADJUSTED":
+            interval, key = "daily", "Time Series (Daily)"
+        elif function == "TIME_SERIES_INTRADAY":
+            interval = params.get("interval", "60min")
+            key = f"Time Series ({interval})"
+        else:
+            return json.dumps({"Error Message": f"Invalid API call: {function}"}).encode()
+        if interval not in _INTERVALS:
+            return json.dumps({"Error Message": f"Invalid interval: {interval}"}).encode()
+        return self._body(
+            (interval, bars),
+            lambda: {"Meta Data": {"1. Information": "stub"}, key: series(interval, bars, self.end)},
+        )
+
+    def _run_body(self, run_id: str) -> bytes:
+        with self._lock:
+            started = self._run_started.get(run_id)
+        if started is None:
+            return json.dumps({"error": {"type": "record-not-found"}}).encode()
+        status = "SUCCEEDED" if time.monotonic() - started >= self.apify_run else "RUNNING"
+        ds = run_id.replace("run", "ds", 1)
+        return json.dumps({"data": {"id": run_id, "status": status, "defaultDatasetId": ds}}).encode()
+
+    def start_apify_run(self) -> bytes:
+        run_id = f"run{next(self._runs)}"
+        with self._lock:
+            self.stats["apify_runs"] += 1
+            self._run_started[run_id] = time.monotonic()
+        return self._run_body(run_id)
+
+    def apify_run_status(self, run_id: str) -> bytes:
+        return self._run_body(run_id)
+
+    def apify_dataset(self) -> bytes:
+        return self._body(("apify", self.apify_bars), lambda: apify_items(self.apify_bars, self.end))
+
+    def record(self, sent: int) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += sent
+
+
+def _handler(market: StubMarket):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, body: bytes, status: int = 200) -> None:
+            if market.latency:
+                time.sleep(market.latency)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            market.record(len(body))
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if url.path == "/query":
+                self._send(market.alpha({k: v[0] for k, v in parse_qs(url.query).items()}))
+            elif url.path == "/stats":
+                with market._lock:
+                    body = json.dumps(market.stats).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif parts[:2] == ["v2", "actor-runs"] and len(parts) == 3:
+                self._send(market.apify_run_status(parts[2]))
+            elif parts[:2] == ["v2", "datasets"] and parts[-1] == "items":
+                self._send(market.apify_dataset())
+            else:
+                self._send(b'{"error": "not found"}', 404)
+
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if parts[:2] == ["v2", "acts"] and parts[-1] == "runs":
+                self._send(market.start_apify_run(), 201)
+            else:
+                self._send(b'{"error": "not found"}', 404)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    return Handler
+
+
+def start(market: StubMarket, port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``market`` from a daemon thread; ``server.server_port`` is the bound port."""
+    server = ThreadingHTTPServer((host, port), _handler(market))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-market", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--bars", type=int, default=1000, help="bars in a full response")
+    parser.add_argument("--apify-bars", type=int, default=100, help="items in an Apify dataset")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--apify-run-ms", type=float, default=0.0, help="time an Apify actor run stays RUNNING")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth Alpha Vantage call with a Note")
+    args = parser.parse_args()
+    market = StubMarket(args.bars, args.latency_ms, args.throttle_every, args.apify_bars, args.apify_run_ms)
+    server = start(market, args.port, args.host)
+    print(f"stub market on http://{args.host}:{server.server_port} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(market.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,5 @@
 from datetime import datetime, timedelta
 from airflow import DAG
-import requests 
-import httpx
 from airflow.operators.python import PythonOperator
 from airflow.operators.bash import BashOperator
 import sys
@@ -9,12 +7,12 @@ import os
 
 # Add the plugins directory to the Python path
 sys.path.append('/opt/airflow/plugins')
+if '/opt/airflow' not in sys.path:
+    sys.path.append('/opt/airflow')
 
-# Import our custom stock fetcher
-try:
-    from fetch_and_upsert import StockDataFetcher
-except ImportError:
-    print("Could not import StockDataFetcher, will use alternative approach")
+# The scheduler re-parses this file continuously, so StockDataFetcher and the
+# pipeline modules (with psycopg2, requests and numpy behind them) are imported
+# inside the task callables. bench/dag_parse_budget.py keeps it that way.
 
 default_args = {
     'owner': 'stock-pipeline',
@@ -36,10 +34,22 @@ dag = DAG(
     tags=['stocks', 'finance', 'data-pipeline'],
 )
 
-def fetch_stock_data_task():
-    """Task to fetch stock data using our Python worker."""
+def plan_shards_task():
+    """Split SYMBOLS into one batch per mapped fetch task."""
+    from app import shards
+    
+    return shards.plan([s.strip() for s in os.getenv('SYMBOLS', 'AAPL,MSFT,GOOGL').split(',') if s.strip()])
+
+def fetch_stock_data_task(symbols=None, ti=None):
+    """Task to fetch stock data for one shard using our Python worker."""
+    from fetch_and_upsert import StockDataFetcher
+    
+    if ti:
+        # One metrics textfile per mapped instance (app/metrics.py).
+        os.environ['METRICS_SHARD'] = str(ti.map_index)
+    
     try:
-        fetcher = StockDataFetcher()
+        fetcher = StockDataFetcher(symbols=symbols)
         result = fetcher.fetch_all_symbols()
         
         print(f"Stock data fetch completed:")
@@ -48,6 +58,9 @@ def fetch_stock_data_task():
         print(f"Failed symbols: {result['failed_symbols']}")
         
         if result['failed_symbols']:
+            # Pushed before failing so value_portfolios still sees this shard's changed symbols.
+            if ti:
+                ti.xcom_push(key='partial', value=result)
             raise Exception(f"Some symbols failed: {result['failed_symbols']}")
             
         return result
@@ -58,6 +71,7 @@ def fetch_stock_data_task():
 def validate_data_task():
     """Task to validate the fetched data."""
     import psycopg2
+    from app import quality
     
     # Database configuration
     db_config = {
@@ -90,6 +104,11 @@ def validate_data_task():
         if not results:
             raise Exception("No recent stock data found in database")
         
+        # Gaps and bad bars are found while writing (app/quality.py); report what is still open.
+        findings = quality.summary(conn, 'stocks', [symbol for symbol, _, _ in results])
+        for symbol, kinds in findings.items():
+            print(f"  {symbol}: open data-quality findings {kinds}")
+        
         conn.close()
         return len(results)
         
@@ -97,9 +116,50 @@ def validate_data_task():
         print(f"Error in validate_data_task: {e}")
         raise
 
+def value_portfolios_task(ti=None):
+    """Task to snapshot the portfolios holding symbols whose bars changed in this run."""
+    import psycopg2
+    from app import valuation
+    
+    changed = set()
+    for key in ('partial', 'return_value'):
+        for result in (ti.xcom_pull(task_ids='fetch_stock_data', key=key) if ti else None) or []:
+            changed.update((result or {}).get('changed_symbols', []))
+    
+    db_config = {
+        'host': os.getenv('POSTGRES_HOST', 'postgres'),
+        'port': os.getenv('POSTGRES_PORT', '5432'),
+        'user': os.getenv('POSTGRES_USER', 'admin'),
+        'password': os.getenv('POSTGRES_PASSWORD', 'adminpassword'),
+        'database': os.getenv('POSTGRES_DB', 'stocks')
+    }
+    
+    conn = psycopg2.connect(**db_config)
+    try:
+        return valuation.run(conn, changed)
+    finally:
+        conn.close()
+
+def export_history_task():
+    """Task to append settled daily bars to the columnar export (EXPORT_DIR) for analytics."""
+    import psycopg2
+    from app import export
+    
+    db_config = {
+        'host': os.getenv('POSTGRES_HOST', 'postgres'),
+        'port': os.getenv('POSTGRES_PORT', '5432'),
+        'user': os.getenv('POSTGRES_USER', 'admin'),
+        'password': os.getenv('POSTGRES_PASSWORD', 'adminpassword'),
+        'database': os.getenv('POSTGRES_DB', 'stocks')
+    }
+    
+    written = export.run(lambda: psycopg2.connect(**db_config), ['stocks'])
+    return {table: sum(rows.values()) for table, rows in written.items()}
+
 def cleanup_old_data_task():
-    """Task to clean up old data (optional - keep last 2 years)."""
+    """Task to create upcoming monthly partitions and drop expired ones (keeps 2 years by default)."""
     import psycopg2
+    from app import partitions
     
     # Database configuration
     db_config = {
@@ -112,47 +172,83 @@ def cleanup_old_data_task():
     
     try:
         conn = psycopg2.connect(**db_config)
-        cursor = conn.cursor()
+        try:
+            # Whole partitions are detached and dropped instead of a row-by-row DELETE.
+            summary = partitions.maintain(conn)
+        finally:
+            conn.close()
         
-        # Delete data older than 2 years
-        cursor.execute("""
-            DELETE FROM stocks
-            WHERE date < CURRENT_DATE - INTERVAL '2 years'
-        """)
-        
-        deleted_count = cursor.rowcount
-        conn.commit()
-        conn.close()
-        
-        print(f"Cleaned up {deleted_count} old records")
-        return deleted_count
+        dropped = sum(len(t['dropped']) for t in summary.values())
+        print(f"Partition maintenance: {summary}")
+        print(f"Dropped {dropped} expired partitions")
+        return dropped
         
     except Exception as e:
         print(f"Error in cleanup_old_data_task: {e}")
         # Don't raise exception for cleanup task
         return 0
 
+def shards_succeeded_task():
+    """Leaf task that only runs when every fetch shard succeeded."""
+    print("All shards succeeded")
+
 # Define tasks
-fetch_data = PythonOperator(
+plan_shards = PythonOperator(
+    task_id='plan_shards',
+    python_callable=plan_shards_task,
+    dag=dag,
+)
+
+# One mapped task instance per shard: shards run in parallel and a retry
+# only refetches the symbols of the shard that failed.
+fetch_data = PythonOperator.partial(
     task_id='fetch_stock_data',
     python_callable=fetch_stock_data_task,
     dag=dag,
-)
+).expand(op_kwargs=plan_shards.output)
 
+# A failed shard must not skip the rest of the run: the tasks below work on
+# whatever the other shards (and the failed one, partially) wrote.
 validate_data = PythonOperator(
     task_id='validate_data',
     python_callable=validate_data_task,
+    trigger_rule='all_done',
+    dag=dag,
+)
+
+value_portfolios = PythonOperator(
+    task_id='value_portfolios',
+    python_callable=value_portfolios_task,
+    trigger_rule='all_done',
+    dag=dag,
+)
+
+export_history = PythonOperator(
+    task_id='export_history',
+    python_callable=export_history_task,
+    trigger_rule='all_done',
     dag=dag,
 )
 
 cleanup_data = PythonOperator(
     task_id='cleanup_old_data',
     python_callable=cleanup_old_data_task,
+    trigger_rule='all_done',
+    dag=dag,
+)
+
+# The run's state comes from its leaf tasks, which all_done would leave green
+# after a failed shard; this all_success leaf fails the run instead.
+shards_succeeded = PythonOperator(
+    task_id='shards_succeeded',
+    python_callable=shards_succeeded_task,
     dag=dag,
 )
 
 # Set task dependencies
-fetch_data >> validate_data >> cleanup_data
+plan_shards >> fetch_data >> validate_data >> [value_portfolios, export_history]
+export_history >> cleanup_data  # export before expired partitions are dropped
+[fetch_data, value_portfolios, cleanup_data] >> shards_succeeded
 
 # Alternative task using BashOperator if Python import fails
 fetch_data_bash = BashOperator(
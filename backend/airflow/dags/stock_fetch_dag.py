@@ -6,8 +6,10 @@ from airflow.operators.python import PythonOperator
 
 if "/opt/airflow" not in sys.path:
     sys.path.append("/opt/airflow")
-from app import etl
-import psycopg2
+
+# The scheduler re-parses this file continuously, so the pipeline modules (and
+# psycopg2, requests, numpy behind them) are imported inside the task callables.
+# bench/dag_parse_budget.py keeps it that way.
 
 def _schedule():
     f = (os.getenv("FREQUENCY", "hourly") or "hourly").lower()
@@ -29,14 +31,51 @@ def _pg_cfg():
 def _symbols():
     return [s.strip().upper() for s in (os.getenv("SYMBOLS", "AAPL")).split(",") if s.strip()]
 
-def _run_then_validate():
+def _plan_shards():
+    from app import etl, shards
+
     if not os.getenv("ALPHA_VANTAGE_API_KEY"):
         raise RuntimeError("ALPHA_VANTAGE_API_KEY missing")
-    etl.run()
+    # SYMBOLS, or with SYMBOL_SOURCE=demand the symbols most in need of a refresh (app/scheduler.py).
+    return shards.plan(etl.select_symbols(etl.load_settings()))
+
+def _run_shard(symbols, ti=None):
+    from app import etl
+
+    # Shards share the provider budget through the rate limiter; a failed
+    # shard raises so that only its own symbols are retried. Its results are
+    # pushed first, so the downstream tasks (trigger_rule="all_done") still
+    # see the symbols it did write.
+    if ti:
+        # One metrics textfile per mapped instance (app/metrics.py).
+        os.environ["METRICS_SHARD"] = str(ti.map_index)
+    results = etl.run(symbols=symbols)
+    failed = {s: r["error"] for s, r in results.items() if r["status"] != "ok"}
+    if failed:
+        if ti:
+            ti.xcom_push(key="partial", value=results)
+        raise RuntimeError(f"Failed symbols: {failed}")
+    return results
+
+def _shard_results(ti):
+    results = {}
+    for key in ("partial", "return_value"):
+        for shard in (ti.xcom_pull(task_ids="fetch_shard", key=key) if ti else None) or []:
+            results.update(shard or {})
+    return results
+
+def _planned_symbols(ti):
+    return [s for shard in (ti.xcom_pull(task_ids="plan_shards") if ti else None) or [] for s in shard["symbols"]]
+
+def _validate(ti=None):
+    import psycopg2
+    from app import quality
+
+    print({"loaded": {s: r["rows"] for s, r in _shard_results(ti).items()}})
     conn = psycopg2.connect(**_pg_cfg())
     try:
         with conn.cursor() as cur:
-            syms = _symbols()
+            syms = sorted(_shard_results(ti)) or _planned_symbols(ti) or _symbols()
             cur.execute(
                 "SELECT symbol, COUNT(*) FROM stock_prices WHERE ts >= NOW() - INTERVAL '7 days' AND symbol = ANY(%s) GROUP BY symbol",
                 (syms,)
@@ -48,9 +87,43 @@ def _run_then_validate():
             if all(c == 0 for c in seen.values()):
                 raise RuntimeError(f"No recent data found for symbols: {syms}")
             print({"validated": seen})
+        # Gaps and bad bars are found while writing (app/quality.py); report what is still open.
+        print({"open_quality_findings": quality.summary(conn, "stock_prices", syms)})
     finally:
         conn.close()
 
+def _value_portfolios(ti=None):
+    import psycopg2
+    from app import valuation
+
+    # Only users holding a symbol whose bars changed in this run are revalued.
+    conn = psycopg2.connect(**_pg_cfg())
+    try:
+        valuation.run(conn, valuation.changed_symbols(_shard_results(ti)))
+    finally:
+        conn.close()
+
+def _export_history():
+    import psycopg2
+    from app import export
+
+    # Appends settled bars to the columnar export (EXPORT_DIR) before old partitions are dropped.
+    export.run(lambda: psycopg2.connect(**_pg_cfg()), ["stock_prices"])
+
+def _maintain_partitions():
+    import psycopg2
+    from app import partitions
+
+    conn = psycopg2.connect(**_pg_cfg())
+    try:
+        print({"partitions": partitions.maintain(conn)})
+    finally:
+        conn.close()
+
+def _shards_succeeded():
+    # Only reached when every fetch_shard instance succeeded (all_success).
+    print("[ETL] all shards succeeded")
+
 default_args = {
     "owner": "data-eng",
     "depends_on_past": False,
@@ -69,5 +142,17 @@ with DAG(
     default_args=default_args,
     tags=["stocks", "etl", "postgres"],
 ) as dag:
-    run = PythonOperator(task_id="run_etl_and_validate", python_callable=_run_then_validate)
-    run
+    plan = PythonOperator(task_id="plan_shards", python_callable=_plan_shards)
+    fetch = PythonOperator.partial(task_id="fetch_shard", python_callable=_run_shard).expand(op_kwargs=plan.output)
+    # One failed shard must not skip the rest of the run: the downstream tasks
+    # work on whatever the other shards (and the failed one, partially) wrote.
+    validate = PythonOperator(task_id="validate", python_callable=_validate, trigger_rule="all_done")
+    value = PythonOperator(task_id="value_portfolios", python_callable=_value_portfolios, trigger_rule="all_done")
+    export = PythonOperator(task_id="export_history", python_callable=_export_history, trigger_rule="all_done")
+    maintain = PythonOperator(task_id="maintain_partitions", python_callable=_maintain_partitions, trigger_rule="all_done")
+    # The run's state comes from its leaf tasks, which all_done would leave green
+    # after a failed shard; this all_success leaf fails the run instead.
+    succeeded = PythonOperator(task_id="shards_succeeded", python_callable=_shards_succeeded)
+    plan >> fetch >> validate >> [value, export]
+    export >> maintain
+    [fetch, value, maintain] >> succeeded
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The DAGs import the pipeline as ``app`` from backend/airflow.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
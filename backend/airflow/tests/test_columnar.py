@@ -0,0 +1,43 @@
+import numpy as np
+
+from app import columnar
+
+
+def test_from_series_parses_columns():
+    series = {
+        "2026-01-05 10:00:00": {"1. open": "1.5", "2. high": "2", "3. low": "1", "4. close": "1.75", "5. volume": "300"},
+        "2026-01-05 09:55:00": {"1. open": "", "2. high": "x", "3. low": "1", "4. close": "1.25", "5. volume": ""},
+    }
+    bars = columnar.from_series(series)
+    assert len(bars) == 2
+    assert bars.ts.dtype == np.dtype("datetime64[s]")
+    assert bars.ts[0] == np.datetime64("2026-01-05T10:00:00")
+    np.testing.assert_array_equal(bars.close, [1.75, 1.25])
+    assert np.isnan(bars.open[1]) and np.isnan(bars.high[1])
+    assert np.isnan(bars.adjusted_close).all()
+    np.testing.assert_array_equal(bars.volume, [300, columnar.MISSING_VOLUME])
+
+
+def test_from_series_drops_bars_without_timestamp_or_close():
+    series = {
+        "not a date": {"4. close": "1"},
+        "2026-01-05 10:00:00": {"4. close": None},
+        "2026-01-05 10:05:00": {"1. open": "1"},
+        "2026-01-05 10:10:00": {"4. close": "2"},
+    }
+    bars = columnar.from_series(series)
+    np.testing.assert_array_equal(bars.ts, [np.datetime64("2026-01-05T10:10:00")])
+    np.testing.assert_array_equal(bars.close, [2.0])
+
+
+def test_from_series_daily_adjusted():
+    series = {"2026-01-05": {"1. open": "1", "2. high": "2", "3. low": "0.5", "4. close": "1.5",
+                             "5. adjusted close": "0.75", "6. volume": "10"}}
+    bars = columnar.from_series(series, columnar.DAILY_ADJUSTED_FIELDS)
+    assert bars.ts[0] == np.datetime64("2026-01-05T00:00:00")
+    np.testing.assert_array_equal(bars.adjusted_close, [0.75])
+    np.testing.assert_array_equal(bars.volume, [10])
+
+
+def test_from_series_empty():
+    assert len(columnar.from_series({})) == 0
@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+import pytest
+
+from app import indicators
+
+
+def _naive_ewm(values, alpha, init=math.nan):
+    out, prev = [], init
+    for x in values:
+        prev = x if math.isnan(prev) else prev + alpha * (x - prev)
+        out.append(prev)
+    return np.array(out)
+
+
+def _bars(n, seed=7):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, n))
+    high = close + rng.uniform(0, 1, n)
+    low = close - rng.uniform(0, 1, n)
+    volume = rng.integers(100, 10_000, n).astype(float)
+    # 5min bars over a few sessions, so the session VWAP restarts.
+    ts = np.datetime64("2026-01-05T09:30") + np.arange(n) * np.timedelta64(5, "m")
+    ts = ts + (np.arange(n) // 78) * np.timedelta64(17 * 60 + 30, "m")
+    return ts.astype("datetime64[s]"), high, low, close, volume
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, indicators._BLOCK, 3 * indicators._BLOCK + 17])
+@pytest.mark.parametrize("init", [math.nan, 42.0])
+def test_ewm_matches_loop(n, init):
+    values = np.random.default_rng(n).normal(50, 5, n)
+    np.testing.assert_allclose(indicators.ewm(values, 0.1, init), _naive_ewm(values, 0.1, init), rtol=1e-10)
+
+
+def test_compute_matches_loop():
+    ts, high, low, close, volume = _bars(300)
+    out = indicators.compute(ts, high, low, close, volume)
+
+    ema = _naive_ewm(close, 2.0 / (indicators.EMA_PERIOD + 1))
+    ema[:indicators.EMA_PERIOD - 1] = np.nan
+    np.testing.assert_allclose(out["ema_20"], ema, rtol=1e-10)
+
+    sma = np.full(len(close), np.nan)
+    for i in range(indicators.SMA_PERIOD - 1, len(close)):
+        sma[i] = close[i - indicators.SMA_PERIOD + 1:i + 1].mean()
+    np.testing.assert_allclose(out["sma_20"], sma, rtol=1e-10)
+
+    diff = np.diff(close)
+    gain = _naive_ewm(np.clip(diff, 0, None), 1.0 / indicators.RSI_PERIOD)
+    loss = _naive_ewm(np.clip(-diff, 0, None), 1.0 / indicators.RSI_PERIOD)
+    with np.errstate(divide="ignore"):
+        rsi = np.r_[np.nan, 100 - 100 / (1 + gain / loss)]
+    rsi[:indicators.RSI_PERIOD] = np.nan
+    np.testing.assert_allclose(out["rsi_14"], rsi, rtol=1e-10)
+
+    vwap = np.empty(len(close))
+    pv = v = 0.0
+    for i in range(len(close)):
+        if i == 0 or ts[i].astype("datetime64[D]") != ts[i - 1].astype("datetime64[D]"):
+            pv = v = 0.0
+        typical = (high[i] + low[i] + close[i]) / 3
+        pv += typical * volume[i]
+        v += volume[i]
+        vwap[i] = pv / v
+    np.testing.assert_allclose(out["vwap"], vwap, rtol=1e-10)
+
+
+def test_compute_resumes_from_state():
+    ts, high, low, close, volume = _bars(250)
+    full = indicators.compute(ts, high, low, close, volume)
+    start = 180
+    state = (full["ema_20"][start - 1], full["rsi_avg_gain"][start - 1], full["rsi_avg_loss"][start - 1])
+    lo = start - indicators.LOOKBACK
+    part = indicators.compute(ts[lo:], high[lo:], low[lo:], close[lo:], volume[lo:], indicators.LOOKBACK, state)
+    for name in ("sma_20", "ema_20", "rsi_14", "volatility_20", "rsi_avg_gain", "rsi_avg_loss"):
+        np.testing.assert_allclose(part[name], full[name][start:], rtol=1e-9, err_msg=name)
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from app import jsonstream
+
+
+ITEMS = [
+    {"timestamp": "2026-01-05T10:00:00Z", "close": 101.25, "volume": 1200},
+    {"timestamp": "2026-01-05T10:05:00Z", "close": 1e-3, "note": "café – \U0001F4C8"},
+    [1, 2, [3, {"deep": None}]],
+    "plain, string ] with brackets",
+    12345678901234567890,
+    True,
+    None,
+]
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 20])
+def test_iter_array_items_across_chunk_boundaries(size):
+    data = json.dumps(ITEMS, ensure_ascii=False).encode()
+    assert list(jsonstream.iter_array_items(_chunks(data, size))) == ITEMS
+
+
+def test_iter_array_items_number_at_chunk_edge():
+    # "12" then "34": the first chunk must not yield 12.
+    assert list(jsonstream.iter_array_items([b"[12", b"34, 5", b"6]"])) == [1234, 56]
+
+
+def test_iter_array_items_empty_and_whitespace():
+    assert list(jsonstream.iter_array_items([b"  [", b" \n ", b"]"])) == []
+
+
+def test_iter_array_items_long_stream():
+    items = [{"i": i, "pad": "x" * 50} for i in range(5000)]
+    data = json.dumps(items).encode()
+    assert list(jsonstream.iter_array_items(_chunks(data, 4096))) == items
+
+
+def test_iter_array_items_rejects_non_array():
+    with pytest.raises(ValueError):
+        list(jsonstream.iter_array_items([b'{"a": 1}']))
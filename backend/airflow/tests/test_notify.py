@@ -0,0 +1,48 @@
+from datetime import date, datetime, timedelta
+
+from app import notify
+
+
+def _merged(n):
+    first = datetime(2026, 1, 5, 9, 30)
+    return {
+        f"SYM{i:05d}": {"first": first, "last": first + timedelta(minutes=5 * i), "new": i, "changed": i % 3}
+        for i in range(n)
+    }
+
+
+def test_payloads_stay_under_limit_and_cover_every_symbol():
+    merged = _merged(2000)
+    messages = notify.payloads("stock_prices", merged)
+    assert len(messages) > 1
+    seen = {}
+    for msg in messages:
+        assert len(msg.encode()) <= notify.MAX_PAYLOAD
+        table, changes = notify.parse(msg)
+        assert table == "stock_prices"
+        assert not seen.keys() & changes.keys()
+        seen.update(changes)
+    assert seen.keys() == merged.keys()
+    change = seen["SYM00042"]
+    assert (change.first, change.last, change.new, change.changed) == (
+        merged["SYM00042"]["first"], merged["SYM00042"]["last"], 42, 0,
+    )
+
+
+def test_payloads_single_message_and_dates():
+    merged = {"AAPL": {"first": date(2026, 1, 2), "last": date(2026, 1, 5), "new": 2, "changed": 1}}
+    [msg] = notify.payloads("stocks", merged)
+    table, changes = notify.parse(msg)
+    assert table == "stocks"
+    assert changes["AAPL"].first == date(2026, 1, 2)
+    assert changes["AAPL"].last == date(2026, 1, 5)
+
+
+def test_payloads_empty():
+    assert notify.payloads("stock_prices", {}) == []
+
+
+def test_change_merge_widens_range():
+    a = notify.Change("X", datetime(2026, 1, 5, 10), datetime(2026, 1, 5, 11), 1, 0)
+    a.merge(notify.Change("X", datetime(2026, 1, 5, 9), datetime(2026, 1, 5, 10), 2, 3))
+    assert (a.first, a.last, a.new, a.changed) == (datetime(2026, 1, 5, 9), datetime(2026, 1, 5, 11), 3, 3)
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from app import scheduler
+
+
+NOW = datetime(2026, 1, 5, 18, 0)  # UTC
+LEVELS = [
+    scheduler.Tier("hot", 0.25, timedelta(hours=1)),
+    scheduler.Tier("cold", 1.0, timedelta(hours=24)),
+]
+
+
+def _demand(**kwargs):
+    return {sym: scheduler.Demand(sym, **fields) for sym, fields in kwargs.items()}
+
+
+def test_plan_orders_due_by_tier_then_staleness(monkeypatch):
+    monkeypatch.setenv("SCHEDULER_EXCHANGE_TZ", "America/New_York")
+    demand = _demand(
+        HOT={"watchers": 5, "last_refreshed": NOW - timedelta(hours=2)},
+        OLD={"last_refreshed": NOW - timedelta(days=3)},
+        STALE={"last_refreshed": NOW - timedelta(days=2)},
+        FRESH={"last_refreshed": NOW - timedelta(hours=6)},
+        NEW={},
+    )
+    plan = scheduler.plan(demand, {}, budget=10, levels=LEVELS, now=NOW)
+    assert plan.tier["HOT"] == "hot" and plan.tier["OLD"] == "cold"
+    # Never-seen symbols are infinitely stale; within a tier the stalest goes first.
+    assert plan.symbols == ["HOT", "NEW", "OLD", "STALE", "FRESH"]
+    assert plan.due == 4
+    assert plan.staleness["FRESH"] == 0.25
+    assert plan.skipped == []
+
+
+def test_plan_budget_skips_due_symbols():
+    demand = _demand(A={}, B={}, C={})
+    plan = scheduler.plan(demand, {}, budget=2, levels=LEVELS, now=NOW)
+    assert plan.symbols == ["A", "B"]
+    assert plan.skipped == ["C"]
+    assert plan.summary()["skipped_due"] == 1
+    assert scheduler.plan(demand, {}, budget=-1, levels=LEVELS, now=NOW).symbols == []
+
+
+def test_plan_uses_bar_watermark_in_exchange_time(monkeypatch):
+    monkeypatch.setenv("SCHEDULER_EXCHANGE_TZ", "America/New_York")
+    demand = _demand(A={})
+    # 12:30 in New York is 17:30 UTC: half an hour before NOW.
+    plan = scheduler.plan(demand, {"A": datetime(2026, 1, 5, 12, 30)}, budget=1, levels=LEVELS, now=NOW)
+    assert plan.staleness["A"] == 0.5 / 24
+
+
+def test_plan_puts_recent_failures_last():
+    demand = _demand(
+        BROKEN={"watchers": 9, "failing": True, "last_attempt": NOW - timedelta(minutes=10)},
+        OK={"watchers": 1},
+    )
+    plan = scheduler.plan(demand, {}, budget=2, levels=LEVELS, now=NOW)
+    assert plan.symbols == ["OK", "BROKEN"]
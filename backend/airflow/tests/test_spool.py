@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from app import bulkload, columnar, spool
+
+
+def _bars():
+    return columnar.from_series({
+        "2026-01-05 10:00:00": {"1. open": "1", "2. high": "2", "3. low": "0.5", "4. close": "1.5", "5. volume": "10"},
+        "2026-01-05 10:05:00": {"1. open": "", "2. high": "2", "3. low": "0.5", "4. close": "1.25", "5. volume": ""},
+    })
+
+
+def _assert_same(a, b):
+    for name in a.__dataclass_fields__:
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name), err_msg=name)
+
+
+def test_encode_decode_round_trip():
+    bars = _bars()
+    record = spool.encode("BRK.B", bars)
+    symbol, decoded = spool.decode(record[spool._HEADER.size:])
+    assert symbol == "BRK.B"
+    _assert_same(decoded, bars)
+
+
+def test_decode_rejects_wrong_length():
+    record = spool.encode("AAPL", _bars())
+    with pytest.raises(spool.CorruptRecord):
+        spool.decode(record[spool._HEADER.size:-8])
+
+
+def test_read_segment_round_trip(tmp_path):
+    path = tmp_path / "0001.seg"
+    path.write_bytes(spool.encode("AAPL", _bars()) + spool.encode("MSFT", _bars()))
+    records = list(spool.read_segment(str(path)))
+    assert [sym for sym, _ in records] == ["AAPL", "MSFT"]
+    _assert_same(records[1][1], _bars())
+
+
+@pytest.mark.parametrize("damage", ["truncate", "flip", "magic", "short_header"])
+def test_read_segment_stops_at_corruption(tmp_path, damage):
+    good = spool.encode("AAPL", _bars())
+    bad = bytearray(spool.encode("MSFT", _bars()))
+    if damage == "truncate":
+        bad = bad[:-5]
+    elif damage == "flip":
+        bad[-1] ^= 0xFF
+    elif damage == "magic":
+        bad[:4] = b"XXXX"
+    else:
+        bad = bad[:spool._HEADER.size - 1]
+    path = tmp_path / "0001.seg"
+    path.write_bytes(good + bytes(bad))
+    records = spool.read_segment(str(path))
+    assert next(records)[0] == "AAPL"
+    with pytest.raises(spool.CorruptRecord):
+        next(records)
+
+
+def test_to_bars_from_tuples():
+    rows = [
+        ("AAPL", "2026-01-05T10:00:00Z", 1.0, 2.0, 0.5, 1.5, 1.4, 10),
+        ("AAPL", "2026-01-05 10:05:00", 1.0, 2.0, 0.5, 1.25, None, None),
+    ]
+    bars = spool.to_bars(bulkload.PRICES_ADJUSTED, rows)
+    np.testing.assert_array_equal(bars.ts, np.array(["2026-01-05T10:00:00", "2026-01-05T10:05:00"], dtype="datetime64[s]"))
+    np.testing.assert_array_equal(bars.close, [1.5, 1.25])
+    assert np.isnan(bars.adjusted_close[1])
+    np.testing.assert_array_equal(bars.volume, [10, columnar.MISSING_VOLUME])
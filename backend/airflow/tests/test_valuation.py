@@ -0,0 +1,49 @@
+import numpy as np
+
+from app import valuation
+
+
+def test_value_aggregates_per_user():
+    pos = valuation.Positions(
+        user_id=np.array([2, 1, 2, 1], dtype=np.int64),
+        symbol=np.array(["AAPL", "AAPL", "MSFT", "XYZ"], dtype=object),
+        quantity=np.array([10.0, 5.0, 2.0, 100.0]),
+        avg_price=np.array([100.0, 120.0, 300.0, 1.0]),
+        price=np.array([110.0, 110.0, 250.0, np.nan]),
+    )
+    val = valuation.value(pos)
+    np.testing.assert_array_equal(val["user_id"], [1, 2])
+    np.testing.assert_allclose(val["market_value"], [550.0, 1600.0])
+    # The unpriced XYZ position is left out of the cost basis too.
+    np.testing.assert_allclose(val["cost_basis"], [600.0, 1600.0])
+    np.testing.assert_allclose(val["unrealized_pnl"], [-50.0, 0.0])
+    np.testing.assert_allclose(val["unrealized_pct"], [-50.0 / 6, 0.0])
+    np.testing.assert_array_equal(val["positions"], [2, 2])
+    np.testing.assert_array_equal(val["unpriced"], [1, 0])
+    np.testing.assert_allclose(val["value"], [1100.0, 550.0, 500.0, 0.0])
+    np.testing.assert_allclose(val["pnl"], [100.0, -50.0, -100.0, 0.0])
+    np.testing.assert_allclose(val["weight"], [1100 / 1600, 1.0, 500 / 1600, 0.0])
+
+
+def test_value_without_priced_positions():
+    pos = valuation.Positions(
+        user_id=np.array([1], dtype=np.int64),
+        symbol=np.array(["XYZ"], dtype=object),
+        quantity=np.array([1.0]),
+        avg_price=np.array([10.0]),
+        price=np.array([np.nan]),
+    )
+    val = valuation.value(pos)
+    assert val["market_value"][0] == 0.0
+    assert np.isnan(val["unrealized_pct"][0])
+    assert val["weight"][0] == 0.0
+
+
+def test_changed_symbols():
+    results = {
+        "A": {"status": "ok", "new": 1},
+        "B": {"status": "ok", "new": 0, "changed": 0},
+        "C": {"status": "error", "new": 3},
+        "D": {"status": "ok", "changed": 2},
+    }
+    assert valuation.changed_symbols(results) == ["A", "D"]
@@ -43,8 +43,10 @@ func main(){
   r.HandleFunc("/auth/me", app.auth(app.getMe)).Methods("GET")
   r.HandleFunc("/stocks", app.auth(app.listLatest)).Methods("GET")
   r.HandleFunc("/stocks/{symbol}", app.auth(app.history)).Methods("GET")
+  r.HandleFunc("/stocks/{symbol}/indicators", app.auth(app.indicators)).Methods("GET")
   r.HandleFunc("/portfolio", app.auth(app.getPortfolio)).Methods("GET")
   r.HandleFunc("/portfolio", app.auth(app.upsertPortfolio)).Methods("POST")
+  r.HandleFunc("/portfolio/history", app.auth(app.portfolioHistory)).Methods("GET")
   r.HandleFunc("/preferences", app.auth(app.getPreferences)).Methods("GET")
   r.HandleFunc("/preferences", app.auth(app.updatePreferences)).Methods("POST")
   
@@ -144,21 +146,41 @@ func (a *App) adminOnly(next http.HandlerFunc) http.HandlerFunc {
 }
 
 func (a *App) listLatest(w http.ResponseWriter, r *http.Request){
-  rows, err := a.db.Query(`SELECT DISTINCT ON(symbol) symbol, ts, close, volume FROM stock_prices ORDER BY symbol, ts DESC`)
+  // latest_quotes is kept current by the ingestion writers, one row per symbol.
+  rows, err := a.db.Query(`SELECT symbol, ts, close, volume, prev_close, change_pct FROM latest_quotes ORDER BY symbol`)
   if err!=nil { http.Error(w,err.Error(),500); return }
   defer rows.Close()
   out := []map[string]any{}
   for rows.Next(){
-    var s string; var ts time.Time; var c sql.NullFloat64; var v sql.NullInt64
-    rows.Scan(&s,&ts,&c,&v)
-    out = append(out, map[string]any{"symbol":s,"ts":ts,"close":nullf(c),"volume":nulli(v)})
+    var s string; var ts time.Time; var c, pc, chg sql.NullFloat64; var v sql.NullInt64
+    rows.Scan(&s,&ts,&c,&v,&pc,&chg)
+    out = append(out, map[string]any{"symbol":s,"ts":ts,"close":nullf(c),"volume":nulli(v),"prev_close":nullf(pc),"change_pct":nullf(chg)})
   }
   json.NewEncoder(w).Encode(out)
 }
 
+// recordView counts a symbol page view; the ingestion scheduler (app/scheduler.py) refreshes viewed symbols more often.
+func (a *App) recordView(sym string){
+  go func(){
+    _, err := a.db.Exec(`INSERT INTO symbol_views(symbol, day, views) VALUES(upper($1), CURRENT_DATE, 1)
+      ON CONFLICT (symbol, day) DO UPDATE SET views = symbol_views.views + 1`, sym)
+    if err!=nil { log.Println("recordView:", err) }
+  }()
+}
+
 func (a *App) history(w http.ResponseWriter, r *http.Request){
   sym := mux.Vars(r)["symbol"]
-  rows, err := a.db.Query(`SELECT ts, open, high, low, close, volume FROM stock_prices WHERE symbol=$1 ORDER BY ts DESC LIMIT 300`, sym)
+  a.recordView(sym)
+  var rows *sql.Rows; var err error
+  switch interval := r.URL.Query().Get("interval"); interval {
+  case "", "raw":
+    rows, err = a.db.Query(`SELECT ts, open, high, low, close, volume FROM stock_prices WHERE symbol=$1 ORDER BY ts DESC LIMIT 300`, sym)
+  case "15min", "30min", "60min", "1d", "1w", "1mo":
+    // Pre-aggregated by the ingestion pipeline (price_rollups), one row per period.
+    rows, err = a.db.Query(`SELECT period_start, open, high, low, close, volume FROM price_rollups WHERE symbol=$1 AND resolution=$2 ORDER BY period_start DESC LIMIT 300`, sym, interval)
+  default:
+    http.Error(w,"interval must be one of raw, 15min, 30min, 60min, 1d, 1w, 1mo",400); return
+  }
   if err!=nil { http.Error(w,err.Error(),500); return }
   defer rows.Close()
   out := []map[string]any{}
@@ -170,6 +192,25 @@ func (a *App) history(w http.ResponseWriter, r *http.Request){
   json.NewEncoder(w).Encode(out)
 }
 
+func (a *App) indicators(w http.ResponseWriter, r *http.Request){
+  sym := mux.Vars(r)["symbol"]
+  // Computed per bar by the ingestion pipeline (price_indicators), one series per bar width;
+  // ?interval=5min|60min picks one, the default is the series written last.
+  rows, err := a.db.Query(`SELECT ts, sma_20, ema_20, rsi_14, vwap, volatility_20 FROM price_indicators
+    WHERE symbol=$1 AND resolution = COALESCE(NULLIF($2, ''),
+      (SELECT resolution FROM price_indicators WHERE symbol=$1 ORDER BY ts DESC LIMIT 1))
+    ORDER BY ts DESC LIMIT 300`, sym, r.URL.Query().Get("interval"))
+  if err!=nil { http.Error(w,err.Error(),500); return }
+  defer rows.Close()
+  out := []map[string]any{}
+  for rows.Next(){
+    var ts time.Time; var sma, ema, rsi, vwap, vol sql.NullFloat64
+    rows.Scan(&ts,&sma,&ema,&rsi,&vwap,&vol)
+    out = append(out, map[string]any{"ts":ts,"sma20":nullf(sma),"ema20":nullf(ema),"rsi14":nullf(rsi),"vwap":nullf(vwap),"volatility20":nullf(vol)})
+  }
+  json.NewEncoder(w).Encode(out)
+}
+
 type portReq struct{ Symbol string; Quantity float64; AvgBuyPrice float64 }
 func (a *App) upsertPortfolio(w http.ResponseWriter, r *http.Request){
   u := getUserID(r); var pr portReq; json.NewDecoder(r.Body).Decode(&pr)
@@ -186,9 +227,7 @@ func (a *App) upsertPortfolio(w http.ResponseWriter, r *http.Request){
 func (a *App) getPortfolio(w http.ResponseWriter, r *http.Request){
   u := getUserID(r)
   rows, err := a.db.Query(`SELECT p.symbol, p.quantity, p.avg_buy_price, sp.close FROM portfolios p
-    LEFT JOIN LATERAL (
-      SELECT close FROM stock_prices WHERE symbol=p.symbol ORDER BY ts DESC LIMIT 1
-    ) sp ON true WHERE p.user_id=$1 ORDER BY p.symbol`, u)
+    LEFT JOIN latest_quotes sp ON sp.symbol=p.symbol WHERE p.user_id=$1 ORDER BY p.symbol`, u)
   if err!=nil { http.Error(w,err.Error(),500); return }
   defer rows.Close()
   out := []map[string]any{}
@@ -205,6 +244,21 @@ func (a *App) getPortfolio(w http.ResponseWriter, r *http.Request){
   json.NewEncoder(w).Encode(out)
 }
 
+func (a *App) portfolioHistory(w http.ResponseWriter, r *http.Request){
+  u := getUserID(r)
+  rows, err := a.db.Query(`SELECT as_of, market_value, cost_basis, unrealized_pnl FROM portfolio_snapshots
+    WHERE user_id=$1 AND as_of >= NOW() - INTERVAL '90 days' ORDER BY as_of`, u)
+  if err!=nil { http.Error(w,err.Error(),500); return }
+  defer rows.Close()
+  out := []map[string]any{}
+  for rows.Next(){
+    var at time.Time; var mv, cost, pnl sql.NullFloat64
+    rows.Scan(&at,&mv,&cost,&pnl)
+    out = append(out, map[string]any{"asOf":at, "marketValue":nullf(mv), "costBasis":nullf(cost), "unrealizedPnl":nullf(pnl)})
+  }
+  json.NewEncoder(w).Encode(out)
+}
+
 func (a *App) getPreferences(w http.ResponseWriter, r *http.Request){
   u := getUserID(r)
   var markets, watchlist string
@@ -266,12 +320,14 @@ func (a *App) getAllUsers(w http.ResponseWriter, r *http.Request){
 }
 
 func (a *App) getAllPortfolios(w http.ResponseWriter, r *http.Request){
-  rows, err := a.db.Query(`SELECT u.id, u.email, p.symbol, p.quantity, p.avg_buy_price, sp.close 
+  // Totals come from the newest snapshot written by the valuation job (app/valuation.py).
+  rows, err := a.db.Query(`SELECT u.id, u.email, p.symbol, p.quantity, p.avg_buy_price, sp.close,
+    ps.market_value, ps.unrealized_pnl, ps.as_of
     FROM users u 
     LEFT JOIN portfolios p ON u.id = p.user_id 
-    LEFT JOIN LATERAL (
-      SELECT close FROM stock_prices WHERE symbol=p.symbol ORDER BY ts DESC LIMIT 1
-    ) sp ON true 
+    LEFT JOIN latest_quotes sp ON sp.symbol=p.symbol 
+    LEFT JOIN LATERAL (SELECT market_value, unrealized_pnl, as_of FROM portfolio_snapshots s
+      WHERE s.user_id=u.id ORDER BY as_of DESC LIMIT 1) ps ON true
     ORDER BY u.email, p.symbol`)
   if err!=nil { http.Error(w,err.Error(),500); return }
   defer rows.Close()
@@ -279,13 +335,18 @@ func (a *App) getAllPortfolios(w http.ResponseWriter, r *http.Request){
   userPortfolios := make(map[string]any)
   for rows.Next(){
     var userID int; var email string; var symbol sql.NullString
-    var quantity, avgPrice, lastPrice sql.NullFloat64
-    rows.Scan(&userID,&email,&symbol,&quantity,&avgPrice,&lastPrice)
+    var quantity, avgPrice, lastPrice, marketValue, pnl sql.NullFloat64; var valuedAt sql.NullTime
+    rows.Scan(&userID,&email,&symbol,&quantity,&avgPrice,&lastPrice,&marketValue,&pnl,&valuedAt)
     
     if _, exists := userPortfolios[email]; !exists {
+      var at any
+      if valuedAt.Valid { at = valuedAt.Time }
       userPortfolios[email] = map[string]any{
         "user_id": userID,
         "email": email,
+        "marketValue": nullf(marketValue),
+        "unrealizedPnl": nullf(pnl),
+        "valuedAt": at,
         "portfolio": []map[string]any{},
       }
     }
@@ -315,9 +376,7 @@ func (a *App) getUserPortfolio(w http.ResponseWriter, r *http.Request){
   if err != nil { http.Error(w,"invalid user id",400); return }
   
   rows, err := a.db.Query(`SELECT p.symbol, p.quantity, p.avg_buy_price, sp.close FROM portfolios p
-    LEFT JOIN LATERAL (
-      SELECT close FROM stock_prices WHERE symbol=p.symbol ORDER BY ts DESC LIMIT 1
-    ) sp ON true WHERE p.user_id=$1 ORDER BY p.symbol`, userID)
+    LEFT JOIN latest_quotes sp ON sp.symbol=p.symbol WHERE p.user_id=$1 ORDER BY p.symbol`, userID)
   if err!=nil { http.Error(w,err.Error(),500); return }
   defer rows.Close()
   out := []map[string]any{}
@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import requests
 import psycopg2
 import psycopg2.extras
@@ -7,14 +8,35 @@ from datetime import datetime, timedelta
 import time
 import logging
 
+# Shared pipeline modules live in backend/airflow/app (mounted at /opt/airflow/app
+# inside the Airflow containers, copied next to this file in the worker image).
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for _path in (_HERE, os.path.join(_HERE, '..', 'airflow'), '/opt/airflow'):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+from app import bulkload, columnar, jsonstream, latest, metrics, notify, quality, ratelimit, respcache, spool, watermark
+
+# latest_quotes is moved forward, and the new days checked for gaps, in the same transaction as every daily upsert,
+# which announces the changed days to listeners when it commits.
+DAILY_STAGES = (
+    latest.stage_for(bulkload.DAILY),
+    quality.stage_for(bulkload.DAILY, timedelta(days=1)),
+    notify.stage_for(bulkload.DAILY),
+)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class StockDataFetcher:
-    def __init__(self):
+    def __init__(self, symbols=None):
         self.api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
-        self.symbols = os.getenv('SYMBOLS', 'AAPL,MSFT,GOOGL').split(',')
+        self.symbols = symbols if symbols is not None else os.getenv('SYMBOLS', 'AAPL,MSFT,GOOGL').split(',')
+        self.base_url = os.getenv('ALPHA_VANTAGE_URL', 'https://www.alphavantage.co/query')
+        self.write_batch_rows = int(os.getenv('ETL_WRITE_BATCH_ROWS', '50000'))
+        # When set, full histories are parsed and written in batches of this many bars.
+        self.stream_batch_rows = int(os.getenv('STREAM_BATCH_ROWS', '0'))
         
         # Database configuration
         self.db_config = {
@@ -22,7 +44,8 @@ class StockDataFetcher:
             'port': os.getenv('POSTGRES_PORT', '5432'),
             'user': os.getenv('POSTGRES_USER', 'admin'),
             'password': os.getenv('POSTGRES_PASSWORD', 'adminpassword'),
-            'database': os.getenv('POSTGRES_DB', 'stocks')
+            'database': os.getenv('POSTGRES_DB', 'stocks'),
+            'connect_timeout': int(os.getenv('POSTGRES_CONNECT_TIMEOUT_SEC', '10'))
         }
         
         if not self.api_key or self.api_key == 'your_api_key_here':
@@ -46,26 +69,40 @@ class StockDataFetcher:
                 else:
                     raise
 
-    def fetch_stock_data(self, symbol):
+    def cache_key(self, symbol, outputsize):
+        return respcache.Key('alphavantage', 'TIME_SERIES_DAILY_ADJUSTED', symbol, 'daily', outputsize)
+
+    def fetch_stock_data(self, symbol, outputsize='full'):
         """Fetch stock data from Alpha Vantage API."""
-        url = f"https://www.alphavantage.co/query"
+        url = self.base_url
         params = {
             'function': 'TIME_SERIES_DAILY_ADJUSTED',
             'symbol': symbol,
-            'outputsize': 'full',
+            'outputsize': outputsize,
             'apikey': self.api_key
         }
         
+        cache = respcache.get_cache()
+        key = self.cache_key(symbol, outputsize)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Using cached response for {symbol}")
+            return json.loads(cached)['Time Series (Daily)']
+
         max_retries = 3
         retry_delay = 1
         
         for attempt in range(max_retries):
             try:
                 logger.info(f"Fetching data for {symbol}, attempt {attempt + 1}")
-                response = requests.get(url, params=params, timeout=30)
-                response.raise_for_status()
+                ratelimit.acquire('alphavantage', self.db_config)
+                with metrics.timer('fetch', provider='alphavantage'):
+                    response = requests.get(url, params=params, timeout=30)
+                    response.raise_for_status()
+                metrics.inc('http_bytes', len(response.content), provider='alphavantage')
                 
-                data = response.json()
+                with metrics.timer('parse', provider='alphavantage'):
+                    data = response.json()
                 
                 # Check for API error messages
                 if 'Error Message' in data:
@@ -74,7 +111,9 @@ class StockDataFetcher:
                 
                 if 'Note' in data:
                     logger.warning(f"Alpha Vantage API note for {symbol}: {data['Note']}")
+                    ratelimit.throttled('alphavantage', self.db_config)
                     if attempt < max_retries - 1:
+                        metrics.inc('http_retries', provider='alphavantage')
                         time.sleep(retry_delay * (attempt + 1))
                         continue
                     return None
@@ -83,11 +122,15 @@ class StockDataFetcher:
                     logger.error(f"Unexpected response format for {symbol}: {list(data.keys())}")
                     return None
                 
+                cache.put(key, response.content)
                 return data['Time Series (Daily)']
                 
+            except ratelimit.RateLimitExceeded:
+                raise
             except requests.RequestException as e:
                 logger.error(f"HTTP request failed for {symbol}, attempt {attempt + 1}: {e}")
                 if attempt < max_retries - 1:
+                    metrics.inc('http_retries', provider='alphavantage')
                     time.sleep(retry_delay)
                 else:
                     raise
@@ -97,6 +140,63 @@ class StockDataFetcher:
         
         return None
 
+    def iter_stock_batches(self, symbol, outputsize='full'):
+        """Stream the daily series for ``symbol``, yielding ``columnar.Bars`` of at most ``stream_batch_rows`` bars."""
+        params = {
+            'function': 'TIME_SERIES_DAILY_ADJUSTED',
+            'symbol': symbol,
+            'outputsize': outputsize,
+            'apikey': self.api_key
+        }
+
+        cache = respcache.get_cache()
+        key = self.cache_key(symbol, outputsize)
+
+        def batches(chunks):
+            members = jsonstream.iter_object_members(chunks, r"Time Series \(Daily\)")
+            for batch in jsonstream.batched(members, self.stream_batch_rows):
+                yield self.daily_rows(symbol, dict(batch))
+
+        cached = cache.read(key)
+        if cached is not None:
+            logger.info(f"Using cached response for {symbol}")
+            yield from batches(cached)
+            return
+
+        max_retries = 3
+        retry_delay = 1
+
+        for attempt in range(max_retries):
+            logger.info(f"Streaming data for {symbol}, attempt {attempt + 1}")
+            ratelimit.acquire('alphavantage', self.db_config)
+            try:
+                with requests.get(self.base_url, params=params, timeout=30, stream=True) as response, \
+                        cache.recording(key) as rec:
+                    response.raise_for_status()
+                    yield from batches(rec.tee(metrics.counted(response.iter_content(65536), provider='alphavantage')))
+                return
+            except jsonstream.SeriesNotFound as e:
+                data = e.payload if isinstance(e.payload, dict) else {}
+                if 'Error Message' in data:
+                    raise RuntimeError(f"Alpha Vantage API error for {symbol}: {data['Error Message']}")
+                if 'Note' not in data:
+                    raise
+                logger.warning(f"Alpha Vantage API note for {symbol}: {data['Note']}")
+                ratelimit.throttled('alphavantage', self.db_config)
+                if attempt < max_retries - 1:
+                    metrics.inc('http_retries', provider='alphavantage')
+                    time.sleep(retry_delay * (attempt + 1))
+                    continue
+                raise RuntimeError(f"Alpha Vantage throttled {symbol}")
+
+    def daily_rows(self, symbol, time_series):
+        """Normalize an Alpha Vantage daily series into ``columnar.Bars`` for ``bulkload.DAILY``."""
+        with metrics.timer('parse', provider='alphavantage'):
+            bars = columnar.from_series(time_series, columnar.DAILY_ADJUSTED_FIELDS)
+        if len(bars) < len(time_series):
+            logger.error(f"Dropped {len(time_series) - len(bars)} unparsable records for {symbol}")
+        return bars
+
     def upsert_stock_data(self, symbol, time_series):
         """Insert or update stock data in the database."""
         if not time_series:
@@ -107,43 +207,9 @@ class StockDataFetcher:
         try:
             conn = self.get_db_connection()
             cursor = conn.cursor()
-            
-            upsert_query = """
-                INSERT INTO stocks (symbol, date, open, high, low, close, adjusted_close, volume, updated_at)
-                VALUES (%(symbol)s, %(date)s, %(open)s, %(high)s, %(low)s, %(close)s, %(adjusted_close)s, %(volume)s, %(updated_at)s)
-                ON CONFLICT (symbol, date)
-                DO UPDATE SET
-                    open = EXCLUDED.open,
-                    high = EXCLUDED.high,
-                    low = EXCLUDED.low,
-                    close = EXCLUDED.close,
-                    adjusted_close = EXCLUDED.adjusted_close,
-                    volume = EXCLUDED.volume,
-                    updated_at = EXCLUDED.updated_at
-            """
-            
-            records_processed = 0
-            for date_str, daily_data in time_series.items():
-                try:
-                    record = {
-                        'symbol': symbol,
-                        'date': date_str,
-                        'open': float(daily_data['1. open']),
-                        'high': float(daily_data['2. high']),
-                        'low': float(daily_data['3. low']),
-                        'close': float(daily_data['4. close']),
-                        'adjusted_close': float(daily_data['5. adjusted close']),
-                        'volume': int(daily_data['6. volume']),
-                        'updated_at': datetime.now()
-                    }
-                    
-                    cursor.execute(upsert_query, record)
-                    records_processed += 1
-                    
-                except (ValueError, KeyError) as e:
-                    logger.error(f"Error processing record for {symbol} on {date_str}: {e}")
-                    continue
-            
+            records_processed = bulkload.copy_upsert_bars(
+                cursor, bulkload.DAILY, symbol, self.daily_rows(symbol, time_series), DAILY_STAGES
+            )
             conn.commit()
             logger.info(f"Successfully upserted {records_processed} records for {symbol}")
             return records_processed
@@ -157,46 +223,111 @@ class StockDataFetcher:
             if conn:
                 conn.close()
 
+    def _collect(self, written, summary):
+        for symbol, result in written.items():
+            if result['status'] == 'ok':
+                logger.info(
+                    f"Upserted {symbol}: {result['new']} new, {result['changed']} changed, "
+                    f"{result['skipped']} skipped"
+                )
+                summary['total_records'] += result['rows']
+                summary['new_records'] += result['new']
+                summary['changed_records'] += result['changed']
+                summary['skipped_records'] += result['skipped']
+                if symbol not in summary['successful_symbols']:
+                    summary['successful_symbols'].append(symbol)
+                if (result['new'] or result['changed']) and symbol not in summary['changed_symbols']:
+                    summary['changed_symbols'].append(symbol)
+                if result.get('spooled'):
+                    logger.warning(f"Spooled {result['spooled']} records for {symbol} until the database is back")
+                    summary['spooled_records'] += result['spooled']
+            else:
+                logger.error(f"Database error upserting data for {symbol}: {result['error']}")
+                if symbol not in summary['failed_symbols']:
+                    summary['failed_symbols'].append(symbol)
+        # A streamed symbol can succeed in one flush and fail in a later one.
+        summary['successful_symbols'] = [s for s in summary['successful_symbols'] if s not in summary['failed_symbols']]
+
+    def load_watermarks(self, symbols):
+        """Newest stored date per symbol (moved back to open data-quality findings), or an empty mapping if the database is unreachable."""
+        try:
+            conn = self.get_db_connection()
+            try:
+                marks = watermark.load(conn, bulkload.DAILY, symbols)
+                return quality.rewind(conn, bulkload.DAILY, timedelta(days=1), marks, symbols)
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            logger.warning(f"Could not load watermarks, fetching full histories: {e}")
+            return {}
+
     def fetch_all_symbols(self):
-        """Fetch data for all configured symbols."""
-        total_records = 0
-        successful_symbols = []
-        failed_symbols = []
+        """Fetch new bars for all configured symbols, bulk-loading them in as few COPYs as possible.
+
+        The summary carries the run's metrics under ``'report'`` (see ``app.metrics``).
+        """
+        started = metrics.begin()
+        summary = {
+            'total_records': 0,
+            'new_records': 0,
+            'changed_records': 0,
+            'skipped_records': 0,
+            'spooled_records': 0,
+            'successful_symbols': [],
+            'failed_symbols': [],
+            'changed_symbols': [],
+        }
+        symbols = [s.strip() for s in self.symbols if s.strip()]
+        # Rows spooled while the database was unavailable are written before anything new is fetched.
+        drained = spool.replay(bulkload.DAILY, self.get_db_connection, DAILY_STAGES, self.write_batch_rows)
+        self._collect({s: r for s, r in drained.items() if s in symbols}, summary)
+        marks = self.load_watermarks(symbols)
+        # Once a write fails on the connection, the rest of the run is spooled instead of
+        # waiting out get_db_connection's retries for every batch.
+        writer = bulkload.BulkWriter(
+            self.get_db_connection, bulkload.DAILY, self.write_batch_rows, DAILY_STAGES, spool.for_target(bulkload.DAILY)
+        )
         
-        for symbol in self.symbols:
-            symbol = symbol.strip()
-            if not symbol:
-                continue
-                
-            try:
-                logger.info(f"Processing symbol: {symbol}")
-                time_series = self.fetch_stock_data(symbol)
-                
-                if time_series:
-                    records = self.upsert_stock_data(symbol, time_series)
-                    total_records += records
-                    successful_symbols.append(symbol)
-                else:
-                    logger.error(f"Failed to fetch data for {symbol}")
-                    failed_symbols.append(symbol)
-                
-                # Rate limiting - Alpha Vantage has 5 API requests per minute limit
-                time.sleep(12)  # Wait 12 seconds between requests
-                
-            except Exception as e:
-                logger.error(f"Error processing {symbol}: {e}")
-                failed_symbols.append(symbol)
+        try:
+            for symbol in symbols:
+                try:
+                    logger.info(f"Processing symbol: {symbol}")
+                    mark = marks.get(symbol)
+                    outputsize = watermark.output_size(mark, timedelta(days=1))
+                    if self.stream_batch_rows > 0:
+                        for bars in self.iter_stock_batches(symbol, outputsize):
+                            rows, skipped = watermark.since(bars, mark)
+                            self._collect(writer.add(symbol, rows, skipped), summary)
+                        continue
+                    time_series = self.fetch_stock_data(symbol, outputsize)
+                    
+                    if time_series:
+                        rows, skipped = watermark.since(self.daily_rows(symbol, time_series), mark)
+                        self._collect(writer.add(symbol, rows, skipped), summary)
+                    else:
+                        logger.error(f"Failed to fetch data for {symbol}")
+                        summary['failed_symbols'].append(symbol)
+                    
+                except Exception as e:
+                    logger.error(f"Error processing {symbol}: {e}")
+                    if symbol not in summary['failed_symbols']:
+                        summary['failed_symbols'].append(symbol)
+        finally:
+            self._collect(writer.close(), summary)
         
-        logger.info(f"Data fetch completed. Total records: {total_records}")
-        logger.info(f"Successful symbols: {successful_symbols}")
-        if failed_symbols:
-            logger.warning(f"Failed symbols: {failed_symbols}")
+        logger.info(
+            f"Data fetch completed. Total records: {summary['total_records']} "
+            f"({summary['new_records']} new, {summary['changed_records']} changed, "
+            f"{summary['skipped_records']} skipped)"
+        )
+        logger.info(f"Successful symbols: {summary['successful_symbols']}")
+        if summary['failed_symbols']:
+            logger.warning(f"Failed symbols: {summary['failed_symbols']}")
         
-        return {
-            'total_records': total_records,
-            'successful_symbols': successful_symbols,
-            'failed_symbols': failed_symbols
-        }
+        summary['report'] = started.report()
+        logger.info(f"Run report: {json.dumps(summary['report'])}")
+        metrics.export('worker')
+        return summary
 
 def main():
     """Main function to run the stock data fetcher."""
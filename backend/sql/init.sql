@@ -15,18 +15,131 @@ CREATE TABLE IF NOT EXISTS user_preferences (
 );
 
 
+-- Price tables are range-partitioned by month; app/partitions.py creates upcoming
+-- partitions and drops expired ones. Rows outside the prepared months land in the
+-- DEFAULT partition until their month is created.
+CREATE OR REPLACE FUNCTION create_month_partitions(parent TEXT, first_month DATE, last_month DATE)
+RETURNS VOID AS $$
+DECLARE
+    m DATE := date_trunc('month', first_month)::DATE;
+BEGIN
+    WHILE m <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            parent || '_p' || to_char(m, 'YYYYMM'), parent, m, (m + INTERVAL '1 month')::DATE
+        );
+        m := (m + INTERVAL '1 month')::DATE;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
 CREATE TABLE IF NOT EXISTS stock_prices (
-    id SERIAL PRIMARY KEY,
     symbol TEXT NOT NULL,
     ts TIMESTAMP NOT NULL,
     open DOUBLE PRECISION,
     high DOUBLE PRECISION,
     low DOUBLE PRECISION,
     close DOUBLE PRECISION,
-    volume BIGINT
+    adjusted_close DOUBLE PRECISION,
+    volume BIGINT,
+    PRIMARY KEY (symbol, ts)
+) PARTITION BY RANGE (ts);
+
+CREATE TABLE IF NOT EXISTS stock_prices_default PARTITION OF stock_prices DEFAULT;
+
+
+CREATE TABLE IF NOT EXISTS stocks (
+    id BIGSERIAL,
+    symbol VARCHAR(10) NOT NULL,
+    date DATE NOT NULL,
+    open NUMERIC(10, 2),
+    high NUMERIC(10, 2),
+    low NUMERIC(10, 2),
+    close NUMERIC(10, 2),
+    adjusted_close NUMERIC(10, 2),
+    volume BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol, date)
+) PARTITION BY RANGE (date);
+
+CREATE TABLE IF NOT EXISTS stocks_default PARTITION OF stocks DEFAULT;
+
+-- 1d / 1w / 1mo OHLCV rollups, refreshed by the ingestion writers (app/rollups.py).
+CREATE TABLE IF NOT EXISTS price_rollups (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    period_start TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume BIGINT,
+    bars INTEGER NOT NULL,
+    period_end TIMESTAMP NOT NULL,
+    PRIMARY KEY (symbol, resolution, period_start)
+);
+
+-- SMA/EMA/RSI/VWAP/volatility per bar, extended incrementally by the writers
+-- (app/indicators.py), one series per bar width (resolution: 5min, 60min).
+-- rsi_avg_gain/rsi_avg_loss carry the RSI state forward.
+CREATE TABLE IF NOT EXISTS price_indicators (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    ts TIMESTAMP NOT NULL,
+    sma_20 DOUBLE PRECISION,
+    ema_20 DOUBLE PRECISION,
+    rsi_14 DOUBLE PRECISION,
+    vwap DOUBLE PRECISION,
+    volatility_20 DOUBLE PRECISION,
+    rsi_avg_gain DOUBLE PRECISION,
+    rsi_avg_loss DOUBLE PRECISION,
+    PRIMARY KEY (symbol, resolution, ts)
+);
+
+-- Gaps and bad bars found by the writers' data-quality stage (app/quality.py);
+-- open findings make the next fetch reach back and refetch them.
+CREATE TABLE IF NOT EXISTS data_quality_findings (
+    source TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ts_from TIMESTAMP NOT NULL,
+    ts_to TIMESTAMP NOT NULL,
+    bars INTEGER NOT NULL,
+    detail TEXT,
+    detected_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    refetches INTEGER NOT NULL DEFAULT 0,
+    resolved_at TIMESTAMPTZ,
+    PRIMARY KEY (source, resolution, symbol, kind, ts_from)
+);
+CREATE INDEX IF NOT EXISTS data_quality_findings_open
+    ON data_quality_findings (source, resolution, symbol) WHERE resolved_at IS NULL;
+
+-- Newest bar per symbol, moved forward by the ingestion writers in the same
+-- transaction as the bars (app/latest.py).
+CREATE TABLE IF NOT EXISTS latest_quotes (
+    symbol TEXT PRIMARY KEY,
+    ts TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    adjusted_close DOUBLE PRECISION,
+    volume BIGINT,
+    prev_close DOUBLE PRECISION,
+    change_pct DOUBLE PRECISION,
+    source TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
 
+SELECT create_month_partitions('stock_prices', CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::DATE);
+SELECT create_month_partitions('stocks', CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::DATE);
+
+
 CREATE TABLE IF NOT EXISTS portfolios (
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     symbol TEXT NOT NULL,
@@ -36,6 +149,42 @@ CREATE TABLE IF NOT EXISTS portfolios (
     PRIMARY KEY (user_id, symbol)
 );
 
+-- Per-user valuation history appended by the valuation job (app/valuation.py).
+CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    as_of TIMESTAMPTZ NOT NULL,
+    market_value DOUBLE PRECISION NOT NULL,
+    cost_basis DOUBLE PRECISION NOT NULL,
+    unrealized_pnl DOUBLE PRECISION NOT NULL,
+    unrealized_pct DOUBLE PRECISION,
+    positions INTEGER NOT NULL,
+    unpriced INTEGER NOT NULL,
+    holdings JSONB NOT NULL,
+    PRIMARY KEY (user_id, as_of)
+);
+
+-- Page views per symbol and day (Go API) and the demand-driven scheduler's
+-- per-source refresh state (app/scheduler.py).
+CREATE TABLE IF NOT EXISTS symbol_views (
+    symbol TEXT NOT NULL,
+    day DATE NOT NULL,
+    views BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (symbol, day)
+);
+CREATE TABLE IF NOT EXISTS symbol_schedule (
+    source TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    tier TEXT,
+    score DOUBLE PRECISION,
+    last_attempt_at TIMESTAMPTZ,
+    last_refreshed_at TIMESTAMPTZ,
+    last_error TEXT,
+    PRIMARY KEY (source, symbol)
+);
+
+
+CREATE INDEX IF NOT EXISTS idx_stock_prices_ts
+    ON stock_prices(ts);
 
-CREATE INDEX IF NOT EXISTS idx_stock_prices_symbol_ts
-    ON stock_prices(symbol, ts DESC);
+CREATE INDEX IF NOT EXISTS idx_stocks_date
+    ON stocks(date);
@@ -0,0 +1,152 @@
+-- Convert stock_prices (by ts) and stocks (by date) into monthly range-partitioned
+-- tables. Retention then detaches/drops whole months (app/partitions.py) instead of
+-- running large DELETEs, and recent-data queries only scan recent partitions.
+--
+-- Existing rows are copied into partitions covering their full date range plus
+-- the next three months; a DEFAULT partition catches anything outside that.
+-- Safe to re-run: tables that are already partitioned are left alone.
+
+CREATE OR REPLACE FUNCTION create_month_partitions(parent TEXT, first_month DATE, last_month DATE)
+RETURNS VOID AS $$
+DECLARE
+    m DATE := date_trunc('month', first_month)::DATE;
+BEGIN
+    WHILE m <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            parent || '_p' || to_char(m, 'YYYYMM'), parent, m, (m + INTERVAL '1 month')::DATE
+        );
+        m := (m + INTERVAL '1 month')::DATE;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- stock_prices ---------------------------------------------------------------
+DO $$
+DECLARE
+    lo DATE;
+    hi DATE;
+    has_adjusted BOOLEAN;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('stock_prices')) THEN
+        RETURN;
+    END IF;
+
+    IF to_regclass('stock_prices') IS NOT NULL THEN
+        ALTER TABLE stock_prices RENAME TO stock_prices_legacy;
+        -- Free the constraint name for the new table's key.
+        ALTER TABLE stock_prices_legacy DROP CONSTRAINT IF EXISTS stock_prices_pkey;
+    END IF;
+
+    CREATE TABLE stock_prices (
+        symbol TEXT NOT NULL,
+        ts TIMESTAMP NOT NULL,
+        open DOUBLE PRECISION,
+        high DOUBLE PRECISION,
+        low DOUBLE PRECISION,
+        close DOUBLE PRECISION,
+        adjusted_close DOUBLE PRECISION,
+        volume BIGINT,
+        PRIMARY KEY (symbol, ts)
+    ) PARTITION BY RANGE (ts);
+    CREATE TABLE stock_prices_default PARTITION OF stock_prices DEFAULT;
+
+    IF to_regclass('stock_prices_legacy') IS NULL THEN
+        PERFORM create_month_partitions('stock_prices', CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::DATE);
+        RETURN;
+    END IF;
+
+    SELECT min(ts)::DATE, max(ts)::DATE INTO lo, hi FROM stock_prices_legacy;
+    PERFORM create_month_partitions(
+        'stock_prices',
+        LEAST(COALESCE(lo, CURRENT_DATE), CURRENT_DATE),
+        (GREATEST(COALESCE(hi, CURRENT_DATE), CURRENT_DATE) + INTERVAL '3 months')::DATE
+    );
+
+    -- Older deployments had no adjusted_close column and no (symbol, ts) key.
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'stock_prices_legacy' AND column_name = 'adjusted_close'
+    ) INTO has_adjusted;
+    EXECUTE format(
+        'INSERT INTO stock_prices (symbol, ts, open, high, low, close, adjusted_close, volume)
+         SELECT symbol, ts, open, high, low, close, %s, volume FROM stock_prices_legacy
+         ON CONFLICT (symbol, ts) DO NOTHING',
+        CASE WHEN has_adjusted THEN 'adjusted_close' ELSE 'NULL' END
+    );
+    DROP TABLE stock_prices_legacy;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_stock_prices_ts ON stock_prices(ts);
+
+-- stocks -------------------------------------------------------------------
+DROP VIEW IF EXISTS latest_stock_prices;
+
+DO $$
+DECLARE
+    lo DATE;
+    hi DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('stocks')) THEN
+        RETURN;
+    END IF;
+
+    IF to_regclass('stocks') IS NOT NULL THEN
+        ALTER TABLE stocks RENAME TO stocks_legacy;
+        ALTER TABLE stocks_legacy DROP CONSTRAINT IF EXISTS stocks_pkey;
+        DROP INDEX IF EXISTS idx_stocks_symbol, idx_stocks_date, idx_stocks_symbol_date;
+    END IF;
+
+    -- The partition key has to be part of every unique constraint, so (symbol, date)
+    -- becomes the primary key and id is kept as a plain sequence-backed column.
+    CREATE TABLE stocks (
+        id BIGSERIAL,
+        symbol VARCHAR(10) NOT NULL,
+        date DATE NOT NULL,
+        open NUMERIC(10, 2),
+        high NUMERIC(10, 2),
+        low NUMERIC(10, 2),
+        close NUMERIC(10, 2),
+        adjusted_close NUMERIC(10, 2),
+        volume BIGINT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (symbol, date)
+    ) PARTITION BY RANGE (date);
+    CREATE TABLE stocks_default PARTITION OF stocks DEFAULT;
+
+    IF to_regclass('stocks_legacy') IS NULL THEN
+        PERFORM create_month_partitions('stocks', CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::DATE);
+        RETURN;
+    END IF;
+
+    SELECT min(date), max(date) INTO lo, hi FROM stocks_legacy;
+    PERFORM create_month_partitions(
+        'stocks',
+        LEAST(COALESCE(lo, CURRENT_DATE), CURRENT_DATE),
+        (GREATEST(COALESCE(hi, CURRENT_DATE), CURRENT_DATE) + INTERVAL '3 months')::DATE
+    );
+
+    INSERT INTO stocks (id, symbol, date, open, high, low, close, adjusted_close, volume, created_at, updated_at)
+    SELECT id, symbol, date, open, high, low, close, adjusted_close, volume, created_at, updated_at
+    FROM stocks_legacy
+    ON CONFLICT (symbol, date) DO NOTHING;
+    PERFORM setval(pg_get_serial_sequence('stocks', 'id'), GREATEST((SELECT max(id) FROM stocks), 1));
+    DROP TABLE stocks_legacy;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_stocks_date ON stocks(date);
+
+CREATE OR REPLACE VIEW latest_stock_prices AS
+SELECT DISTINCT ON (symbol)
+    symbol,
+    date,
+    open,
+    high,
+    low,
+    close,
+    adjusted_close,
+    volume,
+    updated_at
+FROM stocks
+ORDER BY symbol, date DESC;
@@ -0,0 +1,27 @@
+-- OHLCV rollups of stock_prices at 1d / 1w / 1mo. The ingestion writers keep them
+-- current by recomputing only the periods touched by each write (app/rollups.py);
+-- this migration builds them once for the history that already exists.
+CREATE TABLE IF NOT EXISTS price_rollups (
+    symbol TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    period_start TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    volume BIGINT,
+    bars INTEGER NOT NULL,
+    period_end TIMESTAMP NOT NULL,
+    PRIMARY KEY (symbol, resolution, period_start)
+);
+
+INSERT INTO price_rollups (symbol, resolution, period_start, open, high, low, close, volume, bars, period_end)
+SELECT p.symbol, r.resolution, date_trunc(r.unit, p.ts),
+       (array_agg(p.open ORDER BY p.ts) FILTER (WHERE p.open IS NOT NULL))[1],
+       max(p.high), min(p.low),
+       (array_agg(p.close ORDER BY p.ts DESC) FILTER (WHERE p.close IS NOT NULL))[1],
+       sum(p.volume), count(*), max(p.ts)
+FROM stock_prices p
+CROSS JOIN (VALUES ('1d', 'day'), ('1w', 'week'), ('1mo', 'month')) AS r(resolution, unit)
+GROUP BY p.symbol, r.resolution, date_trunc(r.unit, p.ts)
+ON CONFLICT (symbol, resolution, period_start) DO NOTHING;
@@ -0,0 +1,68 @@
+-- latest_quotes: one row per symbol with the newest bar, the previous day's close
+-- and the change against it. The ingestion writers keep it current in the same
+-- transaction as the bars (app/latest.py), so "current price" reads are a
+-- primary-key lookup instead of a DISTINCT ON / ORDER BY ts DESC LIMIT 1 scan.
+-- This migration seeds it from the intraday (stock_prices) and daily (stocks)
+-- tables; the newer bar wins.
+CREATE TABLE IF NOT EXISTS latest_quotes (
+    symbol TEXT PRIMARY KEY,
+    ts TIMESTAMP NOT NULL,
+    open DOUBLE PRECISION,
+    high DOUBLE PRECISION,
+    low DOUBLE PRECISION,
+    close DOUBLE PRECISION,
+    adjusted_close DOUBLE PRECISION,
+    volume BIGINT,
+    prev_close DOUBLE PRECISION,
+    change_pct DOUBLE PRECISION,
+    source TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO latest_quotes AS q (symbol, ts, open, high, low, close, adjusted_close, volume, prev_close, change_pct, source)
+SELECT b.symbol, b.ts, b.open, b.high, b.low, b.close, b.adjusted_close, b.volume, pc.close,
+       CASE WHEN pc.close <> 0 THEN round(((b.close - pc.close) / pc.close * 100)::numeric, 4) END,
+       'stock_prices'
+FROM (
+    SELECT DISTINCT ON (symbol) symbol, ts AS ts, open::float8, high::float8, low::float8, close::float8,
+           adjusted_close::float8, volume
+    FROM stock_prices ORDER BY symbol, ts DESC
+) b
+LEFT JOIN LATERAL (
+    SELECT close::float8 AS close FROM stock_prices p
+    WHERE p.symbol = b.symbol AND p.ts < date_trunc('day', b.ts)
+    ORDER BY ts DESC LIMIT 1
+) pc ON true
+ON CONFLICT (symbol) DO UPDATE SET
+    ts = EXCLUDED.ts, open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+    close = EXCLUDED.close, adjusted_close = EXCLUDED.adjusted_close, volume = EXCLUDED.volume,
+    prev_close = EXCLUDED.prev_close, change_pct = EXCLUDED.change_pct, source = EXCLUDED.source,
+    updated_at = now()
+WHERE q.ts < EXCLUDED.ts;
+
+INSERT INTO latest_quotes AS q (symbol, ts, open, high, low, close, adjusted_close, volume, prev_close, change_pct, source)
+SELECT b.symbol, b.ts, b.open, b.high, b.low, b.close, b.adjusted_close, b.volume, pc.close,
+       CASE WHEN pc.close <> 0 THEN round(((b.close - pc.close) / pc.close * 100)::numeric, 4) END,
+       'stocks'
+FROM (
+    SELECT DISTINCT ON (symbol) symbol, date AS ts, open::float8, high::float8, low::float8, close::float8,
+           adjusted_close::float8, volume
+    FROM stocks ORDER BY symbol, date DESC
+) b
+LEFT JOIN LATERAL (
+    SELECT close::float8 AS close FROM stocks p
+    WHERE p.symbol = b.symbol AND p.date < date_trunc('day', b.ts)
+    ORDER BY date DESC LIMIT 1
+) pc ON true
+ON CONFLICT (symbol) DO UPDATE SET
+    ts = EXCLUDED.ts, open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+    close = EXCLUDED.close, adjusted_close = EXCLUDED.adjusted_close, volume = EXCLUDED.volume,
+    prev_close = EXCLUDED.prev_close, change_pct = EXCLUDED.change_pct, source = EXCLUDED.source,
+    updated_at = now()
+WHERE q.ts < EXCLUDED.ts;
+
+-- Serve the view from the maintained table instead of sorting stocks.
+DROP VIEW IF EXISTS latest_stock_prices;
+CREATE VIEW latest_stock_prices AS
+SELECT symbol, ts::date AS date, open, high, low, close, adjusted_close, volume, updated_at
+FROM latest_quotes;
@@ -0,0 +1,16 @@
+-- portfolio_snapshots: one row per user per valuation run (app/valuation.py).
+-- The job revalues only the users holding symbols that changed in an ingestion
+-- run. The admin view reads the newest row per user, and /portfolio/history
+-- reads the series.
+CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    as_of TIMESTAMPTZ NOT NULL,
+    market_value DOUBLE PRECISION NOT NULL,
+    cost_basis DOUBLE PRECISION NOT NULL,
+    unrealized_pnl DOUBLE PRECISION NOT NULL,
+    unrealized_pct DOUBLE PRECISION,
+    positions INTEGER NOT NULL,
+    unpriced INTEGER NOT NULL,
+    holdings JSONB NOT NULL,
+    PRIMARY KEY (user_id, as_of)
+);
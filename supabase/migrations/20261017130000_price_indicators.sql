@@ -0,0 +1,16 @@
+-- price_indicators: technical indicators per stock_prices bar, extended by the
+-- ingestion writers in the same transaction as the bars (app/indicators.py).
+-- Existing history is filled on first write for each symbol, or up front with:
+--   python -m app.indicators --symbols AAPL,MSFT
+CREATE TABLE IF NOT EXISTS price_indicators (
+    symbol TEXT NOT NULL,
+    ts TIMESTAMP NOT NULL,
+    sma_20 DOUBLE PRECISION,
+    ema_20 DOUBLE PRECISION,
+    rsi_14 DOUBLE PRECISION,
+    vwap DOUBLE PRECISION,
+    volatility_20 DOUBLE PRECISION,
+    rsi_avg_gain DOUBLE PRECISION,
+    rsi_avg_loss DOUBLE PRECISION,
+    PRIMARY KEY (symbol, ts)
+);
@@ -0,0 +1,20 @@
+-- data_quality_findings: missing bars, non-positive prices, high/low
+-- inconsistencies and price spikes found in each newly written range by the
+-- ingestion writers (app/quality.py). Open findings are refetched by the next
+-- run (up to QUALITY_MAX_REFETCHES times) and resolved once a re-check passes.
+CREATE TABLE IF NOT EXISTS data_quality_findings (
+    source TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ts_from TIMESTAMP NOT NULL,
+    ts_to TIMESTAMP NOT NULL,
+    bars INTEGER NOT NULL,
+    detail TEXT,
+    detected_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    refetches INTEGER NOT NULL DEFAULT 0,
+    resolved_at TIMESTAMPTZ,
+    PRIMARY KEY (source, symbol, kind, ts_from)
+);
+CREATE INDEX IF NOT EXISTS data_quality_findings_open
+    ON data_quality_findings (source, symbol) WHERE resolved_at IS NULL;
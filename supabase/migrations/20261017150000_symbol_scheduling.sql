@@ -0,0 +1,20 @@
+-- symbol_views: page views per symbol and day, counted by the Go API
+-- (GET /stocks/{symbol}). symbol_schedule: per-source refresh state of the
+-- demand-driven scheduler (app/scheduler.py, SYMBOL_SOURCE=demand), which
+-- ranks watched, held and viewed symbols into refresh tiers.
+CREATE TABLE IF NOT EXISTS symbol_views (
+    symbol TEXT NOT NULL,
+    day DATE NOT NULL,
+    views BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (symbol, day)
+);
+CREATE TABLE IF NOT EXISTS symbol_schedule (
+    source TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    tier TEXT,
+    score DOUBLE PRECISION,
+    last_attempt_at TIMESTAMPTZ,
+    last_refreshed_at TIMESTAMPTZ,
+    last_error TEXT,
+    PRIMARY KEY (source, symbol)
+);
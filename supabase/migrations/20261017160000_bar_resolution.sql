@@ -0,0 +1,21 @@
+-- Bar width (resolution: 5min, 60min, 1d) in the keys of price_indicators and
+-- data_quality_findings. stock_prices holds 5min bars (app/fetch_and_upsert.py)
+-- next to the etl writer's ETL_INTERVAL bars; without it the two writers
+-- overwrote each other's indicators and resolved each other's findings.
+-- Existing indicator rows mixed both series: they are dropped and rebuilt on
+-- each symbol's next write (or with python -m app.indicators --symbols ...).
+TRUNCATE price_indicators;
+ALTER TABLE price_indicators ADD COLUMN IF NOT EXISTS resolution TEXT NOT NULL;
+ALTER TABLE price_indicators DROP CONSTRAINT IF EXISTS price_indicators_pkey;
+ALTER TABLE price_indicators ADD PRIMARY KEY (symbol, resolution, ts);
+
+-- Existing findings: daily ones are 1d, intraday ones the etl default (60min).
+ALTER TABLE data_quality_findings ADD COLUMN IF NOT EXISTS resolution TEXT;
+UPDATE data_quality_findings SET resolution = CASE WHEN source = 'stocks' THEN '1d' ELSE '60min' END
+WHERE resolution IS NULL;
+ALTER TABLE data_quality_findings ALTER COLUMN resolution SET NOT NULL;
+ALTER TABLE data_quality_findings DROP CONSTRAINT IF EXISTS data_quality_findings_pkey;
+ALTER TABLE data_quality_findings ADD PRIMARY KEY (source, resolution, symbol, kind, ts_from);
+DROP INDEX IF EXISTS data_quality_findings_open;
+CREATE INDEX data_quality_findings_open
+    ON data_quality_findings (source, resolution, symbol) WHERE resolved_at IS NULL;